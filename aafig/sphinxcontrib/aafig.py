@@ -12,6 +12,8 @@
     :license: BOLA, see LICENSE for details
 """
 
+import multiprocessing
+import os
 import posixpath
 from os import path
 try:
@@ -22,6 +24,7 @@ except ImportError:
 from docutils import nodes
 from docutils.parsers.rst.directives import images, nonnegative_int, flag
 
+import sphinx
 from sphinx.errors import SphinxError
 from sphinx.util import ensuredir, relative_uri
 from sphinx.util.compat import Directive
@@ -31,6 +34,11 @@ try:
 except ImportError:
     aafigure = None
 
+try:
+    from sphinxcontrib import rendercache
+except ImportError:
+    rendercache = None
+
 
 DEFAULT_FORMATS = dict(html='svg', latex='pdf', text=None)
 
@@ -130,18 +138,17 @@ def render_aafig_images(app, doctree):
             img.replace_self(nodes.literal_block(text, text))
             continue
         img['uri'] = fname
-        # FIXME: find some way to avoid this hack in aafigure
-        if extra:
-            (width, height) = [x.split('"')[1] for x in extra.split()]
-            if not img.has_key('width'):
-                img['width'] = width
-            if not img.has_key('height'):
-                img['height'] = height
+        img.aafig['outfn'] = outfn
 
 
 def render_aafigure(app, text, options):
     """
     Render an ASCII art figure into the requested format output file.
+
+    Unless ``aafig_workers`` is 0 the figure is only submitted to the pool
+    of worker processes, and it is complete once ``env-updated`` is
+    emitted; the size attributes are then read back by
+    `resolve_aafig_images`.
     """
 
     if aafigure is None:
@@ -163,49 +170,192 @@ def render_aafigure(app, text, options):
                     'the future' % app.builder.format)
         relfn = fname
         outfn = path.join(app.builder.outdir, fname)
-    metadata_fname = '%s.aafig' % outfn
 
-    try:
-        if path.isfile(outfn):
-            extra = None
-            if options['format'].lower() == 'svg':
-                f = None
-                try:
-                    try:
-                        f = file(metadata_fname, 'r')
-                        extra = f.read()
-                    except:
-                        raise AafigError()
-                finally:
-                    if f is not None:
-                        f.close()
-            return relfn, outfn, id, extra
-    except AafigError:
-        pass
+    outfns = get_outfns(outfn, options)
+    key = None
+    cache = rendercache and rendercache.get_cache(app.builder)
+    if cache:
+        key = cache.make_key('aafig', aafigure.__file__, text,
+                             sorted(options.items()))
+        if not path.isfile(outfn):
+            cache.fetch(key, *outfns)
+
+    if all(path.isfile(fn) for fn in outfns):
+        return relfn, outfn, id, read_extra(outfn, options)
 
     ensuredir(path.dirname(outfn))
 
+    job = (text, outfn, options, key)
+    if not get_aafig_workers(app.builder.config):
+        extra = render_aafig_file(text, outfn, options)
+        if cache:
+            cache.store(key, *outfns)
+        return relfn, outfn, id, extra
+
+    env = app.builder.env
+    if not hasattr(env, 'aafig_jobs'):
+        env.aafig_jobs = {}
+    env.aafig_jobs.setdefault(env.docname, {})[outfn] = job
+    submit_aafig_job(app.builder, job)
+    return relfn, outfn, id, None
+
+
+def get_outfns(outfn, options):
+    outfns = [outfn]
+    if options['format'].lower() == 'svg':
+        outfns.append('%s.aafig' % outfn)
+    return outfns
+
+
+def read_extra(outfn, options):
+    if options['format'].lower() != 'svg':
+        return None
+    f = None
+    try:
+        try:
+            f = file('%s.aafig' % outfn, 'r')
+            return f.read()
+        except IOError:
+            return None
+    finally:
+        if f is not None:
+            f.close()
+
+
+def render_aafig_file(text, outfn, options):
+    """Render a figure to outfn, also run in the worker processes"""
     try:
         (visitor, output) = aafigure.render(text, outfn, options)
-	output.close()
+        output.close()
     except aafigure.UnsupportedFormatError, e:
         raise AafigError(str(e))
 
     extra = None
     if options['format'].lower() == 'svg':
         extra = visitor.get_size_attrs()
-        f = file(metadata_fname, 'w')
+        f = file('%s.aafig' % outfn, 'w')
         f.write(extra)
         f.close()
+    return extra
+
 
-    return relfn, outfn, id, extra
+def get_aafig_workers(config):
+    workers = config.aafig_workers
+    if workers is None:
+        try:
+            workers = multiprocessing.cpu_count()
+        except NotImplementedError:
+            workers = 1
+    return int(workers)
+
+
+def init_aafig_pool(app):
+    app.builder._aafig_pool = None
+    app.builder._aafig_pid = os.getpid()
+    app.builder._aafig_results = {}
+
+
+def submit_aafig_job(builder, job):
+    # Documents read in parallel are read by forked processes, which cannot
+    # use the pool: their jobs are merged into the environment and
+    # submitted by wait_aafig_images.
+    if os.getpid() != builder._aafig_pid:
+        return
+    text, outfn, options, key = job
+    if outfn in builder._aafig_results:
+        return
+    if builder._aafig_pool is None:
+        builder._aafig_pool = multiprocessing.Pool(
+            get_aafig_workers(builder.config))
+    result = builder._aafig_pool.apply_async(render_aafig_file,
+                                             (text, outfn, options))
+    builder._aafig_results[outfn] = (result, job)
+
+
+def purge_aafig_jobs(app, env, docname):
+    if hasattr(env, 'aafig_jobs'):
+        env.aafig_jobs.pop(docname, None)
+
+
+def merge_aafig_jobs(app, env, docnames, other):
+    if not hasattr(other, 'aafig_jobs'):
+        return
+    if not hasattr(env, 'aafig_jobs'):
+        env.aafig_jobs = {}
+    for docname in docnames:
+        if docname in other.aafig_jobs:
+            env.aafig_jobs[docname] = other.aafig_jobs[docname]
+
+
+def wait_aafig_images(app, env):
+    """Block until all figures submitted to the pool are rendered"""
+    builder = app.builder
+    for docname in sorted(getattr(env, 'aafig_jobs', {})):
+        for outfn, job in sorted(env.aafig_jobs[docname].items()):
+            if not path.isfile(outfn):
+                submit_aafig_job(builder, job)
+
+    results = builder._aafig_results
+    builder._aafig_results = {}
+    try:
+        if results:
+            app.info('waiting for %d aafig images... ' % len(results),
+                     nonl=True)
+            cache = rendercache and rendercache.get_cache(builder)
+            for outfn, (result, job) in sorted(results.items()):
+                text, outfn, options, key = job
+                try:
+                    result.get()
+                except AafigError, exc:
+                    builder.warn('aafigure error: ' + str(exc))
+                    continue
+                except Exception, exc:
+                    builder.warn('aafigure failed to render %s: %s'
+                                 % (outfn, exc))
+                    continue
+                if cache and key:
+                    cache.store(key, *get_outfns(outfn, options))
+            app.info('done')
+    finally:
+        if builder._aafig_pool is not None:
+            builder._aafig_pool.close()
+            builder._aafig_pool.join()
+            builder._aafig_pool = None
+
+
+def resolve_aafig_images(app, doctree, docname):
+    for img in doctree.traverse(nodes.image):
+        if not hasattr(img, 'aafig') or 'outfn' not in img.aafig:
+            continue
+        outfn = img.aafig['outfn']
+        if not path.isfile(outfn):
+            # rendering failed, show the ASCII art as is
+            text = img.aafig['text']
+            img.replace_self(nodes.literal_block(text, text))
+            continue
+        extra = read_extra(outfn, img.aafig['options'])
+        # FIXME: find some way to avoid this hack in aafigure
+        if extra:
+            (width, height) = [x.split('"')[1] for x in extra.split()]
+            if not img.has_key('width'):
+                img['width'] = width
+            if not img.has_key('height'):
+                img['height'] = height
 
 
 def setup(app):
     app.add_directive('aafig', AafigDirective)
+    app.connect('builder-inited', init_aafig_pool)
     app.connect('doctree-read', render_aafig_images)
+    app.connect('env-purge-doc', purge_aafig_jobs)
+    if sphinx.version_info >= (1, 3):
+        app.connect('env-merge-info', merge_aafig_jobs)
+    app.connect('env-updated', wait_aafig_images)
+    app.connect('doctree-resolved', resolve_aafig_images)
     app.add_config_value('aafig_format', DEFAULT_FORMATS, 'html')
     app.add_config_value('aafig_default_options', dict(), 'html')
+    app.add_config_value('aafig_workers', None, '')
+    return {'parallel_read_safe': True}
 
 
 # vim: set expandtab shiftwidth=4 softtabstop=4 :
@@ -5,12 +5,19 @@ import xml.etree.ElementTree as ET
 import urlparse
 import re
 import itertools
+import marshal
+import mmap
+import struct
+try:
+	from hashlib import sha1 as sha
+except ImportError:
+	from sha import sha
 
 from docutils import nodes, utils
 from sphinx.util.nodes import split_explicit_title
 from sphinx.util.console import bold, standout
 
-from parsing import normalise, ParseException
+from parsing import normalise, normalise_list, ParseException
 
 def find_url(doc, symbol):
 	"""
@@ -76,6 +83,35 @@ def find_url(doc, symbol):
 	
 	return None
 
+def iter_compounds(doc):
+	"""
+	Yield the top-level ``<compound>`` elements of a tag file.
+	
+	If a file is given, it is parsed incrementally and every compound is cleared once the caller is done with it, so the whole DOM of the tag file is never held in memory.
+	
+	:Parameters:
+		doc : xml.etree.ElementTree or string
+			The XML DOM object, or the file name of the tag file
+	"""
+	if hasattr(doc, 'findall'):
+		for compound in doc.findall("./compound"):
+			yield compound
+		return
+	
+	root = None
+	depth = 0
+	for event, element in ET.iterparse(doc, events=('start', 'end')):
+		if event == 'start':
+			if root is None:
+				root = element
+			depth += 1
+			continue
+		depth -= 1
+		if depth == 1 and element.tag == 'compound':
+			yield element
+			#Drop the compound, and any text or elements seen before it, from the root
+			root.clear()
+
 def parse_tag_file(doc):
 	"""
 	Takes in an XML tree from a Doxygen tag file and returns a dictionary that looks something like:
@@ -111,15 +147,15 @@ def parse_tag_file(doc):
 			url = symbol_mapping['file']
 	
 	:Parameters:
-		doc : xml.etree.ElementTree
-			The XML DOM object
+		doc : xml.etree.ElementTree or string
+			The XML DOM object, or the file name of the tag file which is then parsed incrementally, see :py:func:`iter_compounds`
 	
 	:return: a dictionary mapping fully qualified symbols to files
 	"""
 	
 	mapping = {}
 	function_list = [] #This is a list of function to be parsed and inserted into mapping at the end of the function.
-	for compound in doc.findall("./compound"):
+	for compound in iter_compounds(doc):
 		compound_kind = compound.get('kind')
 		if compound_kind != 'namespace' and compound_kind != 'class' and compound_kind!= 'struct' and compound_kind != 'file':
 			continue #Skip everything that isn't a namespace, class, struct or file
@@ -150,7 +186,7 @@ def parse_tag_file(doc):
 			else:
 				mapping[member_symbol] = {'kind' : member.get('kind'), 'file' : join(anchorfile,'#',member.findtext('anchor'))}
 	
-	for old_tuple, normalised_tuple in zip(function_list, itertools.imap(normalise, (member_tuple[1] for member_tuple in function_list))):
+	for old_tuple, normalised_tuple in zip(function_list, normalise_list([member_tuple[1] for member_tuple in function_list])):
 		member_symbol = old_tuple[0]
 		original_arglist = old_tuple[1]
 		kind = old_tuple[2]
@@ -167,6 +203,199 @@ def parse_tag_file(doc):
 	#from pprint import pprint; pprint(mapping)
 	return mapping
 
+def strip_templates(symbol):
+	"""
+	Remove the template arguments from a symbol, so ``PolyVox::Array< 1, ElementType >::operator[]`` becomes ``PolyVox::Array::operator[]``
+	"""
+	if '<' not in symbol:
+		return symbol
+	stripped = []
+	depth = 0
+	for char in symbol:
+		if char == '<':
+			depth += 1
+		elif char == '>' and depth:
+			depth -= 1
+		elif not depth:
+			stripped.append(char)
+	return ''.join(stripped).replace(' ::', '::').strip()
+
+#The kinds of compounds in a mapping returned by parse_tag_file, all other kinds are members
+COMPOUND_KINDS = ('namespace', 'class', 'struct', 'file')
+
+class SymbolIndex(object):
+	"""
+	An index over a mapping returned by :py:func:`parse_tag_file` which is built once per tag file, so that looking up a symbol takes time proportional to the length of the symbol (and the number of matches) rather than to the size of the mapping.
+	
+	It consists of:
+	
+	* the mapping itself, for exact matches
+	* a trie over the reversed ``::`` components of all symbols, so that the symbols ending in the requested one (and those the requested one ends in) are found by walking the components of the requested symbol, see :py:func:`find_url_piecewise`
+	* in each node of the trie, the symbols bucketed by kind, so that preferring classes does not need to look at every candidate
+	* a second trie over the symbols with their template arguments stripped, which is only used if nothing else matched
+	
+	Each trie node is a list of ``[children, symbols ending at this node, symbols below this node]``, the latter two being dictionaries of kind to list of symbols.
+	"""
+	
+	def __init__(self, mapping):
+		"""
+		:Parameters:
+			mapping : dictionary or MappingFile
+				A dictionary of the form returned by :py:func:`parse_tag_file`, or the same read from a mapping file
+		"""
+		self.mapping = mapping
+		self.trie = [{}, {}, {}]
+		self.alias_trie = [{}, {}, {}]
+		if isinstance(mapping, MappingFile):
+			kinds = mapping.iterkinds()
+		else:
+			kinds = ((symbol, mapping[symbol]['kind']) for symbol in mapping)
+		for symbol, kind in sorted(kinds):
+			self._insert(self.trie, symbol, symbol, kind)
+			stripped = strip_templates(symbol)
+			if stripped != symbol:
+				self._insert(self.alias_trie, stripped, symbol, kind)
+	
+	@staticmethod
+	def _insert(trie, key, symbol, kind):
+		node = trie
+		for part in reversed(key.split('::')):
+			node = node[0].setdefault(part, [{}, {}, {}])
+			node[2].setdefault(kind, []).append(symbol)
+		node[1].setdefault(kind, []).append(symbol)
+	
+	@staticmethod
+	def _find(trie, symbol):
+		"""
+		Return the symbols matching the requested one reverse piecewise, bucketed by kind
+		"""
+		found = {}
+		parts = symbol.split('::')
+		parts.reverse()
+		node = trie
+		for depth, part in enumerate(parts):
+			node = node[0].get(part)
+			if node is None:
+				return found
+			#Symbols which are shorter than the requested one are matched if they end here
+			buckets = node[1] if depth < len(parts) - 1 else node[2]
+			for kind, symbols in buckets.iteritems():
+				found.setdefault(kind, []).extend(symbols)
+		return found
+	
+	def find_piecewise(self, symbol):
+		"""
+		Return the symbols matching the requested one reverse piecewise, bucketed by kind. See :py:func:`find_url_piecewise`.
+		"""
+		found = self._find(self.trie, symbol)
+		if not found:
+			found = self._find(self.alias_trie, strip_templates(symbol))
+		return found
+	
+	def find_exact(self, symbol, normalised_arglist=''):
+		"""
+		Return the mapping entry for a symbol of exactly this name, or None. The symbol is not normalised, so this also finds symbols which cannot be parsed.
+		"""
+		entry = self.mapping.get(symbol)
+		if entry:
+			return return_from_mapping(entry, normalised_arglist)
+		return None
+	
+	@staticmethod
+	def _node(trie, symbol):
+		"""
+		Return the trie node of exactly this symbol, or None
+		"""
+		node = trie
+		for part in reversed(symbol.split('::')):
+			node = node[0].get(part)
+			if node is None:
+				return None
+		return node
+	
+	@staticmethod
+	def _first(buckets, compounds):
+		"""
+		Return the first of the symbols of compound kinds (or of the other kinds) in buckets, preferring names without templates
+		"""
+		symbols = sorted(itertools.chain(*[symbols for kind, symbols in buckets.iteritems() if (kind in COMPOUND_KINDS) == compounds]))
+		no_templates = [item for item in symbols if '<' not in item]
+		if no_templates:
+			return no_templates[0]
+		if symbols:
+			return symbols[0]
+		return None
+	
+	def _find_like_tag_file(self, trie, symbol):
+		"""
+		Return the symbol :py:func:`find_url` would match, or None
+		"""
+		node = self._node(trie, symbol)
+		if node is None:
+			return None
+		#An exact match, of a compound or of a member of a compound
+		found = self._first(node[1], True) or self._first(node[1], False)
+		if found:
+			return found
+		#A compound with the first namespace stripped off, so that 'ArraySizes' matches 'PolyVox::ArraySizes'
+		for part, child in sorted(node[0].iteritems()):
+			found = self._first(child[1], True)
+			if found:
+				return found
+		#A member by its unqualified name
+		if '::' not in symbol:
+			return self._first(node[2], False)
+		return None
+	
+	def find_unparsed(self, symbol):
+		"""
+		Return the mapping entry for a symbol which cannot be normalised, or None.
+		
+		This does the lookups :py:func:`find_url` did on the tag file, on the symbols and then on the symbols with their template arguments stripped. If nothing is found and the symbol has an argument list, the function name in front of it is looked up like :py:meth:`find` does.
+		"""
+		found = self._find_like_tag_file(self.trie, symbol) or self._find_like_tag_file(self.alias_trie, strip_templates(symbol))
+		if found:
+			return return_from_mapping(self.mapping[found])
+		start = symbol.find('operator()')
+		start = symbol.find('(', start + len('operator()') if start >= 0 else 0)
+		if start > 0:
+			return self.find(symbol[:start].rstrip())
+		return None
+	
+	def find(self, symbol, normalised_arglist=''):
+		"""
+		Return the mapping entry for a normalised symbol, like :py:func:`find_url2` does. Returns None if there is no match.
+		"""
+		#If we have an exact match then return it.
+		url = self.find_exact(symbol, normalised_arglist)
+		if url:
+			return url
+		
+		buckets = self.find_piecewise(symbol)
+		
+		#If there is only one match, return it.
+		candidates = sorted(itertools.chain(*buckets.values()))
+		if len(candidates) == 1:
+			return return_from_mapping(self.mapping[candidates[0]], normalised_arglist)
+		
+		#If there is more than one match then there is an ambiguity
+		#Often this is due to the symbol matching the name of the constructor as well as the class name itself
+		classes = sorted(buckets.get('class', []))
+		if len(classes) == 1:
+			return self.mapping[classes[0]]
+		
+		#If we exhaused the list by requiring classes, use the list from before the filter.
+		if classes:
+			candidates = classes
+		
+		#Ignore templated names, see find_url_remove_templates
+		no_templates = [item for item in candidates if '<' not in item]
+		
+		#If not found by now, just return the first one in the list
+		if no_templates:
+			return return_from_mapping(self.mapping[no_templates[0]], normalised_arglist)
+		return None
+
 def find_url2(mapping, symbol):
 	"""
 	Return the URL for a given symbol.
@@ -178,8 +407,8 @@ def find_url2(mapping, symbol):
 		Maybe print a list of all possible matches as a warning (but still only return the first)
 	
 	:Parameters:
-		mapping : dictionary
-			A dictionary of the form returned by :py:func:`parse_tag_file`
+		mapping : dictionary or SymbolIndex
+			A dictionary of the form returned by :py:func:`parse_tag_file`, or a :py:class:`SymbolIndex` of it. Pass an index when looking up many symbols, as indexing the dictionary takes time proportional to its size.
 		symbol : string
 			The symbol to lookup in the file. E.g. something like 'PolyVox::Array' or 'tidyUpMemory'
 	
@@ -189,70 +418,132 @@ def find_url2(mapping, symbol):
 		LookupError
 			Raised if the symbol could not be matched in the file
 	"""
-	#print "\n\nSearching for", symbol
 	try:
 		symbol, normalised_arglist =  normalise(symbol)
 	except ParseException as error:
 		raise LookupError(error)
-	#print symbol, normalised_arglist
-	
-	#If we have an exact match then return it.
-	if mapping.get(symbol):
-		#print ('Exact match')
-		return return_from_mapping(mapping[symbol], normalised_arglist)
-	
-	#If the user didn't pass in any arguments, i.e. `arguments == ''` then they don't care which version of the overloaded funtion they get.
-	
-	#First we check for any mapping entries which even slightly match the requested symbol
-	#endswith_list = {}
-	#for item, data in mapping.items():
-	#	if item.endswith(symbol):
-			#print symbol + ' : ' + item
-	#		endswith_list[item] = data
-	#		mapping[item]['file']
-	
-	#If we only find one then we return it.
-	#if len(endswith_list) is 1:
-	#	return endswith_list.values()[0]['file']
-	
-	#print("Still", len(endswith_list), 'possible matches')
-	
-	piecewise_list = find_url_piecewise(mapping, symbol)
-	
-	#If there is only one match, return it.
-	if len(piecewise_list) is 1:
-		return return_from_mapping(piecewise_list.values()[0], normalised_arglist)
-	
-	#print("Still", len(piecewise_list), 'possible matches')
-	
-	#If there is more than one item in piecewise_list then there is an ambiguity
-	#Often this is due to the symbol matching the name of the constructor as well as the class name itself
-	classes_list = find_url_classes(piecewise_list, symbol)
+	if normalised_arglist is None:
+		#normalise returns the error in place of the symbol
+		raise LookupError(symbol)
 	
-	#If there is only one by here we return it.
-	if len(classes_list) is 1:
-		return classes_list.values()[0]
-	
-	#print("Still", len(classes_list), 'possible matches')
+	if not isinstance(mapping, SymbolIndex):
+		mapping = SymbolIndex(mapping)
+	return mapping.find(symbol, normalised_arglist)
+
+MAPPING_FILE_MAGIC = 'doxylink-mapping-1\n'
+
+def write_mapping_file(filename, mapping, mtime, digest):
+	"""
+	Write a mapping returned by :py:func:`parse_tag_file` to a compact file which can be read back by :py:class:`MappingFile`.
 	
-	#If we exhaused the list by requiring classes, use the list from before the filter.
-	if len(classes_list) == 0:
-		classes_list = piecewise_list
+	The file starts with a table of all symbols, their kinds and the offsets of their entries, followed by the entries themselves. All of them are serialised with :py:mod:`marshal`.
 	
-	no_templates_list = find_url_remove_templates(classes_list, symbol)
+	:Parameters:
+		mtime : float
+			The modification time of the tag file the mapping was parsed from
+		digest : string
+			The SHA-1 hex digest of the tag file the mapping was parsed from
+	"""
+	symbols = sorted(mapping)
+	kinds = []
+	offsets = [0]
+	entries = []
+	for symbol in symbols:
+		entry = marshal.dumps(mapping[symbol])
+		kinds.append(mapping[symbol]['kind'])
+		offsets.append(offsets[-1] + len(entry))
+		entries.append(entry)
+	table = marshal.dumps((mtime, digest, symbols, kinds, offsets))
+	_write_mapping(filename, table, entries)
+
+def update_mapping_file(filename, mtime):
+	"""
+	Record a new modification time of the tag file in a mapping file written by :py:func:`write_mapping_file`, keeping its symbols and entries.
+	"""
+	mapping = MappingFile(filename)
+	try:
+		table = marshal.dumps((mtime, mapping.digest, mapping.symbols, mapping.kinds, mapping.offsets))
+		entries = [mapping.data[mapping.base:]]
+	finally:
+		mapping.close()
+	_write_mapping(filename, table, entries)
+
+def _write_mapping(filename, table, entries):
+	temp_filename = filename + '.tmp'
+	f = open(temp_filename, 'wb')
+	try:
+		f.write(MAPPING_FILE_MAGIC)
+		f.write(struct.pack('<Q', len(table)))
+		f.write(table)
+		f.writelines(entries)
+	finally:
+		f.close()
+	try:
+		os.rename(temp_filename, filename)
+	except OSError:
+		#Windows does not replace existing files
+		os.remove(filename)
+		os.rename(temp_filename, filename)
+
+class MappingFile(object):
+	"""
+	A read-only, dictionary-like view of a mapping written by :py:func:`write_mapping_file`.
 	
-	if len(no_templates_list) is 1:
-		return return_from_mapping(no_templates_list.values()[0], normalised_arglist)
+	The file is memory-mapped and only the table of symbols is loaded, each entry is read when it is looked up.
 	
-	#print("Still", len(no_templates_list), 'possible matches')
+	:raises:
+		ValueError
+			Raised if the file is not a mapping file of this version
+	"""
 	
-	#If not found by now, just return the first one in the list
-	if len(no_templates_list) != 0:
-		#TODO return a warning here?
-		return return_from_mapping(no_templates_list.values()[0], normalised_arglist)
-	#Else return None if the list is empty
-	else:
-		LookupError('Could not find a match')
+	def __init__(self, filename):
+		self.file = open(filename, 'rb')
+		try:
+			self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+			start = len(MAPPING_FILE_MAGIC)
+			if self.data[:start] != MAPPING_FILE_MAGIC:
+				raise ValueError('%s is not a doxylink mapping file' % filename)
+			table_length, = struct.unpack('<Q', self.data[start:start + 8])
+			start += 8
+			self.mtime, self.digest, self.symbols, self.kinds, self.offsets = marshal.loads(self.data[start:start + table_length])
+		except (ValueError, EOFError, TypeError, struct.error, mmap.error):
+			self.close()
+			raise ValueError('%s is not a doxylink mapping file' % filename)
+		self.base = start + table_length
+		self.positions = dict(itertools.izip(self.symbols, itertools.count()))
+	
+	def close(self):
+		if getattr(self, 'data', None) is not None:
+			self.data.close()
+			self.data = None
+		self.file.close()
+	
+	def get(self, symbol, default=None):
+		position = self.positions.get(symbol)
+		if position is None:
+			return default
+		begin = self.base + self.offsets[position]
+		end = self.base + self.offsets[position + 1]
+		return marshal.loads(self.data[begin:end])
+	
+	def __getitem__(self, symbol):
+		entry = self.get(symbol)
+		if entry is None:
+			raise KeyError(symbol)
+		return entry
+	
+	def __contains__(self, symbol):
+		return symbol in self.positions
+	
+	def __iter__(self):
+		return iter(self.symbols)
+	
+	def __len__(self):
+		return len(self.symbols)
+	
+	def iterkinds(self):
+		"""Iterate over ``(symbol, kind)`` pairs without reading the entries"""
+		return itertools.izip(self.symbols, self.kinds)
 
 def return_from_mapping(mapping_entry, normalised_arglist=''):
 	"""
@@ -373,36 +664,66 @@ def find_url_remove_templates(mapping, symbol):
 def join(*args):
 	return ''.join(args)
 
+def hash_file(filename):
+	digest = sha()
+	f = open(filename, 'rb')
+	try:
+		for block in iter(lambda: f.read(1024 * 1024), ''):
+			digest.update(block)
+	finally:
+		f.close()
+	return digest.hexdigest()
+
+def load_mapping(app, tag_filename):
+	"""
+	Return the mapping of a tag file as a :py:class:`MappingFile`.
+	
+	The mapping file is kept in the doctree directory and it is only rebuilt if the tag file has changed, judging by its modification time or, if that differs, by its content.
+	"""
+	cache_name = os.path.basename(tag_filename)
+	mapping_filename = os.path.join(app.doctreedir, 'doxylink-%s-%s.mapping' % (cache_name, sha(os.path.abspath(tag_filename)).hexdigest()[:8]))
+	mtime = os.path.getmtime(tag_filename)
+	digest = None
+	
+	app.info(bold('Checking tag file cache for %s: ' % cache_name), nonl=True)
+	try:
+		mapping = MappingFile(mapping_filename)
+	except IOError:
+		app.info('No cache at all, rebuilding...')
+	except ValueError:
+		app.info('Cache is unreadable, rebuilding...')
+	else:
+		if mapping.mtime == mtime:
+			app.info('Sub-cache is up-to-date')
+			return mapping
+		#If only the modification time differs, e.g. because the tag file
+		#was generated again, the content tells whether it changed
+		digest = hash_file(tag_filename)
+		mapping.close()
+		if mapping.digest == digest:
+			app.info('Sub-cache is up-to-date')
+			update_mapping_file(mapping_filename, mtime)
+			return MappingFile(mapping_filename)
+		app.info('Sub-cache is out of date, rebuilding...')
+	
+	if digest is None:
+		digest = hash_file(tag_filename)
+	write_mapping_file(mapping_filename, parse_tag_file(tag_filename), mtime, digest)
+	return MappingFile(mapping_filename)
+
 def create_role(app, tag_filename, rootdir):
 	#Tidy up the root directory path
 	if not rootdir.endswith(('/', '\\')):
 		rootdir = join(rootdir, os.sep)
 	
+	#Mappings used to be stored in the environment
+	if hasattr(app.env, 'doxylink_cache'):
+		del app.env.doxylink_cache
+	
 	try:
-		tag_file = ET.parse(tag_filename)
-		
-		cache_name = os.path.basename(tag_filename)
-		
-		app.info(bold('Checking tag file cache for %s: ' % cache_name), nonl=True)
-		if not hasattr(app.env, 'doxylink_cache'):
-			# no cache present at all, initialise it
-			app.info('No cache at all, rebuilding...')
-			mapping = parse_tag_file(tag_file)
-			app.env.doxylink_cache = { cache_name : {'mapping' : mapping, 'mtime' : os.path.getmtime(tag_filename)}}
-		elif not app.env.doxylink_cache.get(cache_name):
-			# Main cache is there but the specific sub-cache for this tag file is not
-			app.info('Sub cache is missing, rebuilding...')
-			mapping = parse_tag_file(tag_file)
-			app.env.doxylink_cache[cache_name] = {'mapping' : mapping, 'mtime' : os.path.getmtime(tag_filename)}
-		elif app.env.doxylink_cache[cache_name]['mtime'] < os.path.getmtime(tag_filename):
-			# tag file has been modified since sub-cache creation
-			app.info('Sub-cache is out of date, rebuilding...')
-			mapping = parse_tag_file(tag_file)
-			app.env.doxylink_cache[cache_name] = {'mapping' : mapping, 'mtime' : os.path.getmtime(tag_filename)}
-		else:
-			#The cache is up to date
-			app.info('Sub-cache is up-to-date')
-	except IOError:
+		index = SymbolIndex(load_mapping(app, tag_filename))
+		tag_file = True
+	except (IOError, OSError):
 		tag_file = None
 		app.warn(standout('Could not open tag file %s. Make sure your `doxylink` config variable is set correctly.' % tag_filename))
 	
@@ -412,10 +733,12 @@ def create_role(app, tag_filename, rootdir):
 		has_explicit_title, title, part = split_explicit_title(text)
 		warning_messages = []
 		if tag_file:
-			url = find_url(tag_file, part)
+			url = None
 			try:
-				url = find_url2(app.env.doxylink_cache[cache_name]['mapping'], part)
+				url = find_url2(index, part)
 			except LookupError as error:
+				#Look it up like the tag file used to be
+				url = index.find_unparsed(part)
 				warning_messages.append('Error while parsing `%s`. Is not a well-formed C++ function call or symbol. If this is not the case, it is a doxylink bug so please report it. Error reported was: %s' % (part, error))
 			if url:
 				
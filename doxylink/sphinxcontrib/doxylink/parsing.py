@@ -1,5 +1,8 @@
-#import multiprocessing
+import multiprocessing
 import itertools
+import collections
+import functools
+import re
 
 from pyparsing import Word, Literal, alphas, nums, alphanums, OneOrMore, Optional, SkipTo, ParseException, Group, ZeroOrMore, Suppress, Combine, delimitedList, quotedString, nestedExpr, ParseResults, oneOf
 
@@ -59,10 +62,134 @@ argument = Group(argument_type('argument_type') + Optional(input_name) + Optiona
 #List of arguments in parentheses with an optional 'const' on the end
 arglist = LPAR + delimitedList(argument)('arg_list') + Optional(COMMA + '...')('var_args') + RPAR
 
+def lru_cache(maxsize):
+	"""
+	Memoize a function of a single hashable argument, keeping the results of the ``maxsize`` most recently used arguments.
+	
+	Like :py:func:`functools.lru_cache` in Python 3, the wrapper has a ``cache_info()`` method returning ``(hits, misses, maxsize, currsize)`` and a ``cache_clear()`` method.
+	"""
+	def decorator(function):
+		cache = collections.OrderedDict()
+		stats = [0, 0]
+		
+		def wrapper(argument):
+			try:
+				result = cache.pop(argument)
+			except KeyError:
+				stats[1] += 1
+				result = function(argument)
+				if len(cache) >= maxsize:
+					cache.popitem(last=False)
+			else:
+				stats[0] += 1
+			cache[argument] = result
+			return result
+		
+		def cache_clear():
+			cache.clear()
+			stats[:] = [0, 0]
+		
+		wrapper.cache_info = lambda: (stats[0], stats[1], maxsize, len(cache))
+		wrapper.cache_clear = cache_clear
+		return functools.update_wrapper(wrapper, function)
+	return decorator
+
+#The words the grammar tries to match as literals. These match the beginning of longer words as well (e.g. 'const' in 'constant') so the fast path leaves any such word to the grammar.
+literal_words = ('const', 'unsigned', 'typename', 'struct', 'enum')
+
+#A single simple argument: an optional qualifier, a type without templates, pointers, references and const, an optional name and an optional simple default value
+simple_argument = re.compile(r"""\s*(?:(const|unsigned|typename|struct|enum)\s+)?
+                                 ([A-Za-z0-9_:]+)\s*
+                                 ([*&]?)\s*
+                                 (const(?![A-Za-z0-9_]))?\s*
+                                 ([*&]?)\s*
+                                 ([A-Za-z0-9_]+)?\s*
+                                 (?:=\s*[-A-Za-z0-9_:.|&^][-A-Za-z0-9_:.|&^\s]*)?
+                                 \Z""", re.X)
+
+def tokenize_arglist(arglist_input_string):
+	"""
+	Normalise an argument list without the pyparsing grammar.
+	
+	This handles the most common shapes of argument lists, like ``(const QString & text, int index = 0)``. Anything else, e.g. templates, brackets or quotes in the arguments or default values, or variable arguments, is left to the grammar.
+	
+	:Parameters:
+		arglist_input_string : string
+			An argument list in parentheses, without anything after the closing one
+	
+	:return: the normalised argument list like :py:func:`normalise` returns it, or None if it has to be parsed by the grammar
+	"""
+	normalised_arg_list = []
+	for argument in arglist_input_string[1:-1].split(','):
+		match = simple_argument.match(argument)
+		if match is None:
+			return None
+		qualifier, input_type, pointer_or_reference1, const, pointer_or_reference2, name = match.groups()
+		if input_type.startswith(literal_words) or (name and not const and name.startswith(literal_words)):
+			return None
+		
+		#Build up the same normalised form as the grammar does, see normalise_parsed
+		argument_string_list = []
+		if qualifier:
+			argument_string_list.append(qualifier + ' ')
+		argument_string_list.append(input_type)
+		argument_string_list.append(pointer_or_reference1)
+		if const:
+			argument_string_list.append(' const ')
+		argument_string_list.append(pointer_or_reference2)
+		normalised_arg_list.append(''.join(argument_string_list))
+	
+	return ''.join(['(', ', '.join(normalised_arg_list), ')'])
+
+def normalise_parsed(arglist_input_string):
+	"""
+	Normalise an argument list with the pyparsing grammar.
+	
+	:raises:
+		ParseException
+			Raised if the argument list cannot be parsed
+	"""
+	result = arglist.parseString(arglist_input_string)
+	
+	#Will be a list or normalised string arguments
+	#e.g. ['OBMol&', 'vector< int >&', 'OBBitVec&', 'OBBitVec&', 'int', 'int']
+	normalised_arg_list = []
+	
+	#Cycle through all the matched arguments
+	for arg in result.arg_list:
+		#Here is where we build up our normalised form of the argument
+		argument_string_list = ['']
+		if arg.qualifier:
+			argument_string_list.append(''.join((arg.qualifier,' ')))
+		argument_string_list.append(arg.input_type)
+	
+		#Functions can have a funny combination of *, & and const between the type and the name so build up a list of theose here:
+		const_pointer_ref_list = []
+		const_pointer_ref_list.append(arg.pointer_or_reference1)
+		if arg.const_pointer_or_reference:
+			const_pointer_ref_list.append(''.join((' ', arg.const_pointer_or_reference, ' ')))
+		# same here
+		const_pointer_ref_list.append(arg.pointer_or_reference2)
+		#And combine them into a single normalised string and add them to the argument list
+		argument_string_list.extend(const_pointer_ref_list)
+	
+		#Finally we join our argument string and add it to our list
+		normalised_arg_list.append(''.join(argument_string_list))
+	
+	#If the function contains a variable number of arguments (int foo, ...) then add them on.
+	if result.var_args:
+		normalised_arg_list.append('...')
+	
+	#Combine all the arguments and put parentheses around it
+	return ''.join(['(', ', '.join(normalised_arg_list), ')'])
+
+@lru_cache(maxsize=65536)
 def normalise(symbol):
 	"""
 	Takes a c++ symbol or funtion and splits it into symbol and a normalised argument list.
 	
+	The same signatures recur many times in a tag file, so the results are memoized. Common argument lists are normalised by :py:func:`tokenize_arglist`, the others by the pyparsing grammar.
+	
 	:Parameters:
 		symbol : string
 			A C++ symbol or function definition like ``PolyVox::Volume``, ``Volume::printAll() const``
@@ -98,57 +225,59 @@ def normalise(symbol):
 		print 'Could not find closing bracket in %s' % arglist_input_string
 		raise
 	
-	try:
-		result = arglist.parseString(arglist_input_string)
-	except ParseException as error:
-		#print symbol
-		#print pe
-		return str(error), None
-	else:
-		#Will be a list or normalised string arguments
-		#e.g. ['OBMol&', 'vector< int >&', 'OBBitVec&', 'OBBitVec&', 'int', 'int']
-		normalised_arg_list = []
-		
-		#Cycle through all the matched arguments
-		for arg in result.arg_list:
-			#Here is where we build up our normalised form of the argument
-			argument_string_list = ['']
-			if arg.qualifier:
-				argument_string_list.append(''.join((arg.qualifier,' ')))
-			argument_string_list.append(arg.input_type)
-		
-			#Functions can have a funny combination of *, & and const between the type and the name so build up a list of theose here:
-			const_pointer_ref_list = []
-			const_pointer_ref_list.append(arg.pointer_or_reference1)
-			if arg.const_pointer_or_reference:
-				const_pointer_ref_list.append(''.join((' ', arg.const_pointer_or_reference, ' ')))
-			# same here
-			const_pointer_ref_list.append(arg.pointer_or_reference2)
-			#And combine them into a single normalised string and add them to the argument list
-			argument_string_list.extend(const_pointer_ref_list)
-		
-			#Finally we join our argument string and add it to our list
-			normalised_arg_list.append(''.join(argument_string_list))
-		
-		#If the function contains a variable number of arguments (int foo, ...) then add them on.
-		if result.var_args:
-			normalised_arg_list.append('...')
-		
-		#Combine all the arguments and put parentheses around it
-		normalised_arg_list_string = ''.join(['(', ', '.join(normalised_arg_list), ')'])
-		
-		#Add a const onto the end
-		if 'const' in arglist_suffix:
-			normalised_arg_list_string += ' const'
-		
-		return function_name, normalised_arg_list_string
+	normalised_arg_list_string = tokenize_arglist(arglist_input_string)
+	if normalised_arg_list_string is None:
+		try:
+			normalised_arg_list_string = normalise_parsed(arglist_input_string)
+		except ParseException as error:
+			#print symbol
+			#print pe
+			return str(error), None
+	
+	#Add a const onto the end
+	if 'const' in arglist_suffix:
+		normalised_arg_list_string += ' const'
 	
-	#TODO Maybe this should raise an exception?
-	return None
+	return function_name, normalised_arg_list_string
+
+#Below this many distinct symbols it is not worth starting worker processes
+PARALLEL_THRESHOLD = 2000
 
-def normalise_list(list_of_symbols):
-	#normalise_pool = multiprocessing.Pool(multiprocessing.cpu_count() * 2)
-	#results = normalise_pool.map(normalise, list_of_symbols)
-	#normalise_pool.terminate()
-	results = itertools.imap(normalise, list_of_symbols)
-	return results
+def normalise_list(list_of_symbols, processes=None):
+	"""
+	Normalise many symbols, see :py:func:`normalise`.
+	
+	Every distinct symbol is only normalised once, and if there are many of them they are normalised by a pool of worker processes.
+	
+	:Parameters:
+		list_of_symbols : list
+			The symbols to normalise
+		processes : int
+			The number of worker processes, the number of CPUs by default
+	
+	:return: a list of the results of :py:func:`normalise`, in the order of ``list_of_symbols``
+	"""
+	unique_symbols = list(set(list_of_symbols))
+	if processes is None:
+		try:
+			processes = multiprocessing.cpu_count()
+		except NotImplementedError:
+			processes = 1
+	
+	results = None
+	if processes > 1 and len(unique_symbols) >= PARALLEL_THRESHOLD:
+		try:
+			normalise_pool = multiprocessing.Pool(processes)
+		except (OSError, ImportError):
+			#e.g. no working semaphores on this platform
+			pass
+		else:
+			try:
+				results = normalise_pool.map(normalise, unique_symbols, chunksize=256)
+			finally:
+				normalise_pool.terminate()
+	if results is None:
+		results = itertools.imap(normalise, unique_symbols)
+	
+	normalised = dict(itertools.izip(unique_symbols, results))
+	return [normalised[symbol] for symbol in list_of_symbols]
@@ -0,0 +1,57 @@
+"""
+Measure how many argument lists per second :py:func:`parsing.normalise` gets through.
+
+Run it as::
+
+	python tests/benchmark_parser.py [tag file]
+
+or with ``tox -e bench [-- tag file]``, it is not part of the default tox environments.
+
+With a tag file (e.g. ``qt.tag`` from a Qt build) all the argument lists in it are used, otherwise the ones from test_parser.py. They are normalised once with the grammar only, once with the tokenizer fast path and once more through the cache.
+"""
+
+import sys
+import time
+
+from sphinxcontrib.doxylink import doxylink, parsing
+
+def read_arglists(tag_filename):
+	arglists = []
+	for compound in doxylink.iter_compounds(tag_filename):
+		for member in compound.findall('member'):
+			arglist = member.findtext('arglist')
+			if arglist:
+				arglists.append(arglist)
+	return arglists
+
+def grammar_only(arglist):
+	try:
+		return parsing.normalise_parsed(arglist[:arglist.rindex(')')+1])
+	except (ValueError, parsing.ParseException):
+		return None
+
+def uncached(arglist):
+	parsing.normalise.cache_clear()
+	return parsing.normalise(arglist)
+
+def run(name, function, arglists):
+	start = time.time()
+	for arglist in arglists:
+		function(arglist)
+	elapsed = time.time() - start
+	print '%-12s %8.3f s %10.0f arglists/s' % (name, elapsed, len(arglists) / max(elapsed, 1e-9))
+
+if __name__ == '__main__':
+	if len(sys.argv) > 1:
+		arglists = read_arglists(sys.argv[1])
+	else:
+		import test_parser
+		arglists = [arglist for arglist, _ in test_parser.arglists + test_parser.varargs + test_parser.numbers_for_defaults + test_parser.flags_in_defaults] * 20
+	
+	fast = sum(1 for arglist in set(arglists) if parsing.tokenize_arglist(arglist[:arglist.rindex(')')+1]) is not None)
+	print '%d argument lists, %d distinct, %d of those handled by the tokenizer' % (len(arglists), len(set(arglists)), fast)
+	
+	run('grammar', grammar_only, arglists)
+	run('tokenizer', uncached, arglists)
+	parsing.normalise.cache_clear()
+	run('cached', parsing.normalise, arglists)
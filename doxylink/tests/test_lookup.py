@@ -0,0 +1,94 @@
+import unittest
+import itertools
+
+from sphinxcontrib.doxylink import doxylink
+
+mapping = {'PolyVox': {'kind': 'namespace', 'file': 'namespace_poly_vox.html'},
+           'PolyVox::Volume': {'kind': 'class', 'file': 'class_poly_vox_1_1_volume.html'},
+           'PolyVox::Volume::Volume': {'kind': 'function', 'arglist': {'(uint16_t)': 'class_poly_vox_1_1_volume.html#a1', '()': 'class_poly_vox_1_1_volume.html#a2'}},
+           'PolyVox::Volume::getDepth': {'kind': 'function', 'arglist': {'()': 'class_poly_vox_1_1_volume.html#a3'}},
+           'PolyVox::Volume::FloatVolume': {'kind': 'typedef', 'file': 'class_poly_vox_1_1_volume.html#a4'},
+           'PolyVox::Array': {'kind': 'class', 'file': 'class_poly_vox_1_1_array.html'},
+           'PolyVox::Array::operator[]': {'kind': 'function', 'arglist': {'(uint32_t)': 'class_poly_vox_1_1_array.html#a5'}},
+           'PolyVox::Array< 1, ElementType >': {'kind': 'class', 'file': 'class_poly_vox_1_1_array_3_011_00_01_element_type_01_4.html'},
+           'PolyVox::Array< 1, ElementType >::operator[]': {'kind': 'function', 'arglist': {'(uint32_t)': 'class_poly_vox_1_1_array_3_011_00_01_element_type_01_4.html#a6'}},
+           'PolyVox::Sampler< VoxelType >': {'kind': 'class', 'file': 'class_poly_vox_1_1_sampler.html'},
+           'PolyVox::Sampler< VoxelType >::getPosition': {'kind': 'function', 'arglist': {'() const': 'class_poly_vox_1_1_sampler.html#a7'}},
+           'Other::Volume': {'kind': 'struct', 'file': 'struct_other_1_1_volume.html'},
+           'tidyUpMemory': {'kind': 'function', 'arglist': {'()': 'namespace_poly_vox.html#a8'}},
+           'PolyVox::Volume::operator()': {'kind': 'function', 'arglist': {'(uint16_t)': 'class_poly_vox_1_1_volume.html#a9'}},
+           'PolyVox::ArraySizes': {'kind': 'class', 'file': 'class_poly_vox_1_1_array_sizes.html'},
+}
+
+queries = ['PolyVox', 'PolyVox::Volume', 'Volume', 'Volume::Volume', 'getDepth', 'getDepth()',
+           'Volume::getDepth', 'FloatVolume', 'PolyVox::Volume::FloatVolume', 'operator[]', 'Array::operator[]',
+           'Array', 'tidyUpMemory', 'Foo::tidyUpMemory', 'Foo::PolyVox::Volume', 'Volume::Volume(uint16_t)',
+           'NoSuchThing', 'Sampler::getPosition']
+
+class TestSymbolIndex(unittest.TestCase):
+	def setUp(self):
+		self.index = doxylink.SymbolIndex(mapping)
+
+	def test_piecewise_matches_scan(self):
+		for symbol in queries:
+			found = self.index._find(self.index.trie, symbol)
+			self.assertEqual(sorted(itertools.chain(*found.values())),
+			                 sorted(doxylink.find_url_piecewise(mapping, symbol)))
+
+	def test_kind_buckets(self):
+		found = self.index.find_piecewise('Volume')
+		self.assertEqual(found['class'], ['PolyVox::Volume'])
+		self.assertEqual(found['struct'], ['Other::Volume'])
+		self.assertEqual(found['function'], ['PolyVox::Volume::Volume'])
+
+	def test_exact(self):
+		self.assertEqual(doxylink.find_url2(self.index, 'PolyVox::Volume::FloatVolume'),
+		                 {'kind': 'typedef', 'file': 'class_poly_vox_1_1_volume.html#a4'})
+
+	def test_suffix(self):
+		self.assertEqual(doxylink.find_url2(self.index, 'FloatVolume')['file'], 'class_poly_vox_1_1_volume.html#a4')
+		self.assertEqual(doxylink.find_url2(self.index, 'Foo::tidyUpMemory')['file'], 'namespace_poly_vox.html#a8')
+
+	def test_prefer_classes(self):
+		self.assertEqual(doxylink.find_url2(self.index, 'Volume')['file'], 'class_poly_vox_1_1_volume.html')
+
+	def test_arglist(self):
+		self.assertEqual(doxylink.find_url2(self.index, 'Volume::Volume(uint16_t)')['file'], 'class_poly_vox_1_1_volume.html#a1')
+		self.assertEqual(doxylink.find_url2(self.index, 'PolyVox::Volume::Volume()')['file'], 'class_poly_vox_1_1_volume.html#a2')
+
+	def test_remove_templates(self):
+		self.assertEqual(doxylink.find_url2(self.index, 'operator[]')['file'], 'class_poly_vox_1_1_array.html#a5')
+
+	def test_template_alias(self):
+		self.assertEqual(doxylink.strip_templates('PolyVox::Array< 1, ElementType >::operator[]'), 'PolyVox::Array::operator[]')
+		self.assertEqual(doxylink.find_url2(self.index, 'Sampler::getPosition')['file'], 'class_poly_vox_1_1_sampler.html#a7')
+
+	def test_find_exact(self):
+		self.assertEqual(self.index.find_exact('PolyVox::Volume')['file'], 'class_poly_vox_1_1_volume.html')
+		self.assertEqual(self.index.find_exact('tidyUpMemory')['file'], 'namespace_poly_vox.html#a8')
+		#Only exact names are found
+		self.assertEqual(self.index.find_exact('Volume'), None)
+	
+	def test_find_unparsed(self):
+		#Exact names, compounds without their first namespace and unqualified members, like find_url
+		self.assertEqual(self.index.find_unparsed('PolyVox::Volume')['file'], 'class_poly_vox_1_1_volume.html')
+		self.assertEqual(self.index.find_unparsed('ArraySizes')['file'], 'class_poly_vox_1_1_array_sizes.html')
+		self.assertEqual(self.index.find_unparsed('getDepth')['file'], 'class_poly_vox_1_1_volume.html#a3')
+		self.assertEqual(self.index.find_unparsed('Sampler::getPosition'), None)
+		#Template arguments are stripped
+		self.assertEqual(self.index.find_unparsed('PolyVox::Sampler::getPosition')['file'], 'class_poly_vox_1_1_sampler.html#a7')
+		self.assertEqual(self.index.find_unparsed('NoSuchThing'), None)
+	
+	def test_unparsable(self):
+		#Variadic argument lists and operator() with an argument list can't be parsed
+		for symbol in ['Volume::getDepth(T... args)', 'PolyVox::Volume::operator()()']:
+			self.assertRaises(LookupError, doxylink.find_url2, self.index, symbol)
+		self.assertEqual(self.index.find_unparsed('Volume::getDepth(T... args)')['file'], 'class_poly_vox_1_1_volume.html#a3')
+		self.assertEqual(self.index.find_unparsed('PolyVox::Volume::operator()()')['file'], 'class_poly_vox_1_1_volume.html#a9')
+	
+	def test_no_match(self):
+		self.assertEqual(doxylink.find_url2(self.index, 'NoSuchThing'), None)
+
+	def test_mapping(self):
+		#A plain mapping is still accepted
+		self.assertEqual(doxylink.find_url2(mapping, 'getDepth')['file'], 'class_poly_vox_1_1_volume.html#a3')
@@ -110,6 +110,43 @@ class TestNormalise(unittest.TestCase):
 		from pyparsing import ParseException
 		self.assertRaises(ParseException, parsing.normalise, '("center")')
 
+class TestFastPath(unittest.TestCase):
+	def test_same_as_grammar(self):
+		#Whatever the tokenizer accepts must come out exactly as the grammar would give it
+		all_tests = arglists + varargs + multiple_qualifiers + numbers_for_defaults + flags_in_defaults
+		all_tests += [('(int constant)', None), ('(unsigned)', None), ('(int const)', None), ('(QUrl** source)', None),
+		              ('(struct Foo * foo, enum Bar bar = Baz)', None), ('(long long value)', None), ('( )', None)]
+		for arglist, _ in all_tests:
+			fast = parsing.tokenize_arglist(arglist)
+			if fast is not None:
+				self.assertEqual(fast, parsing.normalise_parsed(arglist))
+	
+	def test_common_shapes(self):
+		self.assertEqual(parsing.tokenize_arglist('( const QIcon & icon, const QString & label, int width = -1 )'), '(const QIcon&, const QString&, int)')
+		self.assertEqual(parsing.tokenize_arglist('( QMutex * mutex, unsigned long time = ULONG_MAX )'), '(QMutex*, unsigned long)')
+		#Templates, brackets and quotes are left to the grammar
+		self.assertEqual(parsing.tokenize_arglist('(const VolumeSampler< VoxelType > &volIter)'), None)
+		self.assertEqual(parsing.tokenize_arglist('( const QByteArray & data, const QUrl & documentUri = QUrl() )'), None)
+		self.assertEqual(parsing.tokenize_arglist('(int nb=0,...)'), None)
+		#So are words the grammar would split like 'const' + 'ant'
+		self.assertEqual(parsing.tokenize_arglist('(int constant)'), None)
+
+class TestCache(unittest.TestCase):
+	def test_cache(self):
+		parsing.normalise.cache_clear()
+		self.assertEqual(parsing.normalise('( int index = 0 )'), ('', '(int)'))
+		self.assertEqual(parsing.normalise('( int index = 0 )'), ('', '(int)'))
+		self.assertEqual(parsing.normalise.cache_info()[:2], (1, 1))
+	
+	def test_eviction(self):
+		@parsing.lru_cache(maxsize=2)
+		def double(x):
+			return 2 * x
+		for x in (1, 2, 1, 3, 1, 2):
+			self.assertEqual(double(x), 2 * x)
+		#2 was the least recently used when 3 came in
+		self.assertEqual(double.cache_info(), (2, 4, 2, 2))
+
 if __name__ == "__main__":
 	try:
 		import cProfile as profile
@@ -119,7 +156,8 @@ if __name__ == "__main__":
 	all_tests = arglists + varargs + multiple_qualifiers + functions + numbers_for_defaults + flags_in_defaults
 	all_tests += all_tests + all_tests + all_tests + all_tests
 	
-	profile.runctx("for arglist in all_tests: parsing.normalise(arglist[0])", globals(), locals(), filename='parsing_profile')
+	#Every signature has to be parsed, otherwise this would only measure the cache
+	profile.runctx("for arglist in all_tests: parsing.normalise.cache_clear(); parsing.normalise(arglist[0])", globals(), locals(), filename='parsing_profile')
 	p = pstats.Stats('parsing_profile')
 	p.strip_dirs().sort_stats('time', 'cum').print_stats(40)
 
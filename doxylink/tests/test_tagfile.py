@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+from sphinxcontrib.doxylink import doxylink, parsing
+
+tag_file = '''<?xml version='1.0' encoding='ISO-8859-1' standalone='yes' ?>
+<tagfile>
+  <compound kind="namespace">
+    <name>PolyVox</name>
+    <filename>namespace_poly_vox.html</filename>
+    <member kind="function">
+      <type>void</type>
+      <name>tidyUpMemory</name>
+      <anchorfile>namespace_poly_vox.html</anchorfile>
+      <anchor>a1</anchor>
+      <arglist>(int iNoOfBytes=0)</arglist>
+    </member>
+    <member kind="typedef">
+      <type>Array&lt; 1, float &gt;</type>
+      <name>Array1DFloat</name>
+      <anchorfile>namespace_poly_vox.html</anchorfile>
+      <anchor>a2</anchor>
+      <arglist></arglist>
+    </member>
+  </compound>
+  <compound kind="class">
+    <name>PolyVox::Volume</name>
+    <filename>class_poly_vox_1_1_volume.html</filename>
+    <member kind="function">
+      <type>uint16_t</type>
+      <name>getDepth</name>
+      <anchorfile>class_poly_vox_1_1_volume.html</anchorfile>
+      <anchor>a3</anchor>
+      <arglist>(void) const</arglist>
+    </member>
+    <member kind="function">
+      <type>void</type>
+      <name>setVoxelAt</name>
+      <anchorfile>class_poly_vox_1_1_volume.html</anchorfile>
+      <anchor>a4</anchor>
+      <arglist>(uint16_t uXPos, uint16_t uYPos, VoxelType tValue)</arglist>
+    </member>
+  </compound>
+  <compound kind="page">
+    <name>index</name>
+    <filename>index</filename>
+  </compound>
+</tagfile>
+'''
+
+class TestTagFile(unittest.TestCase):
+	def setUp(self):
+		self.tempdir = tempfile.mkdtemp()
+		self.tag_filename = os.path.join(self.tempdir, 'test.tag')
+		f = open(self.tag_filename, 'w')
+		f.write(tag_file)
+		f.close()
+
+	def tearDown(self):
+		shutil.rmtree(self.tempdir)
+
+	def test_streaming_parse(self):
+		#Parsing the file incrementally gives the same mapping as parsing the DOM
+		self.assertEqual(doxylink.parse_tag_file(self.tag_filename),
+		                 doxylink.parse_tag_file(ET.parse(self.tag_filename)))
+		mapping = doxylink.parse_tag_file(self.tag_filename)
+		self.assertEqual(mapping['PolyVox::Volume::getDepth'],
+		                 {'kind': 'function', 'arglist': {'(void) const': 'class_poly_vox_1_1_volume.html#a3'}})
+		self.assertTrue('index' not in mapping)
+
+	def test_mapping_file(self):
+		mapping = doxylink.parse_tag_file(self.tag_filename)
+		mapping_filename = os.path.join(self.tempdir, 'test.mapping')
+		doxylink.write_mapping_file(mapping_filename, mapping, 42.0, 'abc')
+		mapping_file = doxylink.MappingFile(mapping_filename)
+		try:
+			self.assertEqual((mapping_file.mtime, mapping_file.digest), (42.0, 'abc'))
+			self.assertEqual(len(mapping_file), len(mapping))
+			self.assertEqual(sorted(mapping_file), sorted(mapping))
+			for symbol in mapping:
+				self.assertEqual(mapping_file[symbol], mapping[symbol])
+			self.assertEqual(mapping_file.get('NoSuchThing'), None)
+			self.assertRaises(KeyError, lambda: mapping_file['NoSuchThing'])
+			self.assertEqual(dict(mapping_file.iterkinds())['PolyVox::Volume'], 'class')
+			self.assertEqual(doxylink.find_url2(doxylink.SymbolIndex(mapping_file), 'Volume::getDepth')['file'],
+			                 'class_poly_vox_1_1_volume.html#a3')
+		finally:
+			mapping_file.close()
+
+	def test_load_mapping_touched(self):
+		#A tag file generated again with the same content is not parsed or
+		#hashed again, its new modification time is recorded
+		class App(object):
+			doctreedir = self.tempdir
+			def info(self, *args, **kwargs):
+				pass
+		doxylink.load_mapping(App(), self.tag_filename).close()
+		os.utime(self.tag_filename, (1000000000, 1000000000))
+		hash_file, parse_tag_file = doxylink.hash_file, doxylink.parse_tag_file
+		calls = []
+		doxylink.hash_file = lambda filename: calls.append('hash') or hash_file(filename)
+		doxylink.parse_tag_file = lambda filename: calls.append('parse') or parse_tag_file(filename)
+		try:
+			mapping_file = doxylink.load_mapping(App(), self.tag_filename)
+			self.assertEqual(mapping_file.mtime, 1000000000)
+			self.assertEqual(mapping_file['PolyVox::Volume']['kind'], 'class')
+			mapping_file.close()
+			doxylink.load_mapping(App(), self.tag_filename).close()
+		finally:
+			doxylink.hash_file, doxylink.parse_tag_file = hash_file, parse_tag_file
+		self.assertEqual(calls, ['hash'])
+
+	def test_invalid_mapping_file(self):
+		self.assertRaises(ValueError, doxylink.MappingFile, self.tag_filename)
+
+class TestNormaliseList(unittest.TestCase):
+	def test_parallel(self):
+		symbols = ['()', '( QUrl source )', '( const QUrl & source ) const', '()', '( int index = 0 )'] * 3
+		expected = [parsing.normalise(symbol) for symbol in symbols]
+		self.assertEqual(parsing.normalise_list(symbols, processes=1), expected)
+		threshold = parsing.PARALLEL_THRESHOLD
+		parsing.PARALLEL_THRESHOLD = 1
+		try:
+			self.assertEqual(parsing.normalise_list(symbols, processes=2), expected)
+		finally:
+			parsing.PARALLEL_THRESHOLD = threshold
@@ -1,9 +1,13 @@
-from fsdict import FSDict
+from feedstore import FeedStore
 import feedgenerator
 from urllib import quote_plus
 import os.path
+import bisect
+import hashlib
+from cgi import escape
 from feeddirectives import Latest
 from feednodes import latest
+import sphinx
 from sphinx.addnodes import toctree
 from docutils import nodes
 
@@ -11,6 +15,11 @@ from docutils import nodes
 #global
 feed_entries = None
 
+FEED_CLASSES = {
+  'rss': feedgenerator.Rss201rev2Feed,
+  'atom': feedgenerator.Atom1Feed,
+}
+
 #constant unlikely to occur in a docname and legal as a filename
 MAGIC_SEPARATOR = '---###---'
 
@@ -35,6 +44,10 @@ def setup(app):
     app.add_config_value('feed_base_url', '', 'html')
     app.add_config_value('feed_description', '', 'html')
     app.add_config_value('feed_filename', 'rss.xml', 'html')
+    app.add_config_value('feed_summary_paragraphs', 0, 'html')
+    app.add_config_value('feed_format', 'rss', 'html')
+    app.add_config_value('feed_max_items', 0, 'html')
+    app.add_config_value('feed_archive_page_size', 0, 'html')
     
     app.add_directive('latest', Latest)
     app.add_node(latest)
@@ -43,38 +56,95 @@ def setup(app):
     app.connect('builder-inited', create_feed_container)
     app.connect('env-purge-doc', remove_dead_feed_item)
     app.connect('env-purge-doc', purge_dates)
-    #I would like to parse dates here, but we aren't supplied the document name in the handler, so it's pointless
-    #app.connect('doctree-read', parse_article_date)
+    if sphinx.version_info >= (1, 3):
+        app.connect('env-merge-info', merge_dates)
+    app.connect('doctree-read', parse_article_date)
     app.connect('html-page-context', create_feed_item)
     app.connect('doctree-resolved', process_latest_toc)
 
+    return {'parallel_read_safe': True}
+
+def get_dated_docs(env):
+    """
+    the (date, docname) pairs of all dated articles, sorted by date. Kept in
+    step with env.feed_pub_dates, and rebuilt from it for environments pickled
+    before there was this index.
+    """
+    if not hasattr(env, 'feed_pub_dates'):
+        env.feed_pub_dates = {}
+    if not hasattr(env, 'feed_dated_docs'):
+        env.feed_dated_docs = sorted(
+          (date, docname) for docname, date in env.feed_pub_dates.iteritems())
+    return env.feed_dated_docs
+
+def add_date(env, docname, pub_date):
+    dated_docs = get_dated_docs(env)
+    env.feed_pub_dates[docname] = pub_date
+    bisect.insort(dated_docs, (pub_date, docname))
+
 def purge_dates(app, env, docname):
     if not hasattr(env, 'feed_pub_dates'):
         return
+    dated_docs = get_dated_docs(env)
     try:
-        del(env.feed_pub_dates[docname])
+        pub_date = env.feed_pub_dates.pop(docname)
     except KeyError:
-        pass
+        return
+    i = bisect.bisect_left(dated_docs, (pub_date, docname))
+    if i < len(dated_docs) and dated_docs[i] == (pub_date, docname):
+        del dated_docs[i]
+
+def merge_dates(app, env, docnames, other):
+    if not hasattr(other, 'feed_pub_dates'):
+        return
+    for docname in docnames:
+        if docname in other.feed_pub_dates:
+            add_date(env, docname, other.feed_pub_dates[docname])
+
+def parse_article_date(app, doctree):
+    """
+    parse the date of an article once, when it is read, into the sorted index
+    """
+    env = app.builder.env
+    docname = env.docname
+    get_dated_docs(env)
+    doc_metadata = env.metadata.get(docname, {})
+    if 'date' not in doc_metadata:
+        return #don't index dateless articles
+    try:
+        pub_date = parse_date(doc_metadata['date'])
+    except ValueError, exc:
+        #probably a nonsensical date
+        app.builder.warn('date parse error: ' + str(exc) + ' in ' + docname)
+    else:
+        add_date(env, docname, pub_date)
 
 def process_latest_toc(app, doctree, fromdocname):
-    """We traverse the doctree looking for publication dates to build the
-    date-based ToC here. Since the order in whicih documents are processed is
-    ill-defined, from our perspective, we parse all of them each time, but
-    cache them in the environment"""
+    """We replace the latest nodes with the date-based ToC here. Dates are
+    parsed when the articles are read, so this only sorts the entries: when a
+    latest list has most of the dated articles, it walks the sorted index
+    instead, so either way the work is bounded by the number of entries."""
 
     env = app.builder.env
-    cache_article_dates(env)
-        
-    feed_pub_dates = getattr(env, 'feed_pub_dates', {})
+    dated_docs = get_dated_docs(env)
+    feed_pub_dates = env.feed_pub_dates
     
     for node in doctree.traverse(latest):
         entries = node['entries']
         includefiles = node['includefiles']
         
-        decorated_entries = [
-          (feed_pub_dates.get(doc), title, doc)
-          for title, doc in entries
-          if doc in feed_pub_dates]
+        titles = dict((doc, title) for title, doc in entries)
+        if len(titles) == len(entries) and 2 * len(entries) >= len(dated_docs):
+            decorated_entries = [
+              (date, titles[doc], doc)
+              for date, doc in reversed(dated_docs)
+              if doc in titles]
+        else:
+            decorated_entries = [
+              (feed_pub_dates.get(doc), title, doc)
+              for title, doc in entries
+              if doc in feed_pub_dates]
+        #almost sorted already when walking the index, this only orders ties
         decorated_entries.sort(reverse=True)
         
         latest_list = nodes.bullet_list('',
@@ -111,36 +181,18 @@ def process_latest_toc(app, doctree, fromdocname):
 
 def create_feed_container(app):
     """
-    create lazy filesystem stash for keeping RSS entry fragments, since we
+    create a single-file store for keeping RSS entry fragments, since we
     don't want to store the entire site in the environment (in fact, even if
-    we did, it wasn't persisting for some reason.)
+    we did, it wasn't persisting for some reason.) It lives with the doctrees,
+    which are thrown away together with the environment.
     """
     global feed_entries
-    rss_fragment_path = os.path.realpath(os.path.join(app.outdir, '..', 'rss_entry_fragments'))
-    feed_entries = FSDict(work_dir=rss_fragment_path)
+    if not os.path.isdir(app.doctreedir):
+        os.makedirs(app.doctreedir)
+    feed_entries = FeedStore(os.path.join(app.doctreedir, 'feed_entries.db'))
     app.builder.env.feed_url = app.config.feed_base_url + '/' + \
         app.config.feed_filename
 
-def cache_article_dates(env):
-    # This should only be run once, although currently it is run many times,
-    # wasting CPU cycles.
-    
-    if not hasattr(env, 'feed_pub_dates'):
-        env.feed_pub_dates = {}
-
-    feed_pub_dates = env.feed_pub_dates
-    
-    for docname, doc_metadata in env.metadata.iteritems():
-        doc_metadata = env.metadata.get(docname, {})
-        if 'date' not in doc_metadata:
-            continue #don't index dateless articles
-        try:
-            pub_date = parse_date(doc_metadata['date'])
-            feed_pub_dates[docname] = pub_date
-        except ValueError, exc:
-            #probably a nonsensical date
-            app.builder.warn('date parse error: ' + str(exc) + ' in ' + docname)
-
 def get_date_for_article(env, docname):
     feed_pub_dates = env.feed_pub_dates
 
@@ -167,62 +219,163 @@ def create_feed_item(app, docname, templatename, ctx, doctree):
     #     unique_id=None, enclosure=None, categories=(), item_copyright=None,
     #     ttl=None,
     link = app.config.feed_base_url + '/' + ctx['current_page_name'] + ctx['file_suffix']
+    if app.config.feed_summary_paragraphs:
+        description = summarize(doctree, app.config.feed_summary_paragraphs)
+    else:
+        description = absolutify(ctx.get('body'), link)
     item = {
       'title': ctx.get('title'),
       'link': link,
       'unique_id': link,
-      'description': absolutify(ctx.get('body'), link),
+      'description': description,
       'pubdate': pub_date
     }
     if 'author' in metadata:
         item['author'] = metadata['author']
         
-    feed_entries[dated_name(docname, pub_date)] = item
+    feed_entries.put(docname, dated_name(docname, pub_date), item)
     
     #Now, useful variables to keep in context
     ctx['rss_link'] = app.builder.env.feed_url 
     ctx['pub_date'] = pub_date
 
+def summarize(doctree, max_paragraphs):
+    """
+    the text of the first paragraphs of the article, as HTML. Only paragraphs
+    directly in the body or its sections are used, not those in lists,
+    tables, admonitions etc. As plain text has no URLs, nothing needs to be
+    absolutified.
+    """
+    paragraphs = []
+    for node in doctree.traverse(nodes.paragraph):
+        if not isinstance(node.parent, (nodes.section, nodes.document)):
+            continue
+        paragraphs.append('<p>%s</p>' % escape(node.astext()))
+        if len(paragraphs) >= max_paragraphs:
+            break
+    return u'\n'.join(paragraphs)
+
 def remove_dead_feed_item(app, env, docname):
     """
-    TODO:
-    purge unwanted crap
+    drop the item of a document which is read again or removed
     """
     global feed_entries
-    munged_name = ''.join([MAGIC_SEPARATOR,quote_plus(docname)])
-    for name in feed_entries:
-        if name.endswith(munged_name):
-            del(feed_entries[name])
+    feed_entries.delete(docname)
 
 def emit_feed(app, exc):
+    """
+    write the feed of the newest items and, if feed_archive_page_size is set,
+    RFC 5005 archive documents holding all items, oldest first. An archive
+    document is only rendered again when its items or neighbours changed, and
+    no file is written with the content it has already.
+    """
     global feed_entries
-    import os.path
+    config = app.config
     
-    title = app.config.feed_title
+    title = config.feed_title
     if not title:
-        title = app.config.project
+        title = config.project
+    try:
+        feed_class = FEED_CLASSES[config.feed_format]
+    except KeyError:
+        app.builder.warn('unknown feed_format %r, writing RSS' %
+          config.feed_format)
+        feed_class = feedgenerator.Rss201rev2Feed
 
     feed_dict = {
       'title': title,
-      'link': app.config.feed_base_url,
-      'feed_url': app.config.feed_base_url,
-      'description': app.config.feed_description
+      'link': config.feed_base_url,
+      'description': config.feed_description
     }
-    if app.config.language:
-        feed_dict['language'] = app.config.language
-    if app.config.copyright:
-        feed_dict['feed_copyright'] = app.config.copyright
-    feed = feedgenerator.Rss201rev2Feed(**feed_dict)
+    if config.language:
+        feed_dict['language'] = config.language
+    if config.copyright:
+        feed_dict['feed_copyright'] = config.copyright
+    settings = repr((feed_class.__name__, sorted(feed_dict.items())))
+
+    def feed_link(filename):
+        return config.feed_base_url + '/' + filename
+
+    def make_feed(filename, links, archive=False):
+        return feed_class(feed_url=feed_link(filename), links=links,
+          archive=archive, **feed_dict)
+
+    page_size = config.feed_archive_page_size
+    max_items = config.feed_max_items
+    num_items = len(feed_entries)
+    num_pages = 0
+    if page_size:
+        num_pages = num_items // page_size
+        for number, (digest, load) in enumerate(
+            feed_entries.pages(page_size)):
+            number += 1
+            filename = archive_filename(config.feed_filename, number)
+            links = [('current', feed_link(config.feed_filename))]
+            if number > 1:
+                links.append(('prev-archive',
+                  feed_link(archive_filename(config.feed_filename, number - 1))))
+            if number < num_pages:
+                links.append(('next-archive',
+                  feed_link(archive_filename(config.feed_filename, number + 1))))
+            outfilename = os.path.join(app.builder.outdir, filename)
+            key = hashlib.md5(digest + repr(links) + settings).hexdigest()
+            if feed_entries.get_digest(filename) == key and \
+              os.path.exists(outfilename):
+                continue
+            feed = make_feed(filename, links, archive=True)
+            for item in load():
+                feed.add_item(**item)
+            write_feed(outfilename, feed)
+            feed_entries.set_digest(filename, key)
+        #archive documents of items which are gone
+        number = num_pages + 1
+        while True:
+            outfilename = os.path.join(app.builder.outdir,
+              archive_filename(config.feed_filename, number))
+            if not os.path.exists(outfilename):
+                break
+            os.remove(outfilename)
+            number += 1
+        #the newest items which do not fill a page are in the feed only
+        limit = max(max_items, num_items % page_size) or page_size
+    else:
+        limit = max_items or None
+
+    links = []
+    if num_pages:
+        links.append(('prev-archive',
+          feed_link(archive_filename(config.feed_filename, num_pages))))
+    feed = make_feed(config.feed_filename, links)
     app.builder.env.feed_feed = feed
-    ordered_keys = feed_entries.keys()
-    ordered_keys.sort(reverse=True)
-    for key in ordered_keys:
-        feed.add_item(**feed_entries[key])     
-    outfilename = os.path.join(app.builder.outdir,
-      app.config.feed_filename)
-    fp = open(outfilename, 'w')
-    feed.write(fp, 'utf-8')
-    fp.close()
+    for item in feed_entries.latest(limit):
+        feed.add_item(**item)
+    feed_entries.close()
+    write_feed(os.path.join(app.builder.outdir, config.feed_filename), feed)
+
+def archive_filename(filename, number):
+    """the name of an archive document, rss-1.xml for the oldest of rss.xml"""
+    root, ext = os.path.splitext(filename)
+    return '%s-%d%s' % (root, number, ext)
+
+def write_feed(outfilename, feed):
+    """
+    write the feed unless the file has this content already, so that its
+    modification time and the caches in front of it are kept
+    """
+    content = feed.writeString('utf-8')
+    if os.path.exists(outfilename):
+        fp = open(outfilename, 'rb')
+        try:
+            old_digest = hashlib.md5(fp.read()).digest()
+        finally:
+            fp.close()
+        if old_digest == hashlib.md5(content).digest():
+            return
+    fp = open(outfilename, 'wb')
+    try:
+        fp.write(content)
+    finally:
+        fp.close()
 
 def dated_name(docname, date):
     """
@@ -1,10 +1,10 @@
 # By Gareth Rees
 # http://gareth-rees.livejournal.com/27148.html
 
-import html5lib
-import html5lib.serializer
-import html5lib.treewalkers
+import re
 import urlparse
+from cgi import escape
+from HTMLParser import HTMLParser, HTMLParseError
 
 # List of (ELEMENT, ATTRIBUTE) for HTML5 attributes which contain URLs.
 # Based on the list at http://www.feedparser.org/docs/resolving-relative-links.html
@@ -35,42 +35,94 @@ url_attributes = [
     ('q', 'cite'),
     ('script', 'src')]
 
+url_attributes_by_tag = {}
+for tag, attr in url_attributes:
+    url_attributes_by_tag.setdefault(tag, set()).add(attr)
+
+attribute_re = re.compile(r"""(?<=[\s"'])([^\s"'>/=]+)(\s*=\s*)("[^"]*"|'[^']*'|[^\s>]*)""")
+
+newline_re = re.compile('\n')
+
+class URLRewriter(HTMLParser):
+    """Collect the start tags with URL attributes, and what they have to be
+replaced with, while tokenizing the source. No tree is built."""
+
+    def __init__(self, base_url):
+        HTMLParser.__init__(self)
+        self.base_url = base_url
+        self.base_seen = False
+        self.replacements = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'base' and not self.base_seen:
+            u = dict(attrs).get('href')
+            if u:
+                self.base_url = urlparse.urljoin(self.base_url, u)
+                # HTML5 4.2.3 "if there are multiple base elements with href
+                # attributes, all but the first are ignored."
+                self.base_seen = True
+            return
+
+        names = url_attributes_by_tag.get(tag)
+        if not names or not any(name in names and value for name, value in attrs):
+            return
+
+        def resolve(match):
+            name = match.group(1).lower()
+            if name not in names:
+                return match.group(0)
+            u = match.group(3)
+            if u[:1] in '"\'':
+                u = u[1:-1]
+            u = self.unescape(u)
+            if not u:
+                return match.group(0)
+            return '%s%s"%s"' % (match.group(1), match.group(2),
+              escape(urlparse.urljoin(self.base_url, u), True))
+
+        text = self.get_starttag_text()
+        self.replacements.append((self.getpos(), len(text),
+          attribute_re.sub(resolve, text)))
+
+    handle_startendtag = handle_starttag
+
 def absolutify(src, base_url):
     """absolutify(SRC, BASE_URL): Resolve relative URLs in SRC.
 SRC is a string containing HTML. All URLs in SRC are resolved relative
-to BASE_URL. Return the body of the result as HTML."""
-
-    # Parse SRC as HTML.
-    tree_builder = html5lib.treebuilders.getTreeBuilder('dom')
-    parser = html5lib.html5parser.HTMLParser(tree = tree_builder)
-    dom = parser.parse(src)
-
-    # Handle <BASE> if any.
-    head = dom.getElementsByTagName('head')[0]
-    for b in head.getElementsByTagName('base'):
-        u = b.getAttribute('href')
-        if u:
-            base_url = urlparse.urljoin(base_url, u)
-            # HTML5 4.2.3 "if there are multiple base elements with href
-            # attributes, all but the first are ignored."
-            break
+to BASE_URL. Return the result as HTML.
+
+The source is tokenized and copied unchanged, apart from the attributes
+in url_attributes."""
+
+    rewriter = URLRewriter(base_url)
+    try:
+        rewriter.feed(src)
+        rewriter.close()
+    except HTMLParseError:
+        # keep what could be tokenized
+        pass
+
+    if not rewriter.replacements:
+        return src
+
+    # positions are (line, column) of the start of the tag, where the
+    # parser only counts \n as line breaks
+    line_offsets = [0]
+    line_offsets.extend(m.end() for m in newline_re.finditer(src))
 
     # Change all relative URLs to absolute URLs by resolving them
     # relative to BASE_URL. Note that we need to do this even for URLs
     # that consist only of a fragment identifier, because Google Reader
     # changes href=#foo to href=http://site/#foo
-    for tag, attr in url_attributes:
-        for e in dom.getElementsByTagName(tag):
-            u = e.getAttribute(attr)
-            if u:
-                e.setAttribute(attr, urlparse.urljoin(base_url, u))
-
-    # Return the HTML5 serialization of the <BODY> of the result (we don't
-    # want the <HEAD>: this breaks feed readers).
-    body = dom.getElementsByTagName('body')[0]
-    tree_walker = html5lib.treewalkers.getTreeWalker('dom')
-    html_serializer = html5lib.serializer.htmlserializer.HTMLSerializer()
-    return u''.join(html_serializer.serialize(tree_walker(body)))
+    result = []
+    last_end = 0
+    for (lineno, offset), length, text in rewriter.replacements:
+        start = line_offsets[lineno - 1] + offset
+        result.append(src[last_end:start])
+        result.append(text)
+        last_end = start + length
+    result.append(src[last_end:])
+    return u''.join(result)
     
 
 # Alternative option, from http://stackoverflow.com/questions/589833/how-to-find-a-relative-url-and-translate-it-to-an-absolute-url-in-python/589939#589939
@@ -24,6 +24,9 @@ import re
 import datetime
 from django_support import SimplerXMLGenerator, iri_to_uri, force_unicode
 
+# RFC 5005, Feed Paging and Archiving
+FEED_HISTORY_NS = u"http://purl.org/syndication/history/1.0"
+
 def rfc2822_date(date):
     # We do this ourselves to be timezone aware, email.Utils is not tz aware.
     if date.tzinfo:
@@ -186,7 +189,12 @@ class RssFeed(SyndicationFeed):
         handler.endElement(u"rss")
 
     def rss_attributes(self):
-        return {u"version": self._version}
+        attrs = {u"version": self._version}
+        if self.feed.get('links'):
+            attrs[u"xmlns:atom"] = u"http://www.w3.org/2005/Atom"
+        if self.feed.get('archive'):
+            attrs[u"xmlns:fh"] = FEED_HISTORY_NS
+        return attrs
 
     def write_items(self, handler):
         for item in self.items:
@@ -207,6 +215,10 @@ class RssFeed(SyndicationFeed):
         handler.addQuickElement(u"lastBuildDate", rfc2822_date(self.latest_post_date()).decode('utf-8'))
         if self.feed['ttl'] is not None:
             handler.addQuickElement(u"ttl", self.feed['ttl'])
+        for rel, href in self.feed.get('links', ()):
+            handler.addQuickElement(u"atom:link", "", {u"rel": rel, u"href": iri_to_uri(href)})
+        if self.feed.get('archive'):
+            handler.addQuickElement(u"fh:archive", "")
 
     def endChannelElement(self, handler):
         handler.endElement(u"channel")
@@ -270,10 +282,12 @@ class Atom1Feed(SyndicationFeed):
         handler.endElement(u"feed")
 
     def root_attributes(self):
+        attrs = {u"xmlns": self.ns}
         if self.feed['language'] is not None:
-            return {u"xmlns": self.ns, u"xml:lang": self.feed['language']}
-        else:
-            return {u"xmlns": self.ns}
+            attrs[u"xml:lang"] = self.feed['language']
+        if self.feed.get('archive'):
+            attrs[u"xmlns:fh"] = FEED_HISTORY_NS
+        return attrs
 
     def add_root_elements(self, handler):
         handler.addQuickElement(u"title", self.feed['title'])
@@ -296,6 +310,10 @@ class Atom1Feed(SyndicationFeed):
             handler.addQuickElement(u"category", "", {u"term": cat})
         if self.feed['feed_copyright'] is not None:
             handler.addQuickElement(u"rights", self.feed['feed_copyright'])
+        for rel, href in self.feed.get('links', ()):
+            handler.addQuickElement(u"link", "", {u"rel": rel, u"href": iri_to_uri(href)})
+        if self.feed.get('archive'):
+            handler.addQuickElement(u"fh:archive", "")
 
     def write_items(self, handler):
         for item in self.items:
@@ -0,0 +1,126 @@
+# −*− coding: UTF−8 −*−
+import os
+import sqlite3
+import hashlib
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+"""
+A single-file store for feed items, replacing the folder of pickles in
+FSDict.
+"""
+
+class FeedStore(object):
+    """
+    keep the RSS items of the articles in a sqlite database, one row per
+    docname, indexed by the dated sort key so that the newest items can be read
+    without unpickling all of them.
+
+    Every change is committed as a transaction of its own, so a crashed build
+    never leaves half an item behind. Sphinx forks to read and write documents
+    in parallel right after the main process purged or wrote some of them, and
+    an open transaction must not be carried across a fork: its lock would keep
+    the forked processes, which open their own connection, from writing. The
+    database is kept in write-ahead log mode and only synced at checkpoints,
+    so these commits do not wait for the disk one by one.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = None
+        self.pid = None
+
+    def _connect(self):
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.connection = sqlite3.connect(self.filename, timeout=60)
+            self.connection.text_factory = str
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS items ('
+              'docname TEXT PRIMARY KEY, sortkey TEXT NOT NULL, '
+              'item BLOB NOT NULL, digest TEXT NOT NULL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS '
+              'items_sortkey ON items (sortkey)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS digests ('
+              'filename TEXT PRIMARY KEY, digest TEXT NOT NULL)')
+            self.connection.commit()
+        return self.connection
+
+    def _changed(self):
+        self.connection.commit()
+
+    def put(self, docname, sortkey, item):
+        """store the item of docname, replacing any earlier one"""
+        blob = pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+        self._connect().execute(
+          'INSERT OR REPLACE INTO items (docname, sortkey, item, digest) '
+          'VALUES (?, ?, ?, ?)',
+          (docname, sortkey, sqlite3.Binary(blob),
+           hashlib.md5(blob).hexdigest()))
+        self._changed()
+
+    def delete(self, docname):
+        self._connect().execute('DELETE FROM items WHERE docname = ?',
+          (docname,))
+        self._changed()
+
+    def latest(self, limit=None):
+        """
+        yield the items by descending sort key, at most limit of them
+        """
+        query = 'SELECT item FROM items ORDER BY sortkey DESC'
+        if limit is not None:
+            query += ' LIMIT %d' % limit
+        for row in self._connect().execute(query):
+            yield pickle.loads(str(row[0]))
+
+    def pages(self, size):
+        """
+        split the items, oldest first, into full pages of size items and yield
+        (digest, load) for each of them: the digest of the stored items of the
+        page, and a function unpickling them newest first. The items which do
+        not fill a page are left out. Only the digests kept with the items are
+        read, the items of a page are read when it is loaded.
+        """
+        rows = self._connect().execute(
+          'SELECT sortkey, digest FROM items ORDER BY sortkey ASC').fetchall()
+        for start in range(0, len(rows) - size + 1, size):
+            page = rows[start:start + size]
+            md5 = hashlib.md5()
+            for sortkey, digest in page:
+                md5.update(digest)
+            yield md5.hexdigest(), self._loader(page[0][0], page[-1][0])
+
+    def _loader(self, first, last):
+        return lambda: [pickle.loads(str(row[0])) for row in
+          self._connect().execute('SELECT item FROM items WHERE sortkey '
+            'BETWEEN ? AND ? ORDER BY sortkey DESC', (first, last))]
+
+    def get_digest(self, filename):
+        """the digest remembered for an output file, or None"""
+        row = self._connect().execute(
+          'SELECT digest FROM digests WHERE filename = ?',
+          (filename,)).fetchone()
+        return row and row[0]
+
+    def set_digest(self, filename, digest):
+        self._connect().execute(
+          'INSERT OR REPLACE INTO digests (filename, digest) VALUES (?, ?)',
+          (filename, digest))
+        self._changed()
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM items').fetchone()[0]
+
+    def commit(self):
+        if self.connection is not None and self.pid == os.getpid():
+            self.connection.commit()
+
+    def close(self):
+        self.commit()
+        if self.connection is not None and self.pid == os.getpid():
+            self.connection.close()
+        self.connection = None
+        self.pid = None
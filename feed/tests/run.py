@@ -32,9 +32,11 @@ def run(bonus_args=[]):
     
     print "Running sphinxcontrib.feed test suite..."
     
-    suite = unittest.TestLoader().loadTestsFromTestCase(
-      test_feed.TestFeedStructure
-    )
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite([
+      loader.loadTestsFromTestCase(test_feed.TestFeedStructure),
+      loader.loadTestsFromTestCase(test_feed.TestFeedStore),
+    ])
     unittest.TextTestRunner(verbosity=2).run(suite)
 
 if __name__ == '__main__':
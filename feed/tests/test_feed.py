@@ -15,6 +15,9 @@ from BeautifulSoup import BeautifulSoup
 import feedparser
 from datetime import datetime
 import unittest
+import tempfile
+import shutil
+from sphinxcontrib.feed.feedstore import FeedStore
 
 
 
@@ -102,3 +105,69 @@ class TestFeedStructure(unittest.TestCase):
         
         app.cleanup()
         app2.cleanup()
+
+
+class TestFeedStore(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'feed_entries.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_latest_and_delete(self):
+        store = FeedStore(self.filename)
+        store.put('older', '2001-08-11T09:00:00---###---older', {'title': u'older'})
+        store.put('latest', '2001-08-11T13:00:00---###---latest', {'title': u'latest'})
+        store.put('aged', '1979-01-01T00:00:00---###---aged', {'title': u'aged'})
+        self.assertEqual([item['title'] for item in store.latest()],
+          [u'latest', u'older', u'aged'])
+        self.assertEqual([item['title'] for item in store.latest(limit=1)],
+          [u'latest'])
+        #a new date replaces the item of the document
+        store.put('aged', '2002-01-01T00:00:00---###---aged', {'title': u'aged'})
+        store.delete('latest')
+        store.delete('nonexisting')
+        self.assertEqual([item['title'] for item in store.latest()],
+          [u'aged', u'older'])
+        store.close()
+        #and it persists
+        store = FeedStore(self.filename)
+        self.assertEqual(len(store), 2)
+        store.close()
+
+
+    def test_no_transaction_left_open(self):
+        #processes forked by a parallel build write with their own
+        #connection, which must not find the store locked
+        import sqlite3
+        store = FeedStore(self.filename)
+        other = sqlite3.connect(self.filename, timeout=0)
+        store.put('doc', '2001-08-11T09:00:00---###---doc', {'title': u'doc'})
+        other.execute('DELETE FROM items WHERE docname = ?', ('doc',))
+        other.commit()
+        store.delete('doc')
+        other.execute('DELETE FROM items WHERE docname = ?', ('doc',))
+        other.commit()
+        other.close()
+        store.close()
+
+    def test_pages_and_digests(self):
+        store = FeedStore(self.filename)
+        for i in range(5):
+            store.put('doc%d' % i, '200%d-01-01T00:00:00---###---doc%d' % (i, i),
+              {'title': u'doc%d' % i})
+        pages = list(store.pages(2))
+        #the oldest items fill the pages, the newest one is left out
+        self.assertEqual([[item['title'] for item in load()] for digest, load in pages],
+          [[u'doc1', u'doc0'], [u'doc3', u'doc2']])
+        digests = [digest for digest, load in pages]
+        store.put('doc3', '2003-01-01T00:00:00---###---doc3', {'title': u'changed'})
+        self.assertEqual(digests[0], list(store.pages(2))[0][0])
+        self.assertNotEqual(digests[1], list(store.pages(2))[1][0])
+        self.assertEqual(store.get_digest('rss-1.xml'), None)
+        store.set_digest('rss-1.xml', digests[0])
+        store.close()
+        store = FeedStore(self.filename)
+        self.assertEqual(store.get_digest('rss-1.xml'), digests[0])
+        store.close()
@@ -1,69 +1,116 @@
-from docutils.writers.docutils_xml import Writer
-from docutils.io import DocTreeInput, StringOutput
-from docutils.core import Publisher
-from docutils.utils import new_document
-from sphinx.util.pycompat import any, b
-from docutils.readers.doctree import Reader as DoctreeReader
-import sys, re, os, json
+from docutils import nodes
+import sphinx
+from sphinx import addnodes
+from sphinx.util import url_re
+from sphinx.util.nodes import clean_astext
+import sys, re, os, json, hashlib, itertools
+
+def get_toc_items(env, docname):
+    """Return the references and toctrees in the toc of `docname`.
+
+    Returns a list of ``('ref', level, only, refuri, anchorname, title)`` and
+    ``('toctree', level, only, entries)`` in document order, where `only`
+    are the expressions of enclosing only directives.  The toc is cut at
+    the ``tocdepth`` of the document like :meth:`resolve_toctree` does.
+    The result is cached in the environment until the document changes.
+    """
+    if not hasattr(env, 'findanything_tocs'):
+        env.findanything_tocs = {}
+    if docname in env.findanything_tocs:
+        return env.findanything_tocs[docname]
+
+    maxdepth = int(env.metadata[docname].get('tocdepth', 0))
+    items = []
+
+    def walk(node, level, only):
+        for subnode in node.children:
+            if isinstance(subnode, nodes.bullet_list):
+                if maxdepth <= 0 or level + 1 <= maxdepth:
+                    walk(subnode, level + 1, only)
+            elif isinstance(subnode, addnodes.only):
+                walk(subnode, level, only + (subnode['expr'],))
+            elif isinstance(subnode, addnodes.toctree):
+                items.append(('toctree', level, only, subnode['entries']))
+            elif isinstance(subnode, nodes.reference):
+                items.append(('ref', level, only, subnode['refuri'],
+                              subnode['anchorname'], subnode.astext()))
+            elif isinstance(subnode, nodes.Element):
+                walk(subnode, level, only)
+
+    walk(env.tocs[docname], 1, ())
+    env.findanything_tocs[docname] = items
+    return items
+
+def iter_toctree_references(app, env, entries, parent, parents):
+    """Yield ``(refuri, title)`` of the references a toctree resolves to.
+
+    This walks the entries of a toctree node the way
+    :meth:`resolve_toctree` with ``includehidden=True`` and ``maxdepth=0``
+    does, but from the cached toc items of the documents instead of copies
+    of their tocs.
+    """
+    builder = app.builder
+    master_doc = app.config.master_doc
+
+    for title, ref in entries:
+        if url_re.match(ref):
+            yield ref, title or ref
+            continue
+        if ref == 'self':
+            yield (builder.get_relative_uri(master_doc, parent),
+                   title or clean_astext(env.titles[parent]))
+            continue
+        if ref in parents or ref not in env.tocs:
+            # circular and missing references are reported by sphinx
+            continue
+
+        items = get_toc_items(env, ref)
+        toplevel = len([item for item in items
+                        if item[0] == 'ref' and item[1] == 1])
+
+        for item in items:
+            if not all(builder.tags.eval_condition(expr) for expr in item[2]):
+                continue
+            if item[0] == 'toctree':
+                for reference in iter_toctree_references(app, env, item[3],
+                        ref, [ref] + parents):
+                    yield reference
+                continue
+
+            _, level, only, refuri, anchorname, text = item
+            if title and toplevel == 1 and refuri == ref and not anchorname:
+                text = title
+            if not url_re.match(refuri):
+                refuri = builder.get_relative_uri(master_doc, refuri) + anchorname
+            yield refuri, text
+
+def get_genindex(app, env):
+    """Return the general index, created again only if index entries changed."""
+    cached = getattr(env, 'findanything_genindex', None)
+    if cached is None or cached[0] != app.builder.name:
+        cached = env.findanything_genindex = (app.builder.name,
+            env.create_index(app.builder))
+    return cached[1]
+
+def purge_entries(app, env, docname):
+    if hasattr(env, 'findanything_tocs'):
+        env.findanything_tocs.pop(docname, None)
+    # called before sphinx forgets the index entries of the document
+    if env.indexentries.get(docname):
+        env.findanything_genindex = None
+
+def collect_entries(app, doctree):
+    env = app.builder.env
+    if env.indexentries.get(env.docname):
+        env.findanything_genindex = None
+
+def merge_entries(app, env, docnames, other):
+    if any(other.indexentries.get(docname) for docname in docnames):
+        env.findanything_genindex = None
 
 def env_updated(app, env):
     config = app.builder.config
 
-    doctree = env.get_doctree(config.master_doc)
-    from sphinx import addnodes
-
-    toctrees = []
-    for toctreenode in doctree.traverse(addnodes.toctree):
-        toctree = env.resolve_toctree(config.master_doc, app.builder, 
-            toctreenode, prune = False, includehidden = True, maxdepth = 0,
-            collapse = False)
-        toctrees.append(toctree)
-
-    if not toctrees:
-        toc = None
-    else:
-        toc = toctrees[0]
-        for toctree in toctrees[1:]:
-            toc.extend(toctree.children)
-
-    # toc = env.get_toctree_for(config.master_doc, app.builder, False)
-
-    node = toc
-
-    doc = new_document(b('<partial node>'))
-    doc.append(node)
-
-    pub = Publisher(
-            source_class = DocTreeInput,
-            destination_class=StringOutput)
-
-    pub.set_components('standalone', 'restructuredtext', 'pseudoxml')
-
-    pub.reader = DoctreeReader()
-    pub.writer = Writer()
-    pub.writer.format = 'pseudoxml'
-    pub.process_programmatic_settings(
-        None, {'output_encoding': 'unicode'}, None)
-    pub.set_source(doc, None)
-    pub.set_destination(None, None)
-    pub.publish()
-
-    import xml.etree.cElementTree as ET
-    from cStringIO import StringIO
-
-    #out = re.sub(r'^<!DOCTYPE[^>]*>\s*', '<?xml version="1.0"?>', pub.writer.output)
-    out = pub.writer.output.encode('utf-8').replace(' encoding="unicode"', ' encoding="utf-8"')
-
-    #pprint.pprint(out)
-
-    doctree = ET.fromstring(out)
-
-    #pprint.pprint(doctree)
-    #pprint.pprint(dir(doctree))
-    if hasattr(doctree, 'getroot'):
-        doctree = doctree.getroot()
-    #root = doctree.getroot()
-
     fuzzy_find_entries = []
     docs = {}
 
@@ -92,25 +139,16 @@ def env_updated(app, env):
             return entry
 
     if app.config.html_findanything_add_topics:
-        if hasattr(doctree, 'iter'):
-            references = doctree.iter('reference')
-        else:
-            references = doctree.getiterator('reference')
-
-    #            fuzzy_find_entries.append(dict(
-    #                    href = link,
-    #                    name = entry,
-    #                    path = "index/%s/" % char,
-    #                    info = "INDEX",
-    #                    detail = '',
-    #                ))
+        references = []
+        doctree = env.get_doctree(config.master_doc)
+        for toctreenode in doctree.traverse(addnodes.toctree):
+            references.extend(iter_toctree_references(app, env,
+                toctreenode['entries'], config.master_doc, []))
 
         refset = set()
 
-        for ref in references:
-            refuri = ref.attrib['refuri']
-
-            docs[refuri] = ref.text
+        for refuri, text in references:
+            docs[refuri] = text
             path = "/"
             if "/" in refuri:
                 path = refuri.rsplit('/', 1)[0]+"/"
@@ -124,8 +162,8 @@ def env_updated(app, env):
                 info = 'PAGE'
 
             e = dict(
-                    href = ref.attrib['refuri'],
-                    name = ref.text,
+                    href = refuri,
+                    name = text,
                     info = info,
                     path = path,
                     detail = '',
@@ -141,7 +179,7 @@ def env_updated(app, env):
 
 
     if app.config.html_findanything_add_indexentries:
-        genindex = env.create_index(app.builder)
+        genindex = get_genindex(app, env)
 
         for char,char_list in genindex:
             for entry, (links, subitems) in char_list:
@@ -151,15 +189,19 @@ def env_updated(app, env):
                     for subname, sublinks in subitems:
                         indexentries(subname, sublinks, cap=cap)
     
-    s = json.dumps(fuzzy_find_entries)
-
     static_dir = os.path.join(app.builder.outdir, '_static')
 
     if not os.path.exists(static_dir):
         os.makedirs(static_dir)
 
     with open(os.path.join(static_dir, 'fuzzyindex.js'), 'wb') as f:
-        f.write("DOCUMENTATION_OPTIONS.FIND_ANYTHING_ENTRIES = %s;" % s);
+        if app.config.html_findanything_shards:
+            index = write_index(static_dir, fuzzy_find_entries)
+            f.write("DOCUMENTATION_OPTIONS.FIND_ANYTHING_INDEX = %s;"
+                % json.dumps(index, sort_keys=True))
+        else:
+            f.write("DOCUMENTATION_OPTIONS.FIND_ANYTHING_ENTRIES = %s;"
+                % json.dumps(fuzzy_find_entries));
 
 
         if app.config.html_findanything_use_cached_hits:
@@ -177,6 +219,143 @@ def env_updated(app, env):
 #        }
 
 
+# must match INFO in fuzzyfinder.js
+INFO_CODES = {'PAGE': 0, 'SECTION': 1, 'INDEX': 2}
+
+# number of entries in a chunk file of the index
+CHUNK_SIZE = 64
+
+def shard_key(char):
+    """Return the key of the shard for `char`.
+
+    ASCII letters and digits have a shard each, all other characters share
+    the shard ``_``.
+    """
+    char = char.lower()
+    if 'a' <= char <= 'z' or '0' <= char <= '9':
+        return char
+    return '_'
+
+def key_suffixes(s):
+    """Return ``{key: suffix}`` for the shards string `s` is put into.
+
+    A fuzzy match of a query in `s` starts with a character of the shard of
+    the first character of the query, so a shard only needs the part of `s`
+    from the first character with its key on.
+    """
+    suffixes = {}
+    for i, char in enumerate(s):
+        suffixes.setdefault(shard_key(char), s[i:])
+    return suffixes
+
+def compact_entries(entries):
+    """Return the entries in the compact form of a chunk.
+
+    Each entry becomes ``[name, doc, anchor, path, info(, detail)]``, where
+    doc and path are ids into the ``docs`` and ``paths`` tables of the
+    chunk, as there are many entries for the same document and path.
+    """
+    docs = {}
+    paths = {}
+    rows = []
+    for e in entries:
+        doc, _, anchor = e['href'].partition('#')
+        row = [e['name'], docs.setdefault(doc, len(docs)), anchor,
+               paths.setdefault(e['path'], len(paths)), INFO_CODES[e['info']]]
+        if e['detail']:
+            row.append(e['detail'])
+        rows.append(row)
+
+    return dict(
+        docs = sorted(docs, key=docs.get),
+        paths = sorted(paths, key=paths.get),
+        entries = rows,
+    )
+
+def build_index(entries):
+    """Return ``(shards, chunks)`` of the index of `entries`.
+
+    The entries are numbered in the order of their paths and put into
+    chunks of :data:`CHUNK_SIZE` in compact form.  The shard of a key has
+    the posting lists of the names and paths containing a character of
+    that key, ``names`` as ``[suffix, id, ...]`` and ``paths`` as
+    ``[suffix, first id, count]``, so the client finds the ids of the
+    entries matching a query in the shard of its first character and only
+    loads the chunks of these.
+    """
+    entries = sorted(entries, key=lambda e: e['path'])
+
+    names = {}
+    for i, e in enumerate(entries):
+        for key, suffix in key_suffixes(e['name']).items():
+            names.setdefault(key, {}).setdefault(suffix, []).append(i)
+
+    paths = {}
+    first = 0
+    for path, group in itertools.groupby(entries, key=lambda e: e['path']):
+        count = len(list(group))
+        for key, suffix in key_suffixes(path).items():
+            paths.setdefault(key, []).append([suffix, first, count])
+        first += count
+
+    shards = {}
+    for key in set(names) | set(paths):
+        shards[key] = dict(
+            names = sorted([suffix] + ids
+                for suffix, ids in names.get(key, {}).items()),
+            paths = paths.get(key, []),
+        )
+
+    chunks = [compact_entries(entries[i:i + CHUNK_SIZE])
+              for i in range(0, len(entries), CHUNK_SIZE)]
+
+    return shards, chunks
+
+def write_index(static_dir, entries):
+    """Write the shards and chunks of the index into _static/fuzzyindex.
+
+    The file names start with a hash of the whole index, so that browsers
+    may cache them.  Returns the description of the index for the client.
+    """
+    index_dir = os.path.join(static_dir, 'fuzzyindex')
+    if not os.path.exists(index_dir):
+        os.makedirs(index_dir)
+
+    shards, chunks = build_index(entries)
+
+    scripts = []
+    for key, shard in sorted(shards.items()):
+        scripts.append((key,
+            "DOCUMENTATION_OPTIONS.FIND_ANYTHING_ADD_SHARD(%s, %s);" % (
+                json.dumps(key), json.dumps(shard, separators=(',', ':')))))
+    for n, chunk in enumerate(chunks):
+        scripts.append(('entries-%d' % n,
+            "DOCUMENTATION_OPTIONS.FIND_ANYTHING_ADD_CHUNK(%d, %s);" % (
+                n, json.dumps(chunk, separators=(',', ':'), sort_keys=True))))
+
+    version = hashlib.md5(''.join(s for name, s in scripts)).hexdigest()[:8]
+
+    current = set()
+    for name, s in scripts:
+        fname = '%s-%s.js' % (version, name)
+        current.add(fname)
+        if not os.path.exists(os.path.join(index_dir, fname)):
+            with open(os.path.join(index_dir, fname), 'wb') as f:
+                f.write(s)
+
+    # remove the files of earlier builds
+    for fname in os.listdir(index_dir):
+        if fname not in current:
+            os.unlink(os.path.join(index_dir, fname))
+
+    return dict(
+        version = version,
+        shards = sorted(shards),
+        chunks = len(chunks),
+        chunk_size = CHUNK_SIZE,
+    )
+
+
 def on_builder_inited(app):
     app.config.html_static_path.append( os.path.relpath(
           os.path.join(os.path.dirname(__file__), 'javascript'),
@@ -209,10 +388,17 @@ def setup(app):
     app.add_config_value('html_findanything_add_topics', True, False)
     app.add_config_value('html_findanything_use_cached_hits', True, False)
     app.add_config_value('html_findanything_hit_cacher', 'cookie', False)
+    app.add_config_value('html_findanything_shards', True, False)
 
     app.connect('builder-inited', on_builder_inited)
+    app.connect('env-purge-doc', purge_entries)
+    app.connect('doctree-read', collect_entries)
+    if sphinx.version_info >= (1, 3):
+        app.connect('env-merge-info', merge_entries)
     app.connect('env-updated', env_updated)
 
+    return {'parallel_read_safe': True}
+
 
 #if __name__ == '__main__':
     #sys.stdout.write("hello world\n")
@@ -1,6 +1,150 @@
 $(function(){
+    var index = DOCUMENTATION_OPTIONS.FIND_ANYTHING_INDEX;
+    var getData = null;
+
+    if (index) {
+        // the shard of a character has the posting lists of the names and
+        // paths containing it, the entries are loaded in chunks by id.  See
+        // sphinxcontrib.findanything.
+        var INFO = ['PAGE', 'SECTION', 'INDEX'];
+        var shards = {};
+        var chunks = {};
+        var requested = {};
+        var waiting = null;
+        var last = {query: null, data: null};
+
+        var load = function(name) {
+            if (requested[name]) return;
+            requested[name] = true;
+            // a script element works for file:// urls too
+            $.ajax({
+                url: DOCUMENTATION_OPTIONS.URL_ROOT + '_static/fuzzyindex/' +
+                     index.version + '-' + name + '.js',
+                dataType: 'script',
+                crossDomain: true,
+                cache: true
+            });
+        };
+
+        var loaded = function() {
+            if (waiting) waiting();
+        };
+
+        DOCUMENTATION_OPTIONS.FIND_ANYTHING_ADD_SHARD = function(key, shard) {
+            shards[key] = shard;
+            loaded();
+        };
+
+        DOCUMENTATION_OPTIONS.FIND_ANYTHING_ADD_CHUNK = function(n, chunk) {
+            var entries = [];
+            $.each(chunk.entries, function(i, e){
+                entries.push({
+                    name: e[0],
+                    href: chunk.docs[e[1]] + (e[2] ? '#' + e[2] : ''),
+                    path: chunk.paths[e[3]],
+                    info: INFO[e[4]],
+                    detail: e[5] || ''
+                });
+            });
+            chunks[n] = entries;
+            loaded();
+        };
+
+        var shardKey = function(term) {
+            var c = term.replace(/"/g, '').charAt(0).toLowerCase();
+            if (!c) return null;
+            return /[a-z0-9]/.test(c) ? c : '_';
+        };
+
+        // add the ids of the rows of a posting list matching term to ids
+        var grep = function(term, rows, ids, getIds) {
+            $.fuzzygrep(term, rows, {
+                getName: function(row){ return row[0] },
+                matchPath: false,
+                maxMatch: false,
+                onMatch: function(row){
+                    $.each(getIds(row), function(i, id){ ids[id] = true; });
+                },
+                onNotMatch: null
+            });
+            return ids;
+        };
+
+        var nameIds = function(row) {
+            return row.slice(1);
+        };
+
+        var pathIds = function(row) {
+            var ids = [];
+            for (var id = row[1]; id < row[1] + row[2]; id++) ids.push(id);
+            return ids;
+        };
+
+        // ids of the entries which may match query, null while loading
+        var candidates = function(query) {
+            var m = /(.*\/)(.*)/.exec(query);
+            var path = m ? m[1] : query;
+            var name = m ? m[2] : query;
+            var keys = [shardKey(path), name ? shardKey(name) : null];
+
+            var missing = false;
+            $.each(keys, function(i, key){
+                if (key && $.inArray(key, index.shards) >= 0 && !shards[key]) {
+                    load(key);
+                    missing = true;
+                }
+            });
+            if (missing) return null;
+
+            var pathShard = shards[keys[0]] || {names: [], paths: []};
+            var nameShard = shards[keys[1]] || {names: [], paths: []};
+
+            if (m && name) {
+                // a query "path/name" has to match both
+                var paths = grep(path, pathShard.paths, {}, pathIds);
+                var names = grep(name, nameShard.names, {}, nameIds);
+                var ids = {};
+                $.each(names, function(id){
+                    if (paths[id]) ids[id] = true;
+                });
+                return ids;
+            }
+
+            // otherwise matching the path or the name is enough, and both
+            // are in the shard of the first character of the query
+            var ids = grep(path, pathShard.paths, {}, pathIds);
+            return grep(query, pathShard.names, ids, nameIds);
+        };
+
+        getData = function(query, onLoad) {
+            if (query === last.query) return last.data;
+            waiting = onLoad;
+
+            var ids = candidates(query);
+            if (!ids) return;
+
+            var missing = false;
+            $.each(ids, function(id){
+                var n = Math.floor(id / index.chunk_size);
+                if (!chunks[n]) {
+                    load('entries-' + n);
+                    missing = true;
+                }
+            });
+            if (missing) return;
+
+            var data = [];
+            $.each(ids, function(id){
+                data.push(chunks[Math.floor(id / index.chunk_size)][id % index.chunk_size]);
+            });
+            last = {query: query, data: data};
+            return data;
+        };
+    }
+
     $.fuzzyfinder({
-        data: DOCUMENTATION_OPTIONS.FIND_ANYTHING_ENTRIES,
+        data: index ? [] : DOCUMENTATION_OPTIONS.FIND_ANYTHING_ENTRIES,
+        getData: getData,
         use_cached_hits: DOCUMENTATION_OPTIONS.FIND_ANYTHING_CACHE_HITS,
         url_prefix: DOCUMENTATION_OPTIONS.URL_ROOT,
         width: DOCUMENTATION_OPTIONS.FIND_ANYTHING_WIDTH,
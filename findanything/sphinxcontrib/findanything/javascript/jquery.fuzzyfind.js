@@ -507,6 +507,13 @@ if selector is another element:
 
             If there is no data given by parameter, opts.data will be taken.
 
+        .. js:attribute:: opts.getData
+
+            Optional ``function(query, onLoad)`` returning the data to search
+            *query* in, in place of :js:attr:`opts.data`.  If the data is
+            not there yet, it returns nothing and calls ``onLoad()`` once it
+            is.
+
     :param data: Something, which overrides :js:attr:`opts.data`, if
         present.
 
@@ -645,96 +652,22 @@ if selector is another element:
                 if (typeof(this.cached_hits) == "undefined")
                     this.cached_hits = {};
 
-                // data is list of {href: ... name: ... info: ...}
-                this.max_path_len = 0;
-                this.max_name_len = 0;
+                this.prepareData(data);
 
-                for (i in data) {
-                    var e = data[i];
-                    if (e.name.length > this.max_name_len) {
-                        this.max_name_len = e.name.length;
-                    }
-                    if (e.path.length > this.max_path_len) {
-                        this.max_path_len = e.path.length;
-                    }
-                    e.user_hits = 0;
-
-                    if (this.use_cached_hits) {
-                        if (this.cached_hits[e.href]) {
-                            // cached hits here
-
-                            // this only for migrating old numbers
-                            if (!$.isArray(this.cached_hits[e.href])) {
-                                this.cached_hits[e.href] = [];
-                                this.cached_hits[e.href].push(Date.now());
-                            }
-
-                            // assume we have following entries
-                            // 10s, 2min, 2.10min, 5min, 1.5h, 1.7h,
-                            // 3h, 4h, 10h, 11.5h, 1d, 1.5d, 2d, 2.2d,
-                            // 5d, 7d, 10d, 14d
-                            //
-                            // 13d
-                            //
-                            // within last hour: max(entries) =  6
-                            // within last 6h:   max(entries) =  5
-                            // within last 12h:  max(entries) =  4
-                            // within last 1d:  max(entries)  =  3
-                            // within last 7d:  max(entries)  =  2
-                            // within last 30d:  max(entries) =  1
-                            //
-
-                            // age hits here
-                            var max_count = this.aging.length;
-                            var j = 0,   // iterate over this.aging
-                                k = 0,   // iterate over my_hits
-                                cnt = 0; // count 
-                            var my_hits = this.cached_hits[e.href];
-
-                            var age = Date.now() - this.aging[j];
-
-                            var maxi = 0;
-                            for (var j=0; j<this.aging.length; j++) {
-                                maxi += j;
-                            }
-
-                            if (my_hits.length > maxi) {
-                                var new_hits = [];
-
-                                // my_hits is ascending
-                                for (var k in my_hits) {
-                                    if (my_hits[k] > age) {
-                                        if (cnt < max_count) {
-                                            new_hits.push(my_hits[k])
-                                            cnt += 1;
-                                        } else {
-                                            j += 1;
-                                            cnt = 0;
-                                            max_count -= 1;
-                                            age = Date.now() - this.aging[j];
-                                        }
-                                    } else if (new_hits.length < maxi) {
-                                        new_hits.push(my_hits[k])
-                                    }
-                                }
-    
-                                this.cached_hits[e.href] = new_hits;
-                            }
-                            e.user_hits = this.cached_hits[e.href].length;
+                this.search = function(query){
+                    if (ff.getData) {
+                        // data depends on the query; search again with the
+                        // current input once it is loaded
+                        var d = ff.getData(query, function(){
+                            ff.search(ff.$input.val());
+                        });
+                        if (!d) return;
+                        if (d !== data) {
+                            data = d;
+                            ff.prepareData(data);
                         }
                     }
-                }
-
-                // if maxmatch is used, order of entries is of essence, so
-                // sort entries by user_hits descending
 
-                if (this.use_cached_hits) {
-                    data.sort(function(a,b){
-                        return b.user_hits - a.user_hits;
-                    });
-                }
-
-                this.search = function(query){
                     var selected = ff.$results.find('.selected').children('a').attr('href');
 
                     var results = [];
@@ -932,6 +865,106 @@ if selector is another element:
         }
     };
 
+/*=
+.. js:function:: FuzzyFinder.prototype.prepareData(data)
+
+    Compute the name and path lengths used for rating and the user hits of
+    the entries in *data*.  If :js:attr:`opts.getData` is given, this is
+    done for each set of data it returns.
+
+=*/
+
+    FuzzyFinder.prototype.prepareData = function(data) {
+        // data is list of {href: ... name: ... info: ...}
+        this.max_path_len = 0;
+        this.max_name_len = 0;
+
+        for (var i in data) {
+            var e = data[i];
+            if (e.name.length > this.max_name_len) {
+                this.max_name_len = e.name.length;
+            }
+            if (e.path.length > this.max_path_len) {
+                this.max_path_len = e.path.length;
+            }
+            e.user_hits = 0;
+
+            if (this.use_cached_hits) {
+                if (this.cached_hits[e.href]) {
+                    // cached hits here
+
+                    // this only for migrating old numbers
+                    if (!$.isArray(this.cached_hits[e.href])) {
+                        this.cached_hits[e.href] = [];
+                        this.cached_hits[e.href].push(Date.now());
+                    }
+
+                    // assume we have following entries
+                    // 10s, 2min, 2.10min, 5min, 1.5h, 1.7h,
+                    // 3h, 4h, 10h, 11.5h, 1d, 1.5d, 2d, 2.2d,
+                    // 5d, 7d, 10d, 14d
+                    //
+                    // 13d
+                    //
+                    // within last hour: max(entries) =  6
+                    // within last 6h:   max(entries) =  5
+                    // within last 12h:  max(entries) =  4
+                    // within last 1d:  max(entries)  =  3
+                    // within last 7d:  max(entries)  =  2
+                    // within last 30d:  max(entries) =  1
+                    //
+
+                    // age hits here
+                    var max_count = this.aging.length;
+                    var j = 0,   // iterate over this.aging
+                        k = 0,   // iterate over my_hits
+                        cnt = 0; // count 
+                    var my_hits = this.cached_hits[e.href];
+
+                    var age = Date.now() - this.aging[j];
+
+                    var maxi = 0;
+                    for (var j=0; j<this.aging.length; j++) {
+                        maxi += j;
+                    }
+
+                    if (my_hits.length > maxi) {
+                        var new_hits = [];
+
+                        // my_hits is ascending
+                        for (var k in my_hits) {
+                            if (my_hits[k] > age) {
+                                if (cnt < max_count) {
+                                    new_hits.push(my_hits[k])
+                                    cnt += 1;
+                                } else {
+                                    j += 1;
+                                    cnt = 0;
+                                    max_count -= 1;
+                                    age = Date.now() - this.aging[j];
+                                }
+                            } else if (new_hits.length < maxi) {
+                                new_hits.push(my_hits[k])
+                            }
+                        }
+    
+                        this.cached_hits[e.href] = new_hits;
+                    }
+                    e.user_hits = this.cached_hits[e.href].length;
+                }
+            }
+        }
+
+        // if maxmatch is used, order of entries is of essence, so
+        // sort entries by user_hits descending
+
+        if (this.use_cached_hits) {
+            data.sort(function(a,b){
+                return b.user_hits - a.user_hits;
+            });
+        }
+    };
+
     FuzzyFinder.prototype.ajaxSearch = function(term) {
         var ff = this;
         $.post(ff.data, ff.getParam(term), 
@@ -14,7 +14,11 @@
     Inspired by ``sphinxcontrib-aafig`` by Leandro Lucarella.
 """
 
+import multiprocessing
+import os
 import posixpath
+import re
+from multiprocessing.pool import ThreadPool
 from os import path
 from subprocess import Popen,PIPE
 
@@ -26,10 +30,15 @@ except ImportError:
 from docutils import nodes
 from docutils.parsers.rst import directives
 
+import sphinx
 from sphinx.errors import SphinxError
 from sphinx.util import ensuredir, relative_uri
 from sphinx.util.compat import Directive
 
+try:
+    from sphinxcontrib import rendercache
+except ImportError:
+    rendercache = None
 
 
 DEFAULT_FORMATS = dict(html='png', latex='pdf', text=None)
@@ -85,6 +94,7 @@ def render_gnuplot_images(app, doctree):
         try:
             fname, outfn, hashid = render_gnuplot(app, text, options)
             img['uri'] = fname
+            img.gnuplot['outfn'] = outfn
         except GnuplotError, exc:
             app.builder.warn('gnuplot error: ' + str(exc))
             img.replace_self(nodes.literal_block(text, text))
@@ -94,6 +104,9 @@ def render_gnuplot_images(app, doctree):
 def render_gnuplot(app, text, options):
     """
     Render gnuplot text into a image file.
+
+    Unless ``gnuplot_workers`` is 0 the image is only submitted to the
+    pool of workers, and it is complete once ``env-updated`` is emitted.
     """
     format_map = DEFAULT_FORMATS.copy()
     format_map.update(app.builder.config.gnuplot_format)
@@ -117,10 +130,65 @@ def render_gnuplot(app, text, options):
 
     if path.isfile(outfn):
         return relfn, outfn, hashid
-    
-    ensuredir(path.dirname(outfn))
 
     docdir = (path.dirname(app.builder.env.docname))
+    key = None
+    cache = rendercache and rendercache.get_cache(app.builder)
+    datafiles = cache and get_datafiles(text, docdir)
+    if cache and datafiles is not None:
+        key = cache.make_key('gnuplot', 'gnuplot', text,
+                             sorted(options.items()), term, docdir,
+                             datafiles)
+        if cache.fetch(key, outfn):
+            return relfn, outfn, hashid
+
+    ensuredir(path.dirname(outfn))
+
+    job = (text, options, term, docdir, outfn, key)
+    if not get_gnuplot_workers(app.builder.config):
+        run_gnuplot(app.builder, *job)
+        return relfn, outfn, hashid
+
+    env = app.builder.env
+    if not hasattr(env, 'gnuplot_jobs'):
+        env.gnuplot_jobs = {}
+    env.gnuplot_jobs.setdefault(env.docname, {})[outfn] = job
+    submit_gnuplot_job(app.builder, job)
+    return relfn, outfn, hashid
+
+
+# commands which read files or run programs not named in the script text
+_UNCACHEABLE_RE = re.compile(r'\b(?:load|call|system)\b|`|["\']\s*[<|]')
+_QUOTED_RE = re.compile(r'"((?:[^"\\\n]|\\.)*)"|\'([^\'\n]*)\'')
+
+
+def get_datafiles(text, docdir):
+    """
+    Return the names and content digests of the data files read by a plot,
+    or None if the plot can't be cached.
+
+    Every quoted string naming an existing file relative to the document
+    directory is taken as a data file. Plots which load other scripts, read
+    from pipes or run programs may read files not named in the text, so
+    they are never cached.
+    """
+    if _UNCACHEABLE_RE.search(text):
+        return None
+    datafiles = []
+    for m in _QUOTED_RE.finditer(text):
+        name = m.group(1) if m.group(1) is not None else m.group(2)
+        fn = path.join(docdir, name)
+        if not name or not path.isfile(fn):
+            continue
+        f = open(fn, 'rb')
+        try:
+            datafiles.append((name, sha(f.read()).hexdigest()))
+        finally:
+            f.close()
+    return datafiles
+
+
+def run_gnuplot(builder, text, options, term, docdir, outfn, key):
     try:
         plot = Popen('gnuplot -persist', shell=True, bufsize=64, stdin=PIPE)
         if docdir:
@@ -135,14 +203,117 @@ def render_gnuplot(app, text, options):
         plot.stdin.write("set output '%s'\n" % (outfn,))
         plot.stdin.write("%s\n" % text)
         plot.stdin.write("\nquit\n")
-        plot.stdin.flush()
+        plot.stdin.close()
     except Exception, e:
         raise GnuplotError(str(e))
 
-    return relfn, outfn, hashid
+    # the image is complete only once gnuplot has exited
+    if plot.wait() != 0:
+        if path.isfile(outfn):
+            os.unlink(outfn)
+        raise GnuplotError('gnuplot exited with status %d' % plot.returncode)
+
+    cache = rendercache and rendercache.get_cache(builder)
+    if cache and key:
+        cache.store(key, outfn)
+
+
+def get_gnuplot_workers(config):
+    workers = config.gnuplot_workers
+    if workers is None:
+        try:
+            workers = multiprocessing.cpu_count()
+        except NotImplementedError:
+            workers = 1
+    return int(workers)
+
+
+def init_gnuplot_pool(app):
+    app.builder._gnuplot_pool = None
+    app.builder._gnuplot_pid = os.getpid()
+    app.builder._gnuplot_results = {}
+
+
+def submit_gnuplot_job(builder, job):
+    # Documents read in parallel are read by forked processes, which cannot
+    # use the pool: their jobs are merged into the environment and
+    # submitted by wait_gnuplot_images.
+    if os.getpid() != builder._gnuplot_pid:
+        return
+    outfn = job[4]
+    if outfn in builder._gnuplot_results:
+        return
+    if builder._gnuplot_pool is None:
+        builder._gnuplot_pool = ThreadPool(
+            get_gnuplot_workers(builder.config))
+    builder._gnuplot_results[outfn] = builder._gnuplot_pool.apply_async(
+        run_gnuplot, (builder,) + job)
+
+
+def purge_gnuplot_jobs(app, env, docname):
+    if hasattr(env, 'gnuplot_jobs'):
+        env.gnuplot_jobs.pop(docname, None)
+
+
+def merge_gnuplot_jobs(app, env, docnames, other):
+    if not hasattr(other, 'gnuplot_jobs'):
+        return
+    if not hasattr(env, 'gnuplot_jobs'):
+        env.gnuplot_jobs = {}
+    for docname in docnames:
+        if docname in other.gnuplot_jobs:
+            env.gnuplot_jobs[docname] = other.gnuplot_jobs[docname]
+
+
+def wait_gnuplot_images(app, env):
+    """Block until all images submitted to the pool are rendered"""
+    builder = app.builder
+    for docname in sorted(getattr(env, 'gnuplot_jobs', {})):
+        for outfn, job in sorted(env.gnuplot_jobs[docname].items()):
+            if not path.isfile(outfn):
+                submit_gnuplot_job(builder, job)
+
+    results = builder._gnuplot_results
+    builder._gnuplot_results = {}
+    try:
+        if results:
+            app.info('waiting for %d gnuplot images... ' % len(results),
+                     nonl=True)
+            for outfn, result in sorted(results.items()):
+                try:
+                    result.get()
+                except GnuplotError, exc:
+                    builder.warn('gnuplot error: ' + str(exc))
+                except Exception, exc:
+                    builder.warn('gnuplot failed to render %s: %s'
+                                 % (outfn, exc))
+            app.info('done')
+    finally:
+        if builder._gnuplot_pool is not None:
+            builder._gnuplot_pool.close()
+            builder._gnuplot_pool.join()
+            builder._gnuplot_pool = None
+
+
+def fallback_gnuplot_images(app, doctree, docname):
+    """Show the source of plots which could not be rendered"""
+    for img in doctree.traverse(nodes.image):
+        if not hasattr(img, 'gnuplot') or 'outfn' not in img.gnuplot:
+            continue
+        if not path.isfile(img.gnuplot['outfn']):
+            text = img.gnuplot['text']
+            img.replace_self(nodes.literal_block(text, text))
 
 
 def setup(app):
     app.add_directive('gnuplot', GnuplotDirective)
+    app.connect('builder-inited', init_gnuplot_pool)
     app.connect('doctree-read', render_gnuplot_images)
+    app.connect('env-purge-doc', purge_gnuplot_jobs)
+    if sphinx.version_info >= (1, 3):
+        app.connect('env-merge-info', merge_gnuplot_jobs)
+    app.connect('env-updated', wait_gnuplot_images)
+    app.connect('doctree-resolved', fallback_gnuplot_images)
     app.add_config_value('gnuplot_format', DEFAULT_FORMATS, 'html')
+    app.add_config_value('gnuplot_workers', None, '')
+    return {'parallel_read_safe': True}
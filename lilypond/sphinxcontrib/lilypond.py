@@ -14,9 +14,13 @@
     Note: The extension has only very basic support for LaTeX builder.
 """
 
+import re
 import shutil
+import struct
 import tempfile
 import posixpath
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from os import path
 from subprocess import Popen, PIPE
 try:
@@ -26,10 +30,17 @@ except ImportError:
 
 from docutils import nodes, utils
 from docutils.parsers.rst import directives
+import sphinx
 from sphinx.util.compat import Directive
 
 from sphinx.errors import SphinxError
 from sphinx.util import ensuredir
+from sphinx.util.png import read_png_depth, write_png_depth
+
+try:
+    from sphinxcontrib import rendercache
+except ImportError:
+    rendercache = None
 
 class LilyExtError(SphinxError):
     category = 'Lilypond extension error'
@@ -68,6 +79,13 @@ Directive_BACK = r"""
 >> }
 """
 
+BOOK = r'''
+\book {
+  \bookOutputName "%s"
+%s
+}
+'''
+
 class lily(nodes.Inline, nodes.TextElement):
     pass
 
@@ -96,22 +114,128 @@ class LilyDirective(Directive):
         node['nowrap'] = 'nowrap' in self.options
         return [node]
 
+def get_lily_fname(lily):
+    return "%s.png" % sha(lily.encode('utf-8')).hexdigest()
+
+def get_lily_source(builder, lily):
+    music = DOC_HEAD + builder.config.pnglily_preamble + lily
+    if isinstance(music, unicode):
+        music = music.encode('utf-8')
+    return music
+
+def get_lily_cache_key(cache, builder, music):
+    return cache.make_key('lilypond', builder.config.pnglily_lilypond,
+                          music, builder.config.pnglily_lilypond_args)
+
+def get_lilypond_args(builder, tempdir, infn):
+    # use some standard lilypond arguments
+    lilypond_args = [builder.config.pnglily_lilypond]
+    #lilypond_args += ['-o', tempdir, '--png']
+    lilypond_args += ['-dbackend=eps', '-dno-gs-load-fonts', '-dinclude-eps-fonts',
+                      '-o', tempdir, '--png']
+    # add custom ones from config value
+    lilypond_args.extend(builder.config.pnglily_lilypond_args)
+
+    # last, the input file name
+    lilypond_args.append(infn)
+    return lilypond_args
+
+def run_lilypond(builder, lilypond_args):
+    """Run lilypond, returns False if it cannot be run"""
+    try:
+        p = Popen(lilypond_args, stdout=PIPE, stderr=PIPE)
+    except OSError, err:
+        if err.errno != 2:   # No such file or directory
+            raise
+        builder.warn('lilypond command %r cannot be run (needed for music '
+                     'display), check the pnglily_lilypond setting' %
+                     builder.config.pnglily_lilypond)
+        builder._lilypng_warned = True
+        return False
+    stdout, stderr = p.communicate()
+    if p.returncode != 0:
+        raise LilyExtError(u'lilypond exited with error:\n[stderr]\n%s\n'
+                           '[stdout]\n%s' % (stderr.decode('utf-8'), stdout.decode('utf-8')))
+    return True
+
+def get_png_height(fname):
+    f = open(fname, 'rb')
+    try:
+        head = f.read(24)
+    finally:
+        f.close()
+    if len(head) < 24 or head[12:16] != 'IHDR':
+        return None
+    return struct.unpack('>I', head[20:24])[0]
+
+def get_lily_depth(builder, pngfn, epsfn):
+    """Compute the depth of the baseline below the bottom of the image
+
+    The bounding box of the system written by the eps backend is relative
+    to its reference point, which for markups is the baseline.  The depth
+    is only known if the image is cropped to that system.
+    """
+    try:
+        f = open(epsfn, 'r')
+        try:
+            m = re.search(r'^%%BoundingBox:\s*(\S+)\s+(\S+)\s+(\S+)\s+(\S+)',
+                          f.read(4096), re.M)
+        finally:
+            f.close()
+    except IOError:
+        return None
+    if m is None:
+        return None
+    resolution = 101   # lilypond default
+    for arg in builder.config.pnglily_lilypond_args:
+        if arg.startswith('-dresolution='):
+            resolution = int(arg.split('=', 1)[1])
+    lly, ury = float(m.group(2)), float(m.group(4))
+    height = get_png_height(pngfn)
+    if height is None or abs((ury - lly) * resolution / 72.0 - height) > 2:
+        return None
+    return max(0, int(round(-lly * resolution / 72.0)))
+
+def store_lily_image(builder, tempdir, basename, outfn):
+    """Copy the image lilypond wrote for basename in tempdir to outfn
+
+    The depth of the baseline is stored in the image, so that cached images
+    are aligned without running lilypond again.
+    """
+    pngfn = path.join(tempdir, basename + '.png')
+    if not path.isfile(pngfn):
+        return False
+    ensuredir(path.dirname(outfn))
+    shutil.copyfile(pngfn, outfn)
+    depth = get_lily_depth(builder, pngfn,
+                           path.join(tempdir, basename + '-1.eps'))
+    if depth is not None:
+        write_png_depth(outfn, depth)
+    return True
+
 def render_lily(self, lily):
     """
     Render the Lilypond music expression *lily* using lilypond.
+
+    Returns the relative file name and the depth of the baseline, which is
+    None if unknown.
     """
-    shasum = "%s.png" % sha(lily.encode('utf-8')).hexdigest()
+    shasum = get_lily_fname(lily)
     relfn = posixpath.join(self.builder.imgpath, 'lily', shasum)
     outfn = path.join(self.builder.outdir, '_images', 'lily', shasum)
     if path.isfile(outfn):
-        return relfn
+        return relfn, read_png_depth(outfn)
 
     if hasattr(self.builder, '_lilypng_warned'):
         return None, None
 
-    music = DOC_HEAD + self.builder.config.pnglily_preamble + lily
-    if isinstance(music, unicode):
-        music = music.encode('utf-8')
+    music = get_lily_source(self.builder, lily)
+
+    cache = rendercache and rendercache.get_cache(self.builder)
+    if cache:
+        key = get_lily_cache_key(cache, self.builder, music)
+        if cache.fetch(key, outfn):
+            return relfn, read_png_depth(outfn)
 
     # use only one tempdir per build -- the use of a directory is cleaner
     # than using temporary files, since we can clean up everything at once
@@ -125,36 +249,159 @@ def render_lily(self, lily):
     tf.write(music)
     tf.close()
 
-    ensuredir(path.dirname(outfn))
-    # use some standard lilypond arguments
-    lilypond_args = [self.builder.config.pnglily_lilypond]
-    #lilypond_args += ['-o', tempdir, '--png']
-    lilypond_args += ['-dbackend=eps', '-dno-gs-load-fonts', '-dinclude-eps-fonts',
-                      '-o', tempdir, '--png']
-    # add custom ones from config value
-    lilypond_args.extend(self.builder.config.pnglily_lilypond_args)
-
-    # last, the input file name
-    lilypond_args.append(path.join(tempdir, 'music.ly'))
-    try:
-        p = Popen(lilypond_args, stdout=PIPE, stderr=PIPE)
-    except OSError, err:
-        if err.errno != 2:   # No such file or directory
-            raise
-        self.builder.warn('lilypond command %r cannot be run (needed for music '
-                          'display), check the pnglily_lilypond setting' %
-                          self.builder.config.pnglily_lilypond)
-        self.builder._lilypng_warned = True
+    lilypond_args = get_lilypond_args(self.builder, tempdir,
+                                      path.join(tempdir, 'music.ly'))
+    if not run_lilypond(self.builder, lilypond_args):
         return None, None
-    stdout, stderr = p.communicate()
-    if p.returncode != 0:
-        raise LilyExtError(u'lilypond exited with error:\n[stderr]\n%s\n'
-                           '[stdout]\n%s' % (stderr.decode('utf-8'), stdout.decode('utf-8')))
 
-    shutil.copyfile(path.join(tempdir, 'music.png'), outfn)
+    if not store_lily_image(self.builder, tempdir, 'music', outfn):
+        raise LilyExtError(u'lilypond did not write an image of the music, '
+                           'it may be longer than one page')
+    if cache:
+        cache.store(key, outfn)
     #Popen(['mogrify', '-trim', outfn], stdout=PIPE, stderr=PIPE)
 
-    return relfn
+    return relfn, read_png_depth(outfn)
+
+def render_lily_batch(builder, musics):
+    """Render many snippets by one lilypond run
+
+    Every snippet is a separate book, written to a file named by its sha
+    key.  Images which are missing afterwards, e.g. because lilypond failed
+    on some snippet, are rendered one by one while writing.
+    """
+    cache = rendercache and rendercache.get_cache(builder)
+    books = []
+    outfns = {}
+    for music in musics:
+        shasum = get_lily_fname(music)
+        outfn = path.join(builder.outdir, '_images', 'lily', shasum)
+        if path.isfile(outfn):
+            continue
+        if cache:
+            key = get_lily_cache_key(cache, builder,
+                                     get_lily_source(builder, music))
+            if cache.fetch(key, outfn):
+                continue
+        else:
+            key = None
+        basename = shasum[:-len('.png')]
+        if isinstance(music, unicode):
+            music = music.encode('utf-8')
+        books.append(BOOK % (basename, music))
+        outfns[basename] = (outfn, key)
+    if not books:
+        return
+
+    # the preamble is common to all books; it is not part of them as it may
+    # contain things which are only valid at toplevel
+    head = DOC_HEAD + builder.config.pnglily_preamble
+    if isinstance(head, unicode):
+        head = head.encode('utf-8')
+    tempdir = tempfile.mkdtemp()
+    try:
+        infn = path.join(tempdir, 'batch.ly')
+        tf = open(infn, 'w')
+        tf.write(head + ''.join(books))
+        tf.close()
+        try:
+            run_lilypond(builder, get_lilypond_args(builder, tempdir, infn))
+        except LilyExtError:
+            # keep the books which were written
+            pass
+        for basename, (outfn, key) in outfns.items():
+            if store_lily_image(builder, tempdir, basename, outfn) and key:
+                cache.store(key, outfn)
+    finally:
+        shutil.rmtree(tempdir, True)
+
+def get_lily_music(builder, node):
+    """Return the full lilypond expression rendered for node"""
+    if isinstance(node, lily):
+        music = Inline_HEAD % builder.config.pnglily_fontsize[0]
+        music += node['music'] + Inline_BACK
+        #music += '#"' + node['music'] + '"' + Inline_BACK
+    elif node['nowrap']:
+        music = node['music']
+    else:
+        music = Directive_HEAD % (builder.config.pnglily_fontsize[1],
+                                  builder.config.pnglily_fontsize[1])
+        music += node['music'] + Directive_BACK
+    return music
+
+def collect_lily_sources(app, doctree):
+    if not app.config.pnglily_batch_size:
+        return
+    env = app.builder.env
+    if not hasattr(env, 'lily_sources'):
+        env.lily_sources = {}
+    sources = set()
+    for node in doctree.traverse(lambda n: isinstance(n, (lily, displaylily))):
+        sources.add(get_lily_music(app.builder, node))
+    if sources:
+        env.lily_sources[env.docname] = sources
+    else:
+        env.lily_sources.pop(env.docname, None)
+
+def purge_lily_sources(app, env, docname):
+    if hasattr(env, 'lily_sources'):
+        env.lily_sources.pop(docname, None)
+
+def merge_lily_sources(app, env, docnames, other):
+    if not hasattr(other, 'lily_sources'):
+        return
+    if not hasattr(env, 'lily_sources'):
+        env.lily_sources = {}
+    for docname in docnames:
+        if docname in other.lily_sources:
+            env.lily_sources[docname] = other.lily_sources[docname]
+
+def get_lily_batch_workers(config):
+    workers = config.pnglily_batch_workers
+    if workers is None:
+        try:
+            workers = multiprocessing.cpu_count()
+        except NotImplementedError:
+            workers = 1
+    return int(workers)
+
+def prerender_lily(app, env):
+    """Render all snippets of the build in batches before writing"""
+    batch_size = app.config.pnglily_batch_size
+    if not batch_size or app.builder.format != 'html':
+        return
+
+    musics = set()
+    for sources in getattr(env, 'lily_sources', {}).values():
+        musics.update(sources)
+    musics = [music for music in sorted(musics)
+              if not path.isfile(path.join(app.builder.outdir, '_images',
+                                           'lily', get_lily_fname(music)))]
+    if not musics:
+        return
+
+    batches = [musics[i:i + batch_size]
+               for i in range(0, len(musics), batch_size)]
+
+    def render(batch):
+        try:
+            render_lily_batch(app.builder, batch)
+        except Exception, err:
+            app.verbose('lilypond batch rendering failed: %s' % err)
+
+    app.info('rendering %d lilypond snippets... ' % len(musics), nonl=True)
+    workers = min(get_lily_batch_workers(app.config), len(batches))
+    if workers > 1:
+        pool = ThreadPool(workers)
+        try:
+            pool.map(render, batches)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for batch in batches:
+            render(batch)
+    app.info('done')
 
 def cleanup_tempdir_lily(app, exc):
     if exc:
@@ -175,11 +422,9 @@ def latex_visit_displaylily(self, node):
     raise nodes.SkipNode
 
 def html_visit_lily(self, node):
-    music = Inline_HEAD % self.builder.config.pnglily_fontsize[0]
-    music += node['music'] + Inline_BACK
-    #music += '#"' + node['music'] + '"' + Inline_BACK
+    music = get_lily_music(self.builder, node)
     try:
-        fname = render_lily(self, music)
+        fname, depth = render_lily(self, music)
     except LilyExtError, exc:
         sm = nodes.system_message(unicode(exc), type='WARNING', level=2,
                                   backrefs=[], source=node['music'])
@@ -190,22 +435,22 @@ def html_visit_lily(self, node):
         # something failed -- use text-only as a bad substitute
         self.body.append('<span class="lily">%s</span>' %
                          self.encode(node['music']).strip())
-    else:
+    elif depth is None:
         self.body.append(
             '<img class="lily" src="%s" alt="%s" align="absbottom"/>' %
             (fname, self.encode(node['music']).strip()))
+    else:
+        self.body.append(
+            '<img class="lily" src="%s" alt="%s" '
+            'style="vertical-align: %dpx"/>' %
+            (fname, self.encode(node['music']).strip(), -depth))
     raise nodes.SkipNode
 
 
 def html_visit_displaylily(self, node):
-    if node['nowrap']:
-        music = node['music']
-    else:
-        music = Directive_HEAD % (self.builder.config.pnglily_fontsize[1],
-                                  self.builder.config.pnglily_fontsize[1])
-        music += node['music'] + Directive_BACK
+    music = get_lily_music(self.builder, node)
     try:
-        fname = render_lily(self, music)
+        fname, depth = render_lily(self, music)
     except LilyExtError, exc:
         sm = nodes.system_message(unicode(exc), type='WARNING', level=2,
                                   backrefs=[], source=node['music'])
@@ -238,4 +483,11 @@ def setup(app):
     app.add_config_value('pnglily_fontsize', ['10', '-3'], False)
     app.add_config_value('pnglily_lilypond', 'lilypond', False)
     app.add_config_value('pnglily_lilypond_args', [], False)
+    app.add_config_value('pnglily_batch_size', 0, False)
+    app.add_config_value('pnglily_batch_workers', None, False)
+    app.connect('doctree-read', collect_lily_sources)
+    app.connect('env-purge-doc', purge_lily_sources)
+    if sphinx.version_info >= (1, 3):
+        app.connect('env-merge-info', merge_lily_sources)
+    app.connect('env-updated', prerender_lily)
     app.connect('build-finished', cleanup_tempdir_lily)
@@ -12,6 +12,7 @@
 import os
 import re
 import sys
+import hashlib
 from copy import copy
 
 # Pygments MatlabLexer is in pygments.lexers.math, but recommended way to load
@@ -23,7 +24,7 @@ from pygments.token import Token
 MAT_DOM = 'MATLAB-domain'
 __all__ = ['MatObject', 'MatModule', 'MatFunction', 'MatClass',  \
            'MatProperty', 'MatMethod', 'MatScript', 'MatException', \
-           'MatModuleAnalyzer', 'MAT_DOM']
+           'MatModuleAnalyzer', 'MatSourceIndex', 'MatTokenCache', 'MAT_DOM']
 
 # TODO: use `self.tokens.pop()` instead of idx += 1, see MatFunction
 
@@ -62,6 +63,21 @@ class MatObject(object):
     sphinx_env = None
     sphinx_app = None
     sphinx_dbg = dbg
+    #: :class:`MatSourceIndex` of :attr:`MatObject.basedir`
+    index = None
+    #: :class:`MatTokenCache` of parsed mfiles
+    token_cache = None
+
+    @staticmethod
+    def get_index():
+        """
+        Returns the :class:`MatSourceIndex` of :attr:`MatObject.basedir`,
+        scanning the folder the first time it is asked for.
+        """
+        index = MatObject.index
+        if index is None or index.basedir != MatObject.basedir:
+            index = MatObject.index = MatSourceIndex(MatObject.basedir)
+        return index
 
     def __init__(self, name):
         #: name of MATLAB object
@@ -117,8 +133,9 @@ class MatObject(object):
         path, name = os.path.split(objname)
         # make a full path out of basedir and objname
         fullpath = os.path.join(MatObject.basedir, objname)  # objname fullpath
+        index = MatObject.get_index()
         # package folders imported over mfile with same name
-        if os.path.isdir(fullpath):
+        if index.isdir(fullpath):
             mod = sys.modules.get(package)
             if mod:
                 msg = '[%s] mod %s already loaded.'
@@ -128,7 +145,7 @@ class MatObject(object):
                 msg = '[%s] matlabify %s from\n\t%s.'
                 MatObject.sphinx_dbg(msg, MAT_DOM, package, fullpath)
                 return MatModule(name, fullpath, package)  # import package
-        elif os.path.isfile(fullpath + '.m'):
+        elif index.isfile(fullpath + '.m'):
             mfile = fullpath + '.m'
             return MatObject.parse_mfile(mfile, name, path)  # parse mfile
         return None
@@ -150,9 +167,34 @@ class MatObject(object):
         "classdef" or "function" otherwise it is assumed to be a script.
         """
         # use Pygments to parse mfile to determine type: function/classdef
-        # read mfile code
-        with open(mfile, 'r') as code_f:
-            code = code_f.read().replace('\r\n', '\n')  # repl crlf with lf
+        if MatObject.token_cache is None:
+            MatObject.token_cache = MatTokenCache()
+        tks = MatObject.token_cache.get_tokens(mfile)
+        modname = path.replace(os.sep, '.')  # module name
+        # assume that functions and classes always start with a keyword
+        if tks[0] == (Token.Keyword, 'function'):
+            MatObject.sphinx_dbg('[%s] parsing function %s from %s.', MAT_DOM,
+                                 name, modname)
+            return MatFunction(name, modname, tks)
+        elif tks[0] == (Token.Keyword, 'classdef'):
+            MatObject.sphinx_dbg('[%s] parsing classdef %s from %s.', MAT_DOM,
+                                 name, modname)
+            return MatClass(name, modname, tks)
+        else:
+            # it's a script file
+            return MatScript(name, modname, tks)
+        return None
+
+    @staticmethod
+    def tokenize(code):
+        """
+        Use Pygments to tokenize the code of an mfile.
+
+        :param code: Contents of mfile.
+        :type code: str
+        :returns: List of tokens.
+        """
+        code = code.replace('\r\n', '\n')  # repl crlf with lf
         # functions must be contained in one line, no ellipsis, classdef is OK
         pat = r"""^[ \t]*function[ \t.\n]*  # keyword (function)
                   (\[?[\w, \t.\n]*\]?)      # outputs: group(1)
@@ -171,21 +213,7 @@ class MatObject(object):
         code = pat.sub(repl, code)  # search for functions and apply replacement
         msg = '[%s] replaced ellipsis & appended parentheses in function signatures'
         MatObject.sphinx_dbg(msg, MAT_DOM)
-        tks = list(MatlabLexer().get_tokens(code))  # tokenenize code
-        modname = path.replace(os.sep, '.')  # module name
-        # assume that functions and classes always start with a keyword
-        if tks[0] == (Token.Keyword, 'function'):
-            MatObject.sphinx_dbg('[%s] parsing function %s from %s.', MAT_DOM,
-                                 name, modname)
-            return MatFunction(name, modname, tks)
-        elif tks[0] == (Token.Keyword, 'classdef'):
-            MatObject.sphinx_dbg('[%s] parsing classdef %s from %s.', MAT_DOM,
-                                 name, modname)
-            return MatClass(name, modname, tks)
-        else:
-            # it's a script file
-            return MatScript(name, modname, tks)
-        return None
+        return list(MatlabLexer().get_tokens(code))  # tokenenize code
 
 
 # TODO: get docstring and __all__ from contents.m if exists
@@ -213,22 +241,10 @@ class MatModule(MatObject):
 
     def safe_getmembers(self):
         results = []
-        for key in os.listdir(self.path):
-            # make full path
-            path = os.path.join(self.path, key)
-            # don't visit vcs directories
-            if os.path.isdir(path) and key in ['.git', '.hg', '.svn', '.bzr']:
-                continue
-            # only visit mfiles
-            if os.path.isfile(path) and not key.endswith('.m'):
-                continue
-            # trim file extension
-            if os.path.isfile(path):
-                key, _ = os.path.splitext(key)
-            if not results or key not in zip(*results)[0]:
-                value = self.getter(key, None)
-                if value:
-                    results.append((key, value))
+        for key in MatObject.get_index().members(self.path):
+            value = self.getter(key, None)
+            if value:
+                results.append((key, value))
         results.sort()
         return results
 
@@ -903,18 +919,10 @@ class MatClass(MatMixin, MatObject):
     def __bases__(self):
         bases_ = dict.fromkeys(self.bases)  # make copy of bases
         num_pths = len(MatObject.basedir.split(os.sep))
-        # walk tree to find bases
-        for root, dirs, files in os.walk(MatObject.basedir):
+        # search tree, as walked by the index, to find bases
+        for root, dirs, files in MatObject.get_index().tree:
             # namespace defined by root, doesn't include basedir
             root_mod = '.'.join(root.split(os.sep)[num_pths:])
-            # don't visit vcs directories
-            for vcs in ['.git', '.hg', '.svn', '.bzr']:
-                if vcs in dirs:
-                    dirs.remove(vcs)
-            # only visit mfiles
-            for f in tuple(files):
-                if not f.endswith('.m'):
-                    files.remove(f)
             # search folders
             for b in self.bases:
                 # search folders
@@ -1030,6 +1038,172 @@ class MatcodeError(Exception):
         return res
 
 
+class MatSourceIndex(object):
+    """
+    Index of the folders and mfiles in the MATLAB source folder, made by
+    walking it once so that looking up a MATLAB object doesn't stat the
+    filesystem.
+
+    :param basedir: Folder containing MATLAB sources, ``matlab_src_dir``.
+    :type basedir: str
+
+    Folders reached through symbolic links aren't walked. Paths in them are
+    looked up on the filesystem as before.
+    """
+    #: version control folders, which are not walked
+    vcs_dirs = ['.git', '.hg', '.svn', '.bzr']
+
+    def __init__(self, basedir):
+        #: MATLAB source folder
+        self.basedir = basedir
+        #: full paths of all folders in the walked folders
+        self.folders = set()
+        #: full paths of all mfiles in the walked folders
+        self.mfiles = set()
+        #: walked folders: (full path, folder names, mfile names)
+        self.tree = []
+        #: names of the folders and mfiles, without extension, by folder
+        self._members = {}
+        for root, dirs, files in os.walk(basedir):
+            self.folders.update(os.path.join(root, d) for d in dirs)
+            # don't visit vcs directories
+            for vcs in self.vcs_dirs:
+                if vcs in dirs:
+                    dirs.remove(vcs)
+            # only visit mfiles
+            files = [f for f in files if f.endswith('.m')]
+            self.mfiles.update(os.path.join(root, f) for f in files)
+            self.tree.append((root, dirs, files))
+            members = self.list_members(dirs, files)
+            self._members[root] = self._members[os.path.normpath(root)] = \
+                members
+
+    @staticmethod
+    def list_members(dirs, files):
+        """
+        Returns names of folders and mfiles without the extension, folders
+        first and each name once.
+        """
+        members = []
+        seen = set()
+        for key in dirs + [os.path.splitext(f)[0] for f in files]:
+            if key not in seen:
+                seen.add(key)
+                members.append(key)
+        return members
+
+    def _is_walked(self, path):
+        return os.path.dirname(path) in self._members
+
+    def isdir(self, path):
+        """
+        Returns ``True`` if path is a folder.
+        """
+        if self._is_walked(path):
+            return path in self.folders
+        return os.path.isdir(path)
+
+    def isfile(self, path):
+        """
+        Returns ``True`` if path is an mfile.
+        """
+        if self._is_walked(path):
+            return path in self.mfiles
+        return os.path.isfile(path)
+
+    def members(self, path):
+        """
+        Returns names of folders, other than version control folders, and
+        mfiles without the extension in a folder.
+        """
+        if path in self._members:
+            return self._members[path]
+        dirs, files = [], []
+        for key in os.listdir(path):
+            if os.path.isdir(os.path.join(path, key)):
+                if key not in self.vcs_dirs:
+                    dirs.append(key)
+            elif key.endswith('.m'):
+                files.append(key)
+        return self.list_members(dirs, files)
+
+
+class MatTokenCache(object):
+    """
+    Tokens of mfiles, kept with the modification time, size and MD5 hash of
+    each mfile so that it is tokenized again only if it changed.
+
+    The cache is saved with the Sphinx build environment, so it persists
+    between builds. Token types are stored by name, because the types
+    Pygments compares by identity can't be pickled.
+    """
+    def __init__(self):
+        #: (mtime, size, md5, tokens) by full path of mfile
+        self.entries = {}
+
+    def get_tokens(self, mfile):
+        """
+        Returns the tokens of an mfile, tokenizing it if it changed.
+
+        :param mfile: Full path of mfile.
+        :type mfile: str
+        """
+        stat = os.stat(mfile)
+        entry = self.entries.get(mfile)
+        if entry and entry[:2] == (stat.st_mtime, stat.st_size):
+            return self.load(entry[3])
+        with open(mfile, 'r') as code_f:
+            code = code_f.read()
+        digest = hashlib.md5(code).hexdigest()
+        if entry and entry[2] == digest:
+            packed = entry[3]  # touched, but not changed
+            tks = self.load(packed)
+        else:
+            tks = MatObject.tokenize(code)
+            packed = self.dump(tks)
+        self.entries[mfile] = (stat.st_mtime, stat.st_size, digest, packed)
+        return tks
+
+    @staticmethod
+    def dump(tks):
+        """
+        Returns tokens with the names of their Pygments token types.
+        """
+        names = {}
+        packed = []
+        for ttype, value in tks:
+            ttype_names = names.get(ttype)
+            if ttype_names is None:
+                ttype_names = names[ttype] = tuple(ttype)
+            packed.append((ttype_names, value))
+        return packed
+
+    @staticmethod
+    def load(packed):
+        """
+        Returns tokens with the Pygments token types of their names.
+        """
+        ttypes = {}
+        tks = []
+        for names, value in packed:
+            ttype = ttypes.get(names)
+            if ttype is None:
+                ttype = Token
+                for name in names:
+                    ttype = getattr(ttype, name)
+                ttypes[names] = ttype
+            tks.append((ttype, value))
+        return tks
+
+    def prune(self):
+        """
+        Forget mfiles which don't exist anymore.
+        """
+        for mfile in self.entries.keys():
+            if not os.path.isfile(mfile):
+                del self.entries[mfile]
+
+
 class MatModuleAnalyzer(object):
     # cache for analyzer objects -- caches both by module and file name
     cache = {}
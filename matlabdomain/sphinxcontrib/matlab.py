@@ -711,6 +711,23 @@ class MATLABDomain(Domain):
         for refname, (docname, type) in self.data['objects'].iteritems():
             yield (refname, refname, type, docname, refname, 1)
 
+def init_mat_sources(app):
+    """
+    Use the token cache saved with the environment and scan the MATLAB
+    sources again.
+    """
+    env = app.env
+    if not isinstance(getattr(env, 'matlab_token_cache', None),
+                      doc.MatTokenCache):
+        env.matlab_token_cache = doc.MatTokenCache()
+    doc.MatObject.token_cache = env.matlab_token_cache
+    doc.MatObject.index = None
+
+
+def prune_mat_tokens(app, env):
+    env.matlab_token_cache.prune()
+
+
 def setup(app):
     app.override_domain(StandardDomain)
     app.add_domain(MATLABDomain)
@@ -726,3 +743,5 @@ def setup(app):
     app.add_autodocumenter(doc.MatMethodDocumenter)
     app.add_autodocumenter(doc.MatAttributeDocumenter)
     app.add_autodocumenter(doc.MatInstanceAttributeDocumenter)
+    app.connect('builder-inited', init_mat_sources)
+    app.connect('env-updated', prune_mat_tokens)
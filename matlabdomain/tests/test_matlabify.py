@@ -86,6 +86,52 @@ def test_method():
     eq_(mymethod.getter('__name__'), 'mymethod')
     return my_cls_meth, constructor, mymethod
 
+
+def test_source_index():
+    """
+    test index of folders and mfiles
+    """
+    index = doc.MatSourceIndex(DIRNAME)
+    test_data = os.path.join(DIRNAME, 'test_data')
+    ok_(index.isdir(test_data))
+    ok_(index.isdir(os.path.join(test_data, '+myPackage')))
+    ok_(index.isdir(os.path.join(test_data, '@myClassFolder')))
+    ok_(index.isfile(os.path.join(test_data, 'myfun.m')))
+    ok_(not index.isfile(os.path.join(test_data, 'myfun')))
+    ok_(not index.isdir(os.path.join(test_data, 'no_such_folder')))
+    eq_(sorted(index.members(test_data)),
+        ['+myPackage', '@myClassFolder', 'EllipsisProperties',
+         'MyAbstractClass', 'MyClass', 'MyHandleClass', 'myfun',
+         'test_submodule'])
+    eq_(sorted(index.members(os.path.join(test_data, '@myClassFolder'))),
+        ['classMethod', 'myClassFolder', 'my_static_func'])
+    # folders over mfiles with the same name
+    eq_(doc.MatSourceIndex.list_members(['b', 'a'], ['a.m', 'c.m']),
+        ['b', 'a', 'c'])
+
+
+def test_token_cache():
+    """
+    test tokens of mfiles are cached
+    """
+    cache = doc.MatTokenCache()
+    mfile = os.path.join(DIRNAME, 'test_data', 'myfun.m')
+    tks = cache.get_tokens(mfile)
+    ok_(mfile in cache.entries)
+    # cached tokens have the same token types, which are compared by identity
+    cached_tks = cache.get_tokens(mfile)
+    eq_(tks, cached_tks)
+    ok_(all(tk[0] is cached_tk[0] for tk, cached_tk in zip(tks, cached_tks)))
+    # a touched mfile is only tokenized again if its contents changed
+    mtime, size, digest, packed = cache.entries[mfile]
+    cache.entries[mfile] = (mtime - 1, size, digest, packed[:1])
+    eq_(cache.get_tokens(mfile), tks[:1])
+    cache.entries[mfile] = (mtime - 1, size, 'changed', packed[:1])
+    eq_(cache.get_tokens(mfile), tks)
+    cache.entries['no_such_file.m'] = cache.entries[mfile]
+    cache.prune()
+    eq_(cache.entries.keys(), [mfile])
+
 if __name__ == '__main__':
     m, my_cls, x, my_abc, y, version = test_matlabify_class()
 
@@ -13,7 +13,12 @@
 """
 
 import sys
+import errno
+import time
+import threading
 import posixpath
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from os import path
 from subprocess import Popen, PIPE
 try:
@@ -23,10 +28,16 @@ except ImportError:
 
 from docutils import nodes
 
+import sphinx
 from sphinx.errors import SphinxError
 from sphinx.util import ensuredir
 from sphinx.util.compat import Directive
 
+try:
+    from sphinxcontrib import rendercache
+except ImportError:
+    rendercache = None
+
 
 class MscgenError(SphinxError):
     category = 'mscgen error'
@@ -68,7 +79,17 @@ class MscgenSimple(Directive):
         return [node]
 
 
+def record_cmd_time(builder, cmd_name, seconds):
+    if not hasattr(builder, '_mscgen_stats'):
+        return
+    with builder._mscgen_stats_lock:
+        stats = builder._mscgen_stats.setdefault(cmd_name, [0, 0.0])
+        stats[0] += 1
+        stats[1] += seconds
+
+
 def run_cmd(builder, cmd, cmd_name, cfg_name, stdin=''):
+    start = time.time()
     try:
         try:
             p = Popen(cmd, stdout=PIPE, stdin=PIPE, stderr=PIPE)
@@ -86,6 +107,7 @@ def run_cmd(builder, cmd, cmd_name, cfg_name, stdin=''):
         builder._mscgen_warned = True
         return False
     stdout, stderr = p.communicate(stdin)
+    record_cmd_time(builder, cmd_name, time.time() - start)
     if p.returncode != 0:
         raise MscgenError('%s exited with error:\n[stderr]\n%s\n'
                             '[stdout]\n%s' % (cmd_name, stderr, stdout))
@@ -114,32 +136,56 @@ def get_map_code(mapfn, id):
     return mapcode
 
 
-def render_msc(self, code, format, prefix='mscgen'):
+def get_msc_fnames(builder, code, format, prefix='mscgen'):
     """
-    Render mscgen code into a PNG or PDF output file.
+    Return the names of the files rendered for mscgen code.
     """
-    hashkey = code.encode('utf-8') + str(self.builder.config.mscgen_args)
+    hashkey = code.encode('utf-8') + str(builder.config.mscgen_args)
     id = sha(hashkey).hexdigest()
     fname = '%s-%s.%s' % (prefix, id, format)
-    if hasattr(self.builder, 'imgpath'):
+    if hasattr(builder, 'imgpath'):
         # HTML
-        relfn = posixpath.join(self.builder.imgpath, fname)
-        outfn = path.join(self.builder.outdir, '_images', fname)
+        relfn = posixpath.join(builder.imgpath, fname)
+        outfn = path.join(builder.outdir, '_images', fname)
         tmpfn = outfn
         mapfn = outfn + '.map'
     else:
         # LaTeX
         relfn = fname
-        outfn = path.join(self.builder.outdir, fname)
+        outfn = path.join(builder.outdir, fname)
         format = 'eps'
         tmpfn = outfn[:-3] + format
+        mapfn = None
+    return id, format, relfn, outfn, tmpfn, mapfn
+
+
+def render_msc(self, code, format, prefix='mscgen'):
+    """
+    Render mscgen code into a PNG or PDF output file.
+    """
+    return render_msc_files(self.builder, code, format, prefix)
+
+
+def render_msc_files(builder, code, format, prefix='mscgen'):
+    id, format, relfn, outfn, tmpfn, mapfn = get_msc_fnames(builder, code,
+                                                            format, prefix)
 
     if path.isfile(outfn):
         return relfn, outfn, id
 
-    if hasattr(self.builder, '_mscgen_warned'):
+    if hasattr(builder, '_mscgen_warned'):
         return None, None, None
 
+    outfns = [outfn]
+    if format == 'png':
+        outfns.append(mapfn)
+    cache = rendercache and rendercache.get_cache(builder)
+    if cache:
+        key = cache.make_key('mscgen', builder.config.mscgen, code,
+                             builder.config.mscgen_args, format)
+        if cache.fetch(key, *outfns):
+            return relfn, outfn, id
+
     ensuredir(path.dirname(outfn))
 
     # mscgen don't support encodings very well. ISO-8859-1 seems to work best,
@@ -147,23 +193,116 @@ def render_msc(self, code, format, prefix='mscgen'):
     if isinstance(code, unicode):
         code = code.encode('iso-8859-1')
 
-    mscgen_args = [self.builder.config.mscgen]
-    mscgen_args.extend(self.builder.config.mscgen_args)
+    mscgen_args = [builder.config.mscgen]
+    mscgen_args.extend(builder.config.mscgen_args)
     mscgen_args.extend(['-T', format, '-o', tmpfn])
-    if not run_cmd(self.builder, mscgen_args, 'mscgen', 'mscgen', code):
+    if not run_cmd(builder, mscgen_args, 'mscgen', 'mscgen', code):
         return None, None, None
 
     if format == 'png':
         mscgen_args = mscgen_args[:-4] + ['-T', 'ismap', '-o', mapfn]
-        if not run_cmd(self.builder, mscgen_args, 'mscgen', 'mscgen', code):
+        if not run_cmd(builder, mscgen_args, 'mscgen', 'mscgen', code):
             return None, None, None
     else: # PDF/EPS
-        if not eps_to_pdf(self.builder, tmpfn, outfn):
+        if not eps_to_pdf(builder, tmpfn, outfn):
             return None, None, None
 
+    if cache:
+        cache.store(key, *outfns)
     return relfn, outfn, id
 
 
+def get_prerender_format(builder):
+    if builder.format == 'html':
+        return 'png'
+    if builder.format == 'latex':
+        return 'pdf'
+    return None
+
+
+def collect_mscgen_sources(app, doctree):
+    if not get_mscgen_workers(app.config):
+        return
+    env = app.builder.env
+    if not hasattr(env, 'mscgen_sources'):
+        env.mscgen_sources = {}
+    sources = set(node['code'] for node in doctree.traverse(mscgen))
+    if sources:
+        env.mscgen_sources[env.docname] = sources
+    else:
+        env.mscgen_sources.pop(env.docname, None)
+
+
+def purge_mscgen_sources(app, env, docname):
+    if hasattr(env, 'mscgen_sources'):
+        env.mscgen_sources.pop(docname, None)
+
+
+def merge_mscgen_sources(app, env, docnames, other):
+    if not hasattr(other, 'mscgen_sources'):
+        return
+    if not hasattr(env, 'mscgen_sources'):
+        env.mscgen_sources = {}
+    for docname in docnames:
+        if docname in other.mscgen_sources:
+            env.mscgen_sources[docname] = other.mscgen_sources[docname]
+
+
+def get_mscgen_workers(config):
+    workers = config.mscgen_workers
+    if workers is None:
+        try:
+            workers = multiprocessing.cpu_count()
+        except NotImplementedError:
+            workers = 1
+    return int(workers)
+
+
+def prerender_mscgen(app, env):
+    """Render all charts of the build on a pool of workers before writing"""
+    format = get_prerender_format(app.builder)
+    workers = get_mscgen_workers(app.config)
+    if format is None or not workers:
+        return
+    codes = set()
+    for sources in getattr(env, 'mscgen_sources', {}).values():
+        codes.update(sources)
+    codes = [code for code in sorted(codes)
+             if not path.isfile(get_msc_fnames(app.builder, code, format)[3])]
+    if not codes:
+        return
+
+    def render(code):
+        try:
+            render_msc_files(app.builder, code, format)
+        except MscgenError, exc:
+            # reported when the chart is written
+            app.verbose('mscgen code %r: %s' % (code, exc))
+
+    app.info('rendering %d mscgen charts... ' % len(codes), nonl=True)
+    pool = ThreadPool(min(workers, len(codes)))
+    try:
+        pool.map(render, codes)
+    finally:
+        pool.close()
+        pool.join()
+    app.info('done')
+
+
+def init_mscgen_stats(app):
+    app.builder._mscgen_stats = {}
+    app.builder._mscgen_stats_lock = threading.Lock()
+
+
+def report_mscgen_stats(app, exc):
+    stats = getattr(app.builder, '_mscgen_stats', None)
+    if not stats:
+        return
+    app.info('mscgen: %s' % ', '.join(
+        '%d runs of %s in %.2fs' % (count, cmd_name, seconds)
+        for cmd_name, (count, seconds) in sorted(stats.items())))
+
+
 def render_msc_html(self, node, code, prefix='mscgen', imgcls=None):
     try:
         fname, outfn, id = render_msc(self, code, 'png', prefix)
@@ -219,4 +358,12 @@ def setup(app):
     app.add_config_value('mscgen_args', [], 'html')
     app.add_config_value('mscgen_epstopdf', 'epstopdf', 'html')
     app.add_config_value('mscgen_epstopdf_args', [], 'html')
+    app.add_config_value('mscgen_workers', None, '')
+    app.connect('builder-inited', init_mscgen_stats)
+    app.connect('doctree-read', collect_mscgen_sources)
+    app.connect('env-purge-doc', purge_mscgen_sources)
+    if sphinx.version_info >= (1, 3):
+        app.connect('env-merge-info', merge_mscgen_sources)
+    app.connect('env-updated', prerender_mscgen)
+    app.connect('build-finished', report_mscgen_stats)
 
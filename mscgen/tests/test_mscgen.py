@@ -0,0 +1,31 @@
+from docutils import nodes
+from mock import Mock
+from nose.tools import *
+
+from sphinxcontrib.mscgen import mscgen, collect_mscgen_sources
+
+def make_app(workers):
+    app = Mock()
+    app.config.mscgen_workers = workers
+    app.builder.env = Mock(spec=['docname'])
+    app.builder.env.docname = 'index'
+    return app
+
+def make_doctree(*codes):
+    doctree = nodes.section()
+    for code in codes:
+        node = mscgen()
+        node['code'] = code
+        doctree += node
+    return doctree
+
+def test_collect_sources_by_default():
+    app = make_app(None)
+    collect_mscgen_sources(app, make_doctree(u'msc {a,b;}', u'msc {a,b;}'))
+    assert_equals(app.builder.env.mscgen_sources,
+                  {'index': set([u'msc {a,b;}'])})
+
+def test_collect_no_sources_without_workers():
+    app = make_app(0)
+    collect_mscgen_sources(app, make_doctree(u'msc {a,b;}'))
+    assert not hasattr(app.builder.env, 'mscgen_sources')
@@ -9,7 +9,9 @@ import sys
 
 from six import PY2, iteritems
 
-from sphinxcontrib.napoleon.docstring import GoogleDocstring, NumpyDocstring
+from sphinxcontrib.napoleon.cache import ClassCache, DocstringCache
+from sphinxcontrib.napoleon.docstring import (GoogleDocstring, NumpyDocstring,
+                                              _docstring_styles)
 from sphinxcontrib.napoleon._version import __version__
 assert __version__  # silence pyflakes
 
@@ -251,6 +253,13 @@ def setup(app):
 
     app.connect('autodoc-process-docstring', _process_docstring)
     app.connect('autodoc-skip-member', _skip_member)
+    app.connect('builder-inited', _init_cache)
+    app.connect('env-purge-doc', _purge_cache)
+    app.connect('env-updated', _prune_cache)
+    # Sphinx<1.3 has neither event, _init_cache starts the counts instead
+    if sphinx.version_info >= (1, 3):
+        app.connect('env-before-read-docs', _begin_cache)
+        app.connect('env-merge-info', _merge_cache)
 
     for name, (default, rebuild) in iteritems(Config._config_values):
         app.add_config_value(name, default, rebuild)
@@ -293,17 +302,94 @@ def _process_docstring(app, what, name, obj, options, lines):
 
         .. note:: `lines` is modified *in place*
 
+    During a Sphinx build the converted lines are kept in a `DocstringCache`
+    in the build environment, so a docstring seen before is not parsed
+    again.
+
     """
+    env = getattr(app, 'env', None)
+    cache = getattr(env, 'napoleon_cache', None)
+    if what and isinstance(cache, DocstringCache):
+        docname = env.temp_data.get('docname')
+        key = cache.make_key(lines, app.config, what, name)
+        result_lines = cache.get(key, docname)
+        if result_lines is None:
+            result_lines = _parse_docstring(lines, app.config, app, what,
+                                            name, obj, options)
+            cache.put(key, result_lines, docname)
+    else:
+        result_lines = _parse_docstring(lines, app.config, app, what, name,
+                                        obj, options)
+    lines[:] = result_lines
+
+
+def _parse_docstring(lines, config, app=None, what='', name='', obj=None,
+                     options=None):
+    """Convert the lines of a docstring to reStructuredText.
+
+    A docstring is parsed by `NumpyDocstring` and then `GoogleDocstring`, as
+    enabled by ``napoleon_numpy_docstring`` and ``napoleon_google_docstring``.
+    A quick pre-scan of the lines tells which styles of sections the
+    docstring may have; the parser of a style that is absent is skipped, as
+    it would only strip trailing whitespace. Attribute docstrings, which both
+    parsers convert, are always parsed twice.
+
+    Returns
+    -------
+    List[str]
+        The converted lines.
+
+    """
+    if name and (what == 'attribute' or what == 'data'):
+        is_numpy = is_google = True
+    else:
+        is_numpy, is_google = _docstring_styles(lines)
     result_lines = lines
-    if app.config.napoleon_numpy_docstring:
-        docstring = NumpyDocstring(result_lines, app.config, app, what, name,
-                                   obj, options)
-        result_lines = docstring.lines()
-    if app.config.napoleon_google_docstring:
-        docstring = GoogleDocstring(result_lines, app.config, app, what, name,
-                                    obj, options)
-        result_lines = docstring.lines()
-    lines[:] = result_lines[:]
+    if config.napoleon_numpy_docstring:
+        if is_numpy:
+            docstring = NumpyDocstring(result_lines, config, app, what, name,
+                                       obj, options)
+            result_lines = docstring.lines()
+        else:
+            result_lines = [line.rstrip() for line in result_lines]
+    if config.napoleon_google_docstring:
+        if is_google:
+            docstring = GoogleDocstring(result_lines, config, app, what, name,
+                                        obj, options)
+            result_lines = docstring.lines()
+        else:
+            result_lines = [line.rstrip() for line in result_lines]
+    return result_lines[:]
+
+
+def _init_cache(app):
+    import sphinx
+    app.napoleon_classes = ClassCache()
+    if not isinstance(getattr(app.env, 'napoleon_cache', None),
+                      DocstringCache):
+        app.env.napoleon_cache = DocstringCache()
+    if sphinx.version_info < (1, 3):
+        app.env.napoleon_cache.begin_build(None)
+
+
+def _begin_cache(app, env, docnames):
+    env.napoleon_cache.begin_build(docnames)
+
+
+def _purge_cache(app, env, docname):
+    env.napoleon_cache.purge_doc(docname)
+
+
+def _merge_cache(app, env, docnames, other):
+    env.napoleon_cache.merge(docnames, other.napoleon_cache)
+
+
+def _prune_cache(app, env):
+    cache = env.napoleon_cache
+    cache.prune()
+    if cache.hits or cache.misses:
+        app.info('napoleon: %d docstrings from the cache, %d converted' %
+                 (cache.hits, cache.misses))
 
 
 def _skip_member(app, what, name, obj, skip, options):
@@ -345,36 +431,37 @@ def _skip_member(app, what, name, obj, skip, options):
         True if the member should be skipped during creation of the docs,
         False if it should be included in the docs.
 
+    During a Sphinx build the classes and the names they define are kept in
+    a `ClassCache` on the application, so each class is looked up once.
+
     """
     has_doc = getattr(obj, '__doc__', False)
     is_member = (what == 'class' or what == 'exception' or what == 'module')
     if name != '__weakref__' and name != '__init__' and has_doc and is_member:
         cls_is_owner = False
         if what == 'class' or what == 'exception':
+            classes = getattr(app, 'napoleon_classes', None)
+            if not isinstance(classes, ClassCache):
+                classes = ClassCache()
             if PY2:
                 cls = getattr(obj, 'im_class', getattr(obj, '__objclass__',
                               None))
-                cls_is_owner = (cls and hasattr(cls, name) and
-                                name in cls.__dict__)
+                cls_is_owner = (cls and classes.defines(cls, name) and
+                                hasattr(cls, name))
             elif sys.version_info >= (3, 3):
                 qualname = getattr(obj, '__qualname__', '')
                 cls_path, _, _ = qualname.rpartition('.')
                 if cls_path:
                     try:
                         if '.' in cls_path:
-                            import importlib
-                            import functools
-
-                            mod = importlib.import_module(obj.__module__)
-                            mod_path = cls_path.split('.')
-                            cls = functools.reduce(getattr, mod_path, mod)
+                            cls = classes.get_class(obj.__module__, cls_path)
                         else:
                             cls = obj.__globals__[cls_path]
                     except Exception:
                         cls_is_owner = False
                     else:
-                        cls_is_owner = (cls and hasattr(cls, name) and
-                                        name in cls.__dict__)
+                        cls_is_owner = (cls and classes.defines(cls, name) and
+                                        hasattr(cls, name))
                 else:
                     cls_is_owner = False
             else:
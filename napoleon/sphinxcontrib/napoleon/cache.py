@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 Rob Ruana
+# Licensed under the BSD License, see LICENSE file for details.
+
+"""Cache of converted docstrings, kept across builds."""
+
+import functools
+import hashlib
+import importlib
+
+from six import iteritems, text_type
+
+from sphinxcontrib.napoleon._version import __version__
+
+
+# The settings which change how a docstring is converted
+_config_names = (
+    'napoleon_google_docstring',
+    'napoleon_numpy_docstring',
+    'napoleon_use_admonition_for_examples',
+    'napoleon_use_admonition_for_notes',
+    'napoleon_use_admonition_for_references',
+    'napoleon_use_ivar',
+    'napoleon_use_param',
+    'napoleon_use_rtype',
+)
+
+
+class DocstringCache(object):
+    """Converted docstrings by the hash of their text and their settings.
+
+    The cache is pickled with the Sphinx build environment. It remembers
+    which documents use which entries, so that when a document is read again
+    its docstrings are looked up instead of parsed, and entries no document
+    uses any more are dropped by `prune`. The same docstring inherited by
+    many classes is converted only once.
+
+    Attributes
+    ----------
+    hits : int
+        The number of docstrings found in the cache while reading the
+        documents of the current build.
+    misses : int
+        The number of docstrings which had to be converted.
+
+    """
+    def __init__(self):
+        self._entries = {}
+        self._keys_by_doc = {}
+        # [hits, misses] by document, None for lookups outside of documents
+        self._counts = {}
+        self._reading = set()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hits(self):
+        return self._count(0)
+
+    @property
+    def misses(self):
+        return self._count(1)
+
+    def _count(self, i):
+        if self._reading is None:
+            return sum(counts[i] for counts in self._counts.values())
+        return sum(self._counts[docname][i] for docname in
+                   self._reading.union([None]) if docname in self._counts)
+
+    def make_key(self, lines, config, what='', name=''):
+        """Return the key of a docstring converted with `config`.
+
+        Only ``what`` and whether there is a ``name`` change how the
+        docstring is converted, besides its text and the settings.
+
+        """
+        text = u'\n'.join(line if isinstance(line, text_type)
+                          else line.decode('utf-8', 'replace')
+                          for line in lines)
+        digest = hashlib.md5(text.encode('utf-8')).hexdigest()
+        settings = tuple(getattr(config, setting, None)
+                         for setting in _config_names)
+        return (digest, what, bool(name), settings, __version__)
+
+    def get(self, key, docname=None):
+        """Return a copy of the cached lines of `key`, or None."""
+        counts = self._counts.setdefault(docname, [0, 0])
+        lines = self._entries.get(key)
+        if lines is None:
+            counts[1] += 1
+            return None
+        counts[0] += 1
+        self._use(key, docname)
+        return list(lines)
+
+    def put(self, key, lines, docname=None):
+        self._entries[key] = tuple(lines)
+        self._use(key, docname)
+
+    def _use(self, key, docname):
+        if docname is not None:
+            self._keys_by_doc.setdefault(docname, set()).add(key)
+
+    def begin_build(self, docnames):
+        """Count the lookups of the documents about to be read afresh.
+
+        With `docnames` None, as on Sphinx<1.3 which does not tell the
+        documents in advance, every lookup from now on is counted.
+
+        """
+        if docnames is None:
+            self._reading = None
+            self._counts.clear()
+        else:
+            self._reading = set(docnames)
+            self._counts.pop(None, None)
+
+    def purge_doc(self, docname):
+        """Forget which entries the document uses."""
+        self._keys_by_doc.pop(docname, None)
+        self._counts.pop(docname, None)
+
+    def merge(self, docnames, other):
+        """Take over the entries of the documents read by another process."""
+        for docname in docnames:
+            keys = other._keys_by_doc.get(docname)
+            if keys:
+                self._keys_by_doc[docname] = set(keys)
+                for key in keys:
+                    self._entries[key] = other._entries[key]
+            if docname in other._counts:
+                self._counts[docname] = list(other._counts[docname])
+
+    def prune(self):
+        """Drop the entries no document uses."""
+        used = set()
+        for docname, keys in iteritems(self._keys_by_doc):
+            used.update(keys)
+        for key in list(self._entries):
+            if key not in used:
+                del self._entries[key]
+
+
+class ClassCache(object):
+    """Classes by their module and qualified name, and the names they define.
+
+    `_skip_member` asks for each member of a class whether the class defines
+    it. The cache is kept on the Sphinx application for one build, so that a
+    class with many members is looked up and its ``__dict__`` listed once.
+
+    """
+    def __init__(self):
+        self._classes = {}
+        # (class, names) by the id of the class
+        self._names = {}
+
+    def get_class(self, module_name, cls_path):
+        """Return the class at the dotted `cls_path` in the module, or None."""
+        key = (module_name, cls_path)
+        try:
+            return self._classes[key]
+        except KeyError:
+            pass
+        try:
+            mod = importlib.import_module(module_name)
+            cls = functools.reduce(getattr, cls_path.split('.'), mod)
+        except Exception:
+            cls = None
+        self._classes[key] = cls
+        return cls
+
+    def defines(self, cls, name):
+        """Return True if `name` is in the ``__dict__`` of `cls`."""
+        entry = self._names.get(id(cls))
+        if entry is None:
+            names = frozenset(getattr(cls, '__dict__', ()))
+            entry = self._names[id(cls)] = (cls, names)
+        return name in entry[1]
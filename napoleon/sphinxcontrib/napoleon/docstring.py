@@ -8,7 +8,7 @@ import collections
 import inspect
 import re
 
-from pockets import modify_iter, UnicodeMixin
+from pockets import UnicodeMixin
 from six import string_types, u
 from six.moves import range
 
@@ -24,6 +24,56 @@ _enumerated_list_regex = re.compile(
     r'(\d+|#|[ivxlcdm]+|[IVXLCDM]+|[a-zA-Z])'
     r'(?(paren)\)|\.)(\s+\S|\s*$)')
 
+_section_names = frozenset([
+    'args', 'arguments', 'attributes', 'example', 'examples', 'keyword args',
+    'keyword arguments', 'methods', 'note', 'notes', 'other parameters',
+    'parameters', 'return', 'returns', 'raises', 'references', 'see also',
+    'todo', 'warning', 'warnings', 'warns', 'yield', 'yields'])
+_numpy_underline_chars = frozenset('=-`:\'"~^_*+#<>')
+
+
+def _docstring_styles(lines):
+    """Pre-scan docstring lines for NumPy and Google style sections.
+
+    The scan is looser than the parsers: it ignores indentation, so a style
+    it does not report is certain to be absent, also from the text the other
+    parser may pass on dedented.
+
+    Parameters
+    ----------
+    lines : List[str]
+        The lines of the docstring.
+
+    Returns
+    -------
+    Tuple[bool, bool]
+        Whether the lines may hold NumPy style sections, and whether they
+        may hold Google style sections.
+
+    """
+    numpy = google = False
+    last = len(lines) - 1
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if stripped[:2] == '..':
+            if stripped.lower().startswith('.. index::'):
+                numpy = True
+        elif stripped[-1] == ':':
+            if (not google and
+                    stripped.strip(':').lower() in _section_names):
+                google = True
+        elif (not numpy and i < last and
+                stripped.lower() in _section_names):
+            underline = lines[i + 1].strip()
+            if (underline[:1] in _numpy_underline_chars and
+                    _numpy_section_regex.match(underline)):
+                numpy = True
+        if numpy and google:
+            break
+    return numpy, google
+
 
 class GoogleDocstring(UnicodeMixin):
     """Convert Google style docstrings to reStructuredText.
@@ -115,7 +165,7 @@ class GoogleDocstring(UnicodeMixin):
         if isinstance(docstring, string_types):
             docstring = docstring.splitlines()
         self._lines = docstring
-        self._line_iter = modify_iter(docstring, modifier=lambda s: s.rstrip())
+        self._init_line_table(docstring)
         self._parsed_lines = []
         self._is_in_section = False
         self._section_indent = 0
@@ -171,33 +221,65 @@ class GoogleDocstring(UnicodeMixin):
         """
         return self._parsed_lines
 
+    def _init_line_table(self, docstring):
+        # The lines are looked at by their index: the right-stripped text,
+        # the indent of each line and of the next non-blank line at or after
+        # it, and whether it is a section header, found the first time it
+        # is asked for.
+        lines = [line.rstrip() for line in docstring]
+        indents = [len(line) - len(line.lstrip()) for line in lines]
+        next_indents = [0] * (len(lines) + 1)
+        for i in range(len(lines) - 1, -1, -1):
+            if lines[i]:
+                next_indents[i] = indents[i]
+            else:
+                next_indents[i] = next_indents[i + 1]
+        self._line_table = lines
+        self._line_indents = indents
+        self._line_next_indents = next_indents
+        self._line_headers = [None] * len(lines) + [False]
+        self._line_count = len(lines)
+        self._line_index = 0
+
+    def _has_next_line(self):
+        return self._line_index < self._line_count
+
+    def _next_line(self):
+        i = self._line_index
+        if i >= self._line_count:
+            raise StopIteration
+        self._line_index = i + 1
+        return self._line_table[i]
+
     def _consume_indented_block(self, indent=1):
-        lines = []
-        line = self._line_iter.peek()
-        while(not self._is_section_break() and
-              (not line or self._is_indented(line, indent))):
-            lines.append(next(self._line_iter))
-            line = self._line_iter.peek()
-        return lines
+        lines = self._line_table
+        indents = self._line_indents
+        start = self._line_index
+        while (not self._is_section_break() and
+               (not lines[self._line_index] or
+                indents[self._line_index] >= indent)):
+            self._line_index += 1
+        return lines[start:self._line_index]
 
     def _consume_contiguous(self):
-        lines = []
-        while (self._line_iter.has_next() and
-               self._line_iter.peek() and
+        lines = self._line_table
+        start = self._line_index
+        while (self._line_index < self._line_count and
+               lines[self._line_index] and
                not self._is_section_header()):
-            lines.append(next(self._line_iter))
-        return lines
+            self._line_index += 1
+        return lines[start:self._line_index]
 
     def _consume_empty(self):
-        lines = []
-        line = self._line_iter.peek()
-        while self._line_iter.has_next() and not line:
-            lines.append(next(self._line_iter))
-            line = self._line_iter.peek()
-        return lines
+        lines = self._line_table
+        start = self._line_index
+        while (self._line_index < self._line_count and
+               not lines[self._line_index]):
+            self._line_index += 1
+        return lines[start:self._line_index]
 
     def _consume_field(self, parse_type=True, prefer_type=False):
-        line = next(self._line_iter)
+        line = self._next_line()
 
         before, colon, after = self._partition_field_on_colon(line)
         _name, _type, _desc = before, '', after
@@ -227,7 +309,7 @@ class GoogleDocstring(UnicodeMixin):
         return fields
 
     def _consume_inline_attribute(self):
-        line = next(self._line_iter)
+        line = self._next_line()
         _type, colon, _desc = self._partition_field_on_colon(line)
         if not colon:
             _type, _desc = _desc, _type
@@ -264,24 +346,23 @@ class GoogleDocstring(UnicodeMixin):
         return lines
 
     def _consume_section_header(self):
-        section = next(self._line_iter)
+        section = self._next_line()
         stripped_section = section.strip(':')
         if stripped_section.lower() in self._sections:
             section = stripped_section
         return section
 
     def _consume_to_end(self):
-        lines = []
-        while self._line_iter.has_next():
-            lines.append(next(self._line_iter))
-        return lines
+        start = self._line_index
+        self._line_index = self._line_count
+        return self._line_table[start:]
 
     def _consume_to_next_section(self):
         self._consume_empty()
-        lines = []
+        start = self._line_index
         while not self._is_section_break():
-            lines.append(next(self._line_iter))
-        return lines + self._consume_empty()
+            self._line_index += 1
+        return self._line_table[start:self._line_index] + self._consume_empty()
 
     def _dedent(self, lines, full=False):
         if full:
@@ -370,13 +451,8 @@ class GoogleDocstring(UnicodeMixin):
         return lines
 
     def _get_current_indent(self, peek_ahead=0):
-        line = self._line_iter.peek(peek_ahead + 1)[peek_ahead]
-        while line != self._line_iter.sentinel:
-            if line:
-                return self._get_indent(line)
-            peek_ahead += 1
-            line = self._line_iter.peek(peek_ahead + 1)[peek_ahead]
-        return 0
+        i = min(self._line_index + peek_ahead, self._line_count)
+        return self._line_next_indents[i]
 
     def _get_indent(self, line):
         for i, s in enumerate(line):
@@ -398,14 +474,6 @@ class GoogleDocstring(UnicodeMixin):
     def _indent(self, lines, n=4):
         return [(' ' * n) + line for line in lines]
 
-    def _is_indented(self, line, indent=1):
-        for i, s in enumerate(line):
-            if i >= indent:
-                return True
-            elif not s.isspace():
-                return False
-        return False
-
     def _is_list(self, lines):
         if not lines:
             return False
@@ -424,11 +492,18 @@ class GoogleDocstring(UnicodeMixin):
         return next_indent > indent
 
     def _is_section_header(self):
-        section = self._line_iter.peek().lower()
+        i = self._line_index
+        is_header = self._line_headers[i]
+        if is_header is None:
+            is_header = self._line_headers[i] = self._is_section_header_at(i)
+        return is_header
+
+    def _is_section_header_at(self, i):
+        section = self._line_table[i].lower()
         match = _google_section_regex.match(section)
         if match and section.strip(':') in self._sections:
-            header_indent = self._get_indent(section)
-            section_indent = self._get_current_indent(peek_ahead=1)
+            header_indent = self._line_indents[i]
+            section_indent = self._line_next_indents[i + 1]
             return section_indent > header_indent
         elif self._directive_sections:
             if _directive_regex.match(section):
@@ -438,12 +513,12 @@ class GoogleDocstring(UnicodeMixin):
         return False
 
     def _is_section_break(self):
-        line = self._line_iter.peek()
-        return (not self._line_iter.has_next() or
+        i = self._line_index
+        return (i >= self._line_count or
                 self._is_section_header() or
-                (self._is_in_section and
-                    line and
-                    not self._is_indented(line, self._section_indent)))
+                bool(self._is_in_section and
+                     self._line_table[i] and
+                     self._line_indents[i] < self._section_indent))
 
     def _parse(self):
         self._parsed_lines = self._consume_empty()
@@ -452,7 +527,7 @@ class GoogleDocstring(UnicodeMixin):
             self._parsed_lines.extend(self._parse_attribute_docstring())
             return
 
-        while self._line_iter.has_next():
+        while self._line_index < self._line_count:
             if self._is_section_header():
                 try:
                     section = self._consume_section_header()
@@ -793,7 +868,7 @@ class NumpyDocstring(GoogleDocstring):
                                              name, obj, options)
 
     def _consume_field(self, parse_type=True, prefer_type=False):
-        line = next(self._line_iter)
+        line = self._next_line()
         if parse_type:
             _name, _, _type = self._partition_field_on_colon(line)
         else:
@@ -812,25 +887,27 @@ class NumpyDocstring(GoogleDocstring):
         return self._consume_fields(prefer_type=True)
 
     def _consume_section_header(self):
-        section = next(self._line_iter)
+        section = self._next_line()
         if not _directive_regex.match(section):
             # Consume the header underline
-            next(self._line_iter)
+            self._next_line()
         return section
 
     def _is_section_break(self):
-        line1, line2 = self._line_iter.peek(2)
-        return (not self._line_iter.has_next() or
+        i = self._line_index
+        lines = self._line_table
+        return (i >= self._line_count or
                 self._is_section_header() or
-                ['', ''] == [line1, line2] or
-                (self._is_in_section and
-                    line1 and
-                    not self._is_indented(line1, self._section_indent)))
-
-    def _is_section_header(self):
-        section, underline = self._line_iter.peek(2)
-        section = section.lower()
-        if section in self._sections and isinstance(underline, string_types):
+                (not lines[i] and i + 1 < self._line_count and
+                    not lines[i + 1]) or
+                bool(self._is_in_section and
+                     lines[i] and
+                     self._line_indents[i] < self._section_indent))
+
+    def _is_section_header_at(self, i):
+        section = self._line_table[i].lower()
+        if section in self._sections and i + 1 < self._line_count:
+            underline = self._line_table[i + 1]
             return bool(_numpy_section_regex.match(underline))
         elif self._directive_sections:
             if _directive_regex.match(section):
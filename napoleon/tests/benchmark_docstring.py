@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 Rob Ruana
+# Licensed under the BSD License, see LICENSE file for details.
+
+"""Measure how fast napoleon converts the docstrings of whole APIs.
+
+Run it from the top directory as::
+
+    python -m tests.benchmark_docstring [module ...]
+
+With module names (e.g. ``numpy scipy``) the docstrings of those packages,
+their submodules and their classes' members are converted, otherwise the
+docstrings of the napoleon test suite, repeated to the size of a large API.
+Each docstring is converted by each parser on its own, by running both
+parsers over it as napoleon did before it pre-scanned the docstrings, by
+the parsers its style needs, and twice through the docstring cache, first
+empty and then filled as on the next build.
+"""
+
+from __future__ import print_function
+
+import importlib
+import inspect
+import pkgutil
+import sys
+import time
+import warnings
+
+from sphinxcontrib.napoleon import Config, _parse_docstring
+from sphinxcontrib.napoleon.cache import DocstringCache
+from sphinxcontrib.napoleon.docstring import (GoogleDocstring, NumpyDocstring,
+                                              _docstring_styles)
+
+
+def iter_modules(name):
+    try:
+        module = importlib.import_module(name)
+    except Exception:
+        return
+    yield module
+    for _, subname, _ in pkgutil.walk_packages(
+            getattr(module, '__path__', []), name + '.',
+            onerror=lambda name: None):
+        try:
+            yield importlib.import_module(subname)
+        except (Exception, SystemExit):
+            pass
+
+
+def read_docstrings(names):
+    seen = set()
+    docstrings = []
+    for name in names:
+        for module in iter_modules(name):
+            objs = [module]
+            for obj in list(vars(module).values()):
+                objs.append(obj)
+                if inspect.isclass(obj):
+                    objs.extend(vars(obj).values())
+            for obj in objs:
+                doc = getattr(obj, '__doc__', None)
+                if (isinstance(doc, str) and doc.strip() and
+                        id(obj) not in seen):
+                    seen.add(id(obj))
+                    docstrings.append(inspect.cleandoc(doc).splitlines())
+    return docstrings
+
+
+def test_docstrings():
+    from tests.napoleon import test_docstring
+    docstrings = []
+    for cls in (test_docstring.GoogleDocstringTest,
+                test_docstring.NumpyDocstringTest):
+        for value in vars(cls).values():
+            if isinstance(value, list):
+                docstrings.extend(item[0].splitlines() for item in value
+                                  if isinstance(item, tuple))
+    return docstrings
+
+
+def numpy_only(lines, config):
+    return NumpyDocstring(lines, config, what='function').lines()
+
+
+def google_only(lines, config):
+    return GoogleDocstring(lines, config, what='function').lines()
+
+
+def two_pass(lines, config):
+    lines = NumpyDocstring(lines, config, what='function').lines()
+    return GoogleDocstring(lines, config, what='function').lines()
+
+
+def dispatch(lines, config):
+    return _parse_docstring(lines, config, what='function')
+
+
+def cached(lines, config, cache=DocstringCache()):
+    key = cache.make_key(lines, config, 'function')
+    result_lines = cache.get(key)
+    if result_lines is None:
+        result_lines = dispatch(lines, config)
+        cache.put(key, result_lines)
+    return result_lines
+
+
+def run(name, function, docstrings, config):
+    start = time.time()
+    for lines in docstrings:
+        function(lines, config)
+    elapsed = time.time() - start
+    print('%-12s %8.3f s %10.0f docstrings/s'
+          % (name, elapsed, len(docstrings) / max(elapsed, 1e-9)))
+
+
+if __name__ == '__main__':
+    warnings.simplefilter('ignore')
+    if len(sys.argv) > 1:
+        docstrings = read_docstrings(sys.argv[1:])
+    else:
+        docstrings = test_docstrings() * 200
+
+    styles = [_docstring_styles(lines) for lines in docstrings]
+    print('%d docstrings, %d NumPy style, %d Google style, %d both'
+          % (len(docstrings),
+             sum(1 for numpy, google in styles if numpy),
+             sum(1 for numpy, google in styles if google),
+             sum(1 for numpy, google in styles if numpy and google)))
+
+    config = Config()
+    run('numpy', numpy_only, docstrings, config)
+    run('google', google_only, docstrings, config)
+    run('two-pass', two_pass, docstrings, config)
+    run('dispatch', dispatch, docstrings, config)
+    run('cache cold', cached, docstrings, config)
+    run('cache warm', cached, docstrings, config)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014 Rob Ruana
+# Licensed under the BSD License, see LICENSE file for details.
+
+"""Tests for :mod:`sphinxcontrib.napoleon.cache` module."""
+
+try:
+    # Python >=3.3
+    from unittest import mock
+except ImportError:
+    import mock
+from sphinxcontrib.napoleon import _process_docstring, Config
+from sphinxcontrib.napoleon.cache import ClassCache, DocstringCache
+from unittest import TestCase
+
+
+class Outer(object):
+    class Inner(object):
+        def method(self):
+            """Inner.method.DOCSTRING"""
+
+
+class ClassCacheTest(TestCase):
+    def test_get_class(self):
+        classes = ClassCache()
+        self.assertIs(Outer.Inner, classes.get_class(__name__, 'Outer.Inner'))
+        self.assertIsNone(classes.get_class(__name__, 'Outer.Missing'))
+        self.assertIsNone(classes.get_class('no.such.module', 'Outer'))
+        with mock.patch('importlib.import_module') as import_module:
+            classes.get_class(__name__, 'Outer.Inner')
+            classes.get_class(__name__, 'Outer.Missing')
+            self.assertFalse(import_module.called)
+
+    def test_defines(self):
+        classes = ClassCache()
+        self.assertTrue(classes.defines(Outer.Inner, 'method'))
+        self.assertFalse(classes.defines(Outer.Inner, '__init__'))
+        self.assertFalse(classes.defines(Outer, 'method'))
+        self.assertFalse(classes.defines(None, 'method'))
+
+
+class DocstringCacheTest(TestCase):
+    def test_keys(self):
+        cache = DocstringCache()
+        lines = ['Summary line.', '', 'Args:', '   arg1: description']
+        key = cache.make_key(lines, Config(), 'function', 'func')
+        self.assertEqual(key, cache.make_key(list(lines), Config(),
+                                             'function', 'other_func'))
+        self.assertNotEqual(key, cache.make_key(lines[:-1], Config(),
+                                                'function', 'func'))
+        self.assertNotEqual(key, cache.make_key(lines, Config(),
+                                                'attribute', 'func'))
+        self.assertNotEqual(key, cache.make_key(
+            lines, Config(napoleon_use_param=False), 'function', 'func'))
+        self.assertEqual(key, cache.make_key(
+            lines, Config(napoleon_include_private_with_doc=True),
+            'function', 'func'))
+
+    def test_hits_misses_and_prune(self):
+        cache = DocstringCache()
+        cache.begin_build(['one', 'two'])
+        self.assertEqual(None, cache.get('key', 'one'))
+        cache.put('key', ['line'], 'one')
+        self.assertEqual(['line'], cache.get('key', 'two'))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+        cache.purge_doc('one')
+        cache.prune()
+        self.assertEqual(1, len(cache))
+        cache.purge_doc('two')
+        cache.prune()
+        self.assertEqual(0, len(cache))
+
+    def test_count_all_documents(self):
+        cache = DocstringCache()
+        cache.get('key', 'one')
+        cache.begin_build(None)
+        cache.get('key', 'one')
+        cache.put('key', ['line'], 'one')
+        cache.get('key', 'two')
+        cache.get('key')
+        self.assertEqual((2, 1), (cache.hits, cache.misses))
+
+    def test_merge(self):
+        cache = DocstringCache()
+        cache.begin_build(['one', 'two'])
+        other = DocstringCache()
+        other.get('key', 'one')
+        other.put('key', ['line'], 'one')
+        other.put('other', ['line'], 'three')
+        cache.merge(['one'], other)
+        self.assertEqual(1, len(cache))
+        self.assertEqual((0, 1), (cache.hits, cache.misses))
+
+    def test_process_docstring(self):
+        app = mock.Mock()
+        app.config = Config()
+        app.env.napoleon_cache = DocstringCache()
+        app.env.temp_data = {'docname': 'index'}
+        app.env.napoleon_cache.begin_build(['index'])
+        expected = ['Summary line.',
+                    '',
+                    ':param arg1: arg1 description',
+                    '']
+        for i in range(2):
+            lines = ['Summary line.',
+                     '',
+                     'Args:',
+                     '   arg1: arg1 description']
+            _process_docstring(app, 'function', 'func', None, mock.Mock(),
+                               lines)
+            self.assertEqual(expected, lines)
+        self.assertEqual((1, 1), (app.env.napoleon_cache.hits,
+                                  app.env.napoleon_cache.misses))
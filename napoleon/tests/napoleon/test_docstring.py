@@ -10,7 +10,9 @@ from collections import namedtuple
 from inspect import cleandoc
 from textwrap import dedent
 from sphinxcontrib.napoleon import Config
-from sphinxcontrib.napoleon.docstring import GoogleDocstring, NumpyDocstring
+from sphinxcontrib.napoleon.docstring import (GoogleDocstring, NumpyDocstring,
+                                              _docstring_styles,
+                                              _section_names)
 from unittest import TestCase
 
 try:
@@ -45,6 +47,25 @@ class BaseDocstringTest(TestCase):
     pass
 
 
+class DocstringStylesTest(BaseDocstringTest):
+    def test_section_names(self):
+        self.assertEqual(set(GoogleDocstring('')._sections), _section_names)
+
+    def test_styles(self):
+        self.assertEqual((False, False),
+                         _docstring_styles(['Summary.', '', 'Text: here']))
+        self.assertEqual((False, True),
+                         _docstring_styles(['Summary.', '', 'Args:', '  x']))
+        self.assertEqual((True, False),
+                         _docstring_styles(['Summary.', '', 'Returns',
+                                            '-------', 'int']))
+        self.assertEqual((True, False),
+                         _docstring_styles(['.. index:: summary']))
+        self.assertEqual((True, True),
+                         _docstring_styles(['Notes', '-----',
+                                            '    Returns:', '        int']))
+
+
 class NamedtupleSubclassTest(BaseDocstringTest):
     def test_attributes_docstring(self):
         config = Config()
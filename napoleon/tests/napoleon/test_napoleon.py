@@ -11,8 +11,9 @@ except ImportError:
     import mock
 from collections import namedtuple
 from sphinx.application import Sphinx
-from sphinxcontrib.napoleon import (_process_docstring, _skip_member, Config,
-                                    setup)
+from sphinxcontrib.napoleon import (_parse_docstring, _process_docstring,
+                                    _skip_member, Config, setup)
+from sphinxcontrib.napoleon.docstring import GoogleDocstring, NumpyDocstring
 from unittest import TestCase
 
 
@@ -85,6 +86,28 @@ class ProcessDocstringTest(TestCase):
                     '']
         self.assertEqual(expected, lines)
 
+    def test_single_pass_matches_two_passes(self):
+        config = Config()
+        docstrings = [
+            ['Summary line.  ', '', 'Plain text only.  '],
+            ['Summary line.', '', 'Args:', '   arg1: arg1 description'],
+            ['Summary line.', '', 'Parameters', '----------', 'arg1 : int',
+             '    arg1 description'],
+            ['Summary line.', '', 'Parameters', '----------', 'arg1 : int',
+             '    arg1 description', '', 'Notes', '-----',
+             '    Returns:', '        str: value'],
+            ['int: attribute description'],
+        ]
+        for lines in docstrings:
+            for what, name in (('function', 'func'), ('attribute', 'attr')):
+                expected = NumpyDocstring(lines, config, what=what,
+                                          name=name).lines()
+                expected = GoogleDocstring(expected, config, what=what,
+                                           name=name).lines()
+                actual = _parse_docstring(lines, config, what=what,
+                                          name=name)
+                self.assertEqual(expected, actual)
+
 
 class SetupTest(TestCase):
     def test_unknown_app_type(self):
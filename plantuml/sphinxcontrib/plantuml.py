@@ -8,17 +8,19 @@
     :copyright: Copyright 2010 by Yuya Nishihara <yuya@tcha.org>.
     :license: BSD, see LICENSE for details.
 """
-import errno, hashlib, os, re, shlex, subprocess
+import errno, hashlib, multiprocessing, os, re, shlex, struct, subprocess
+from multiprocessing.pool import ThreadPool
 from docutils import nodes
 from docutils.parsers.rst import directives
+import sphinx
 from sphinx.errors import SphinxError
 from sphinx.util.compat import Directive
 from sphinx.util.osutil import ensuredir, ENOENT
 
 try:
-    from PIL import Image
+    from sphinxcontrib import rendercache
 except ImportError:
-    Image = None
+    rendercache = None
 
 class PlantUmlError(SphinxError):
     pass
@@ -71,9 +73,12 @@ class UmlDirective(Directive):
 
         return [node]
 
+def _generate_fname(uml, fileformat):
+    key = hashlib.sha1(uml.encode('utf-8')).hexdigest()
+    return 'plantuml-%s.%s' % (key, fileformat)
+
 def generate_name(self, node, fileformat):
-    key = hashlib.sha1(node['uml'].encode('utf-8')).hexdigest()
-    fname = 'plantuml-%s.%s' % (key, fileformat)
+    fname = _generate_fname(node['uml'], fileformat)
     imgpath = getattr(self.builder, 'imgpath', None)
     if imgpath:
         return ('/'.join((self.builder.imgpath, fname)),
@@ -96,10 +101,29 @@ def generate_plantuml_args(self, fileformat):
     args.extend(_ARGS_BY_FILEFORMAT[fileformat])
     return args
 
+# preprocessor directives reading other files, which the cache key can't see
+_INCLUDE_RE = re.compile(r'^\s*!(?:include|import)', re.MULTILINE)
+
+def _get_render_cache(self, uml, fileformat):
+    """Return (cache, key) if sphinxcontrib.rendercache is enabled
+
+    Diagrams including other files are not cached, as a change of the
+    included files wouldn't change the key.
+    """
+    cache = rendercache and rendercache.get_cache(self.builder)
+    if not cache or _INCLUDE_RE.search(uml):
+        return None, None
+    key = cache.make_key('plantuml', generate_plantuml_args(self, fileformat),
+                         uml)
+    return cache, key
+
 def render_plantuml(self, node, fileformat):
     refname, outfname = generate_name(self, node, fileformat)
     if os.path.exists(outfname):
         return refname, outfname  # don't regenerate
+    cache, key = _get_render_cache(self, node['uml'], fileformat)
+    if cache and cache.fetch(key, outfname):
+        return refname, outfname
     ensuredir(os.path.dirname(outfname))
     f = open(outfname, 'wb')
     try:
@@ -115,9 +139,29 @@ def render_plantuml(self, node, fileformat):
         serr = p.communicate(node['uml'].encode('utf-8'))[1]
         if p.returncode != 0:
             raise PlantUmlError('error while running plantuml\n\n%s' % serr)
-        return refname, outfname
     finally:
         f.close()
+    if cache:
+        cache.store(key, outfname)
+    return refname, outfname
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+def _get_png_size(fname):
+    """Read (width, height) from the IHDR chunk of PNG file
+
+    This doesn't decode the image, so it takes constant time regardless of
+    the image size. Returns None if the file isn't a PNG image.
+    """
+    f = open(fname, 'rb')
+    try:
+        head = f.read(24)
+    finally:
+        f.close()
+    if (len(head) != 24 or not head.startswith(_PNG_SIGNATURE)
+        or head[12:16] != b'IHDR'):
+        return None
+    return struct.unpack('>II', head[16:24])
 
 def _get_png_tag(self, fnames, node):
     refname, _outfname = fnames['png']
@@ -126,14 +170,17 @@ def _get_png_tag(self, fnames, node):
     # mimic StandaloneHTMLBuilder.post_process_images(). maybe we should
     # process images prior to html_vist.
     scale_keys = ('scale', 'width', 'height')
-    if all(key not in node for key in scale_keys) or Image is None:
+    if all(key not in node for key in scale_keys):
         return ('<img src="%s" alt="%s" />\n'
                 % (self.encode(refname), self.encode(alt)))
 
     # Get sizes from the rendered image (defaults)
-    im = Image.open(_outfname)
-    im.load()
-    (fw, fh) = im.size
+    if 'width' not in node or 'height' not in node:
+        size = _get_png_size(_outfname)
+        if size is None:
+            return ('<img src="%s" alt="%s" />\n'
+                    % (self.encode(refname), self.encode(alt)))
+        (fw, fh) = size
 
     # Regex to get value and units
     vu = re.compile(r"(?P<value>\d+)\s*(?P<units>[a-zA-Z%]+)?")
@@ -299,6 +346,162 @@ def pdf_visit_plantuml(self, node):
     rep = nodes.image(uri=outfname, alt=node.get('alt', node['uml']))
     node.parent.replace(node, rep)
 
+def collect_plantuml_sources(app, doctree):
+    env = app.builder.env
+    if not hasattr(env, 'plantuml_sources'):
+        env.plantuml_sources = {}
+    sources = set(node['uml'] for node in doctree.traverse(plantuml))
+    if sources:
+        env.plantuml_sources[env.docname] = sources
+    else:
+        env.plantuml_sources.pop(env.docname, None)
+
+def purge_plantuml_sources(app, env, docname):
+    if not hasattr(env, 'plantuml_sources'):
+        return
+    env.plantuml_sources.pop(docname, None)
+
+def merge_plantuml_sources(app, env, docnames, other):
+    if not hasattr(other, 'plantuml_sources'):
+        return
+    if not hasattr(env, 'plantuml_sources'):
+        env.plantuml_sources = {}
+    for docname in docnames:
+        if docname in other.plantuml_sources:
+            env.plantuml_sources[docname] = other.plantuml_sources[docname]
+
+def _get_prerender_fileformats(builder):
+    # invalid formats are reported by the visitors
+    if builder.format == 'html':
+        format = builder.config.plantuml_output_format
+        if format in _KNOWN_HTML_FORMATS:
+            return _KNOWN_HTML_FORMATS[format][0]
+    elif builder.format == 'latex':
+        format = builder.config.plantuml_latex_output_format
+        if format in _KNOWN_LATEX_FORMATS:
+            return (_KNOWN_LATEX_FORMATS[format][0],)
+    return ()
+
+# separates diagrams in the output of a single 'plantuml -pipe' process
+_PIPE_DELIMITOR = '__sphinxcontrib_plantuml_delimitor__'
+
+def _wrap_startuml(uml):
+    if '@start' in uml:
+        return uml
+    return '@startuml\n%s\n@enduml' % uml
+
+def _split_piped_images(data, count):
+    delim = _PIPE_DELIMITOR.encode('ascii')
+    parts = data.split(delim)
+    if len(parts) != count + 1 or parts[-1].strip():
+        raise PlantUmlError('plantuml generated %d diagrams, expected %d'
+                            % (len(parts) - 1, count))
+    images = parts[:1]
+    for part in parts[1:-1]:
+        # strip line separator printed after the delimiter
+        if part.startswith(b'\r\n'):
+            part = part[2:]
+        elif part.startswith(b'\n'):
+            part = part[1:]
+        images.append(part)
+    return images
+
+def render_plantuml_batch(app, fileformat, jobs):
+    """Render many diagrams by one plantuml process
+
+    jobs is a list of (uml, outfname) pairs. Nothing is written unless
+    all diagrams are rendered successfully.
+    """
+    args = generate_plantuml_args(app, fileformat)
+    args.extend(['-pipedelimitor', _PIPE_DELIMITOR])
+    source = '\n'.join(_wrap_startuml(uml) for uml, _outfname in jobs)
+    try:
+        p = subprocess.Popen(args, stdout=subprocess.PIPE,
+                             stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as err:
+        if err.errno != ENOENT:
+            raise
+        raise PlantUmlError('plantuml command %r cannot be run'
+                            % app.builder.config.plantuml)
+    sout, serr = p.communicate(source.encode('utf-8'))
+    if p.returncode != 0:
+        raise PlantUmlError('error while running plantuml\n\n%s' % serr)
+    images = _split_piped_images(sout, len(jobs))
+    for (uml, outfname), data in zip(jobs, images):
+        ensuredir(os.path.dirname(outfname))
+        f = open(outfname, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        cache, key = _get_render_cache(app, uml, fileformat)
+        if cache:
+            cache.store(key, outfname)
+
+def _get_batch_workers(config):
+    if config.plantuml_batch_workers:
+        return config.plantuml_batch_workers
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+def prerender_plantuml(app, env):
+    """Render missing diagrams of all documents before writing
+
+    Diagrams are passed in batches to a bounded pool of plantuml
+    processes, so that the JVM startup is paid once per batch instead of
+    once per diagram. Diagrams failed to be rendered here are left to the
+    visitors, which report errors as usual.
+    """
+    batchsize = app.config.plantuml_batch_size
+    if not batchsize or not getattr(env, 'plantuml_sources', None):
+        return
+    builder = app.builder
+    if builder.format == 'html':
+        imgdir = os.path.join(builder.outdir, '_images')
+    else:
+        imgdir = builder.outdir
+
+    # {fileformat: {outfname: uml, ...}, ...} deduplicated by sha1 key
+    pending = {}
+    for sources in env.plantuml_sources.values():
+        for uml in sources:
+            for fileformat in _get_prerender_fileformats(builder):
+                outfname = os.path.join(imgdir,
+                                        _generate_fname(uml, fileformat))
+                if os.path.exists(outfname):
+                    continue
+                cache, key = _get_render_cache(app, uml, fileformat)
+                if cache and cache.fetch(key, outfname):
+                    continue
+                pending.setdefault(fileformat, {})[outfname] = uml
+
+    batches = []
+    for fileformat, umls in sorted(pending.items()):
+        jobs = sorted((uml, outfname) for outfname, uml in umls.items())
+        for i in range(0, len(jobs), batchsize):
+            batches.append((fileformat, jobs[i:i + batchsize]))
+    if not batches:
+        return
+
+    def render(batch):
+        fileformat, jobs = batch
+        try:
+            render_plantuml_batch(app, fileformat, jobs)
+        except PlantUmlError as err:
+            app.verbose('plantuml batch rendering failed: %s' % err)
+
+    app.info('rendering %d plantuml diagrams... '
+             % sum(len(jobs) for _fileformat, jobs in batches), nonl=True)
+    pool = ThreadPool(min(_get_batch_workers(app.config), len(batches)))
+    try:
+        pool.map(render, batches)
+    finally:
+        pool.close()
+        pool.join()
+    app.info('done')
+
 def setup(app):
     app.add_node(plantuml,
                  html=(html_visit_plantuml, None),
@@ -308,6 +511,13 @@ def setup(app):
     app.add_config_value('plantuml_output_format', 'png', 'html')
     app.add_config_value('plantuml_epstopdf', 'epstopdf', '')
     app.add_config_value('plantuml_latex_output_format', 'png', '')
+    app.add_config_value('plantuml_batch_size', 0, '')
+    app.add_config_value('plantuml_batch_workers', None, '')
+    app.connect('doctree-read', collect_plantuml_sources)
+    app.connect('env-purge-doc', purge_plantuml_sources)
+    if sphinx.version_info >= (1, 3):
+        app.connect('env-merge-info', merge_plantuml_sources)
+    app.connect('env-updated', prerender_plantuml)
 
     # imitate what app.add_node() does
     if 'rst2pdf.pdfbuilder' in app.config.extensions:
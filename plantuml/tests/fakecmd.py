@@ -1,6 +1,20 @@
 #!/usr/bin/env python
 import sys
 
+if '-pipedelimitor' in sys.argv:
+    # emulate batch mode: one output per @startuml/@enduml block
+    i = sys.argv.index('-pipedelimitor')
+    delim = sys.argv[i + 1]
+    args = sys.argv[:i + 1] + sys.argv[i + 2:]
+    for line in sys.stdin:
+        if line.startswith('@startuml'):
+            print '%', ' '.join(args)
+        elif line.startswith('@enduml'):
+            print delim
+        else:
+            sys.stdout.write('% ' + line)
+    sys.exit()
+
 # embed as PostScript comment
 print '%', ' '.join(sys.argv)
 for line in sys.stdin:
@@ -103,6 +103,19 @@ def test_buildhtml_alt():
     """
     assert 'alt="Foo &lt;Bar&gt;"' in readfile('index.html')
 
+@with_runsphinx('html')
+def test_buildhtml_width_height_scale():
+    """Generate HTML with explicit size
+
+    .. uml::
+       :width: 200px
+       :height: 100px
+       :scale: 50 %
+
+       Hello
+    """
+    assert 'width="100px" height="50px"' in readfile('index.html')
+
 @with_runsphinx('html')
 def test_buildhtml_caption():
     """Generate HTML with caption specified
@@ -127,6 +140,57 @@ def test_buildhtml_nonascii():
     assert '-charset utf-8' in content[0]
     assert_equals(u'\u3042', content[1][2:].decode('utf-8'))
 
+@with_runsphinx('html', plantuml_output_format='svg', plantuml_batch_size=2)
+def test_buildhtml_batch():
+    """Generate HTML from diagrams rendered in batch
+
+    .. uml::
+
+       Hello
+
+    .. uml::
+
+       @startuml
+       World
+       @enduml
+
+    .. uml::
+
+       Hello
+
+    .. uml::
+
+       Bye
+    """
+    pngfiles = glob.glob(os.path.join(_outdir, '_images', 'plantuml-*.png'))
+    assert len(pngfiles) == 3
+    svgfiles = glob.glob(os.path.join(_outdir, '_images', 'plantuml-*.svg'))
+    assert len(svgfiles) == 3
+
+    contents = sorted(readfile(f).splitlines() for f in pngfiles + svgfiles)
+    for content in contents:
+        assert '-pipedelimitor' in content[0]
+    assert_equals(['Bye', 'Bye', 'Hello', 'Hello', 'World', 'World'],
+                  sorted(content[1][2:] for content in contents))
+
+    imgtags = [l for l in readfile('index.html').splitlines()
+               if '<img src="_images/plantuml' in l]
+    assert len(imgtags) == 4
+
+@with_runsphinx('latex', plantuml_batch_size=10)
+def test_buildlatex_batch():
+    """Generate LaTeX from diagrams rendered in batch
+
+    .. uml::
+
+       Hello
+    """
+    files = glob.glob(os.path.join(_outdir, 'plantuml-*.png'))
+    assert len(files) == 1
+    content = readfile(files[0]).splitlines()
+    assert '-pipedelimitor' in content[0]
+    assert_equals(['Hello'], [l[2:] for l in content[1:]])
+
 @with_runsphinx('latex')
 def test_buildlatex_simple():
     """Generate simple LaTeX
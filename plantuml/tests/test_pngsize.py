@@ -0,0 +1,36 @@
+import os, shutil, struct, tempfile, zlib
+from nose.tools import *
+
+from sphinxcontrib import plantuml
+
+def setup():
+    global _tempdir
+    _tempdir = tempfile.mkdtemp()
+
+def teardown():
+    shutil.rmtree(_tempdir)
+
+def writefile(fname, data):
+    f = open(fname, 'wb')
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+def pngchunk(tag, data):
+    crc = zlib.crc32(tag + data) & 0xffffffff
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', crc)
+
+def test_get_png_size():
+    fname = os.path.join(_tempdir, 'a.png')
+    writefile(
+        fname,
+        b'\x89PNG\r\n\x1a\n'
+        + pngchunk(b'IHDR', struct.pack('>IIBBBBB', 115, 147, 8, 2, 0, 0, 0))
+        + pngchunk(b'IEND', b''))
+    assert_equals((115, 147), plantuml._get_png_size(fname))
+
+def test_get_png_size_not_png():
+    fname = os.path.join(_tempdir, 'b.png')
+    writefile(fname, b'% plantuml -pipe\n% Hello\n')
+    assert_equals(None, plantuml._get_png_size(fname))
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+from setuptools import setup, find_packages
+
+long_desc = '''
+This package contains the rendercache Sphinx extension.
+
+Shared on-disk cache of images rendered by diagram extensions (plantuml,
+tikz, mscgen, gnuplot, aafig, lilypond, sdedit), so that clean builds and
+builds for several output directories only render changed diagrams.
+'''
+
+requires = ['Sphinx>=1.0']
+
+setup(
+    name='sphinxcontrib-rendercache',
+    version='0.1',
+    url='http://bitbucket.org/birkenfeld/sphinx-contrib',
+    download_url='http://pypi.python.org/pypi/sphinxcontrib-rendercache',
+    license='BSD',
+    author='Georg Brandl',
+    author_email='georg@python.org',
+    description='Sphinx "rendercache" extension',
+    long_description=long_desc,
+    zip_safe=False,
+    classifiers=[
+        'Development Status :: 4 - Beta',
+        'Environment :: Console',
+        'Environment :: Web Environment',
+        'Intended Audience :: Developers',
+        'License :: OSI Approved :: BSD License',
+        'Operating System :: OS Independent',
+        'Programming Language :: Python',
+        'Framework :: Sphinx :: Extension',
+        #'Framework :: Sphinx :: Theme',
+        'Topic :: Documentation',
+        'Topic :: Utilities',
+    ],
+    platforms='any',
+    packages=find_packages(),
+    include_package_data=True,
+    install_requires=requires,
+    namespace_packages=['sphinxcontrib'],
+)
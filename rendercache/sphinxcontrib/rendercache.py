@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+    sphinxcontrib.rendercache
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Persistent cache of images rendered by diagram extensions.
+
+    Rendered files are stored by a content hash of the extension name, the
+    rendering tool and all inputs, in a directory outside of the build
+    output, and linked (or copied) into the output directory of each build.
+
+    See the README file for details.
+
+    :license: BSD, see LICENSE for details.
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+
+from sphinx.util.osutil import ensuredir
+
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
+
+def _default_cachedir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'sphinxcontrib-rendercache')
+
+
+def _find_executable(name):
+    for d in os.environ.get('PATH', '').split(os.pathsep):
+        fn = os.path.join(d.strip('"'), name)
+        if os.path.isfile(fn):
+            return fn
+    return None
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except (AttributeError, OSError):
+        # no hardlink support, or cache on another filesystem
+        shutil.copyfile(src, dst)
+
+
+def _encode(part):
+    if isinstance(part, bytes):
+        return part
+    if not isinstance(part, text_type):
+        part = repr(part)
+    return part.encode('utf-8')
+
+
+class RenderCache(object):
+    """Content-addressed store of rendered files with LRU eviction
+
+    Entries are files named ``<key>.<suffix>`` where the suffix is taken
+    from the output file name, so that several files rendered from the
+    same inputs (e.g. an image and its image map) can share one key.
+    """
+
+    def __init__(self, cachedir, maxsize=0):
+        self.cachedir = cachedir
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._tool_signatures = {}
+
+    def _tool_signature(self, tool):
+        """Identify the rendering tool by its files' sizes and mtimes
+
+        Upgrading the tool (or the jar passed to java) changes the
+        signature, which invalidates everything rendered by the old one.
+        """
+        if not isinstance(tool, (list, tuple)):
+            tool = [tool]
+        tool = tuple(tool)
+        try:
+            return self._tool_signatures[tool]
+        except KeyError:
+            pass
+        signature = []
+        for i, arg in enumerate(tool):
+            fn = arg
+            if i == 0 and not os.path.dirname(arg):
+                fn = _find_executable(arg)
+            if fn and os.path.isfile(fn):
+                st = os.stat(fn)
+                signature.append('%s:%d:%d' % (arg, st.st_size,
+                                               int(st.st_mtime)))
+            else:
+                signature.append(arg)
+        self._tool_signatures[tool] = signature
+        return signature
+
+    def make_key(self, extension, tool, *parts):
+        """Compute the cache key of an image
+
+        *tool* is the command line (or any other identification) of the
+        program rendering the image and *parts* are all other inputs, e.g.
+        the diagram source and the options.
+        """
+        h = hashlib.sha1()
+        for part in [extension] + self._tool_signature(tool) + list(parts):
+            part = _encode(part)
+            h.update(_encode('%d:' % len(part)))
+            h.update(part)
+        return h.hexdigest()
+
+    def _entry(self, key, outfn):
+        suffix = os.path.basename(outfn).split('.', 1)[-1]
+        return os.path.join(self.cachedir, key[:2], '%s.%s' % (key, suffix))
+
+    def fetch(self, key, *outfns):
+        """Put the cached files for *key* at *outfns*
+
+        Returns True if all of them were found, otherwise nothing is put.
+        """
+        entries = [self._entry(key, outfn) for outfn in outfns]
+        if not all(os.path.isfile(entry) for entry in entries):
+            with self._lock:
+                self.misses += 1
+            return False
+        for entry, outfn in zip(entries, outfns):
+            ensuredir(os.path.dirname(outfn))
+            if os.path.exists(outfn):
+                os.unlink(outfn)
+            _link_or_copy(entry, outfn)
+            try:
+                os.utime(entry, None)  # mark as recently used
+            except OSError:
+                pass
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def store(self, key, *outfns):
+        """Add the rendered files *outfns* to the cache"""
+        for outfn in outfns:
+            if not os.path.isfile(outfn):
+                continue
+            entry = self._entry(key, outfn)
+            ensuredir(os.path.dirname(entry))
+            # rename is atomic, so concurrent builds never see partial
+            # entries
+            tmpfn = '%s.%d.%d.tmp' % (entry, os.getpid(),
+                                      threading.current_thread().ident)
+            _link_or_copy(outfn, tmpfn)
+            try:
+                os.rename(tmpfn, entry)
+            except OSError:
+                # entry exists on Windows, which is fine as it has the
+                # same content
+                os.unlink(tmpfn)
+
+    def evict(self):
+        """Remove least recently used entries exceeding the size limit"""
+        if not self.maxsize or not os.path.isdir(self.cachedir):
+            return
+        entries = []
+        total = 0
+        for dirpath, dirnames, filenames in os.walk(self.cachedir):
+            for fname in filenames:
+                fn = os.path.join(dirpath, fname)
+                try:
+                    st = os.stat(fn)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, fn))
+                total += st.st_size
+        entries.sort()
+        for mtime, size, fn in entries:
+            if total <= self.maxsize:
+                break
+            try:
+                os.unlink(fn)
+            except OSError:
+                continue
+            total -= size
+
+
+def get_cache(builder):
+    """Return the cache for *builder*, or None if rendercache is not enabled"""
+    return getattr(builder, '_rendercache', None)
+
+
+def init_cache(app):
+    cachedir = app.config.rendercache_dir or _default_cachedir()
+    if not os.path.isabs(cachedir):
+        cachedir = os.path.join(app.confdir, cachedir)
+    app.builder._rendercache = RenderCache(cachedir,
+                                           app.config.rendercache_max_size)
+
+
+def finish_cache(app, exc):
+    cache = get_cache(app.builder)
+    if cache is None:
+        return
+    if cache.hits or cache.misses:
+        app.info('rendercache: %d hits, %d misses'
+                 % (cache.hits, cache.misses))
+    cache.evict()
+
+
+def setup(app):
+    app.add_config_value('rendercache_dir', None, '')
+    app.add_config_value('rendercache_max_size', 512 * 1024 * 1024, '')
+    app.connect('builder-inited', init_cache)
+    app.connect('build-finished', finish_cache)
+    return {'parallel_read_safe': True}
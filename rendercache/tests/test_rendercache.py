@@ -0,0 +1,100 @@
+import os, shutil, tempfile, time
+
+from nose.tools import *
+
+from sphinxcontrib.rendercache import RenderCache
+
+def setup():
+    global _tempdir, _cachedir, _outdir
+    _tempdir = tempfile.mkdtemp()
+    _cachedir = os.path.join(_tempdir, 'cache')
+    _outdir = os.path.join(_tempdir, 'out')
+
+def teardown():
+    shutil.rmtree(_tempdir)
+
+def writefile(fname, content):
+    f = open(fname, 'wb')
+    try:
+        f.write(content)
+    finally:
+        f.close()
+
+def readfile(fname):
+    f = open(fname, 'rb')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+def test_make_key():
+    cache = RenderCache(_cachedir)
+    key = cache.make_key('foo', ['footool', '-x'], u'source', {'a': 1})
+    assert_equals(key, cache.make_key('foo', ['footool', '-x'], u'source',
+                                      {'a': 1}))
+    assert key != cache.make_key('bar', ['footool', '-x'], u'source',
+                                 {'a': 1})
+    assert key != cache.make_key('foo', ['footool', '-y'], u'source',
+                                 {'a': 1})
+    assert key != cache.make_key('foo', ['footool', '-x'], u'source2',
+                                 {'a': 1})
+    assert key != cache.make_key('foo', ['footool', '-x'], u'source',
+                                 {'a': 2})
+
+def test_make_key_tool_changed():
+    tool = os.path.join(_tempdir, 'tool.jar')
+    writefile(tool, b'v1')
+    key = RenderCache(_cachedir).make_key('foo', ['java', '-jar', tool], '')
+    writefile(tool, b'version 2')
+    assert key != RenderCache(_cachedir).make_key('foo', ['java', '-jar', tool],
+                                                  '')
+
+def test_store_fetch():
+    cache = RenderCache(_cachedir)
+    imgfn = os.path.join(_outdir, 'build1', 'foo.png')
+    mapfn = os.path.join(_outdir, 'build1', 'foo.png.map')
+    os.makedirs(os.path.dirname(imgfn))
+    writefile(imgfn, b'image')
+    writefile(mapfn, b'map')
+
+    key = cache.make_key('foo', 'footool', 'source')
+    assert not cache.fetch(key, imgfn)
+    cache.store(key, imgfn, mapfn)
+
+    imgfn2 = os.path.join(_outdir, 'build2', 'foo.png')
+    mapfn2 = os.path.join(_outdir, 'build2', 'foo.png.map')
+    assert cache.fetch(key, imgfn2, mapfn2)
+    assert_equals(b'image', readfile(imgfn2))
+    assert_equals(b'map', readfile(mapfn2))
+    assert_equals((1, 1), (cache.hits, cache.misses))
+
+    # all or nothing
+    otherkey = cache.make_key('foo', 'footool', 'other')
+    cache.store(otherkey, imgfn)
+    imgfn3 = os.path.join(_outdir, 'build3', 'foo.png')
+    mapfn3 = os.path.join(_outdir, 'build3', 'foo.png.map')
+    assert not cache.fetch(otherkey, imgfn3, mapfn3)
+    assert not os.path.exists(imgfn3)
+
+def test_evict():
+    cachedir = os.path.join(_tempdir, 'evictcache')
+    cache = RenderCache(cachedir, maxsize=10)
+    srcfn = os.path.join(_tempdir, 'img.png')
+    keys = []
+    for i in range(3):
+        writefile(srcfn, b'12345')
+        key = cache.make_key('foo', 'footool', str(i))
+        cache.store(key, srcfn)
+        os.unlink(srcfn)
+        keys.append(key)
+    # keys[0] is used most recently
+    past = time.time() - 100
+    for i, key in enumerate(keys):
+        entry = os.path.join(cachedir, key[:2], '%s.png' % key)
+        os.utime(entry, (past + i, past + i))
+    assert cache.fetch(keys[0], os.path.join(_outdir, 'evict.png'))
+
+    cache.evict()
+    found = [cache.fetch(key, os.path.join(_outdir, 'evict-%s.png' % key))
+             for key in keys]
+    assert_equals([True, False, True], found)
@@ -10,8 +10,12 @@
 """
 
 import re
+import time
+import threading
 import posixpath
 import os
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from subprocess import Popen, PIPE
 try:
     from hashlib import sha1 as sha
@@ -21,12 +25,18 @@ except ImportError:
 from docutils import nodes
 from docutils.parsers.rst import directives
 
+import sphinx
 from sphinx.errors import SphinxError
 from sphinx.util import ensuredir
 from sphinx.util.compat import Directive
 
 from PIL import (Image, ImageFilter)
 
+try:
+    from sphinxcontrib import rendercache
+except ImportError:
+    rendercache = None
+
 
 def boolean_input(argument):
     return directives.choice(argument.lower() , ('true', 'false')) == 'true'
@@ -66,29 +76,50 @@ class SequenceDiagram(Directive):
         return [node]
 
 
-def render_sdx(self, code, options, format, prefix='sdedit'):
+def get_sdx_fnames(builder, code, options, format, prefix='sdedit'):
     """
-    Render sequence diagram into a PNG or PDF output file.
+    Return the names of the files rendered for a sequence diagram.
     """
     hashkey = code.encode('utf-8') + str(options) + \
-              str(self.builder.config.sdedit_args)
+              str(builder.config.sdedit_args)
     ofname = '%s-%s.%s' % (prefix, sha(hashkey).hexdigest(), format)
     ifname = '%s-%s.sd' % (prefix, sha(hashkey).hexdigest())
-    infn = os.path.join(self.builder.outdir, ifname)
-    if hasattr(self.builder, 'imgpath'):
+    infn = os.path.join(builder.outdir, ifname)
+    if hasattr(builder, 'imgpath'):
         # HTML
-        relfn = posixpath.join(self.builder.imgpath, ofname)
-        outfn = os.path.join(self.builder.outdir, '_images', ofname)
+        relfn = posixpath.join(builder.imgpath, ofname)
+        outfn = os.path.join(builder.outdir, '_images', ofname)
     else:
         # LaTeX
         relfn = ofname
-        outfn = os.path.join(self.builder.outdir, ofname)
+        outfn = os.path.join(builder.outdir, ofname)
+    return relfn, outfn, infn
+
+
+def render_sdx(self, code, options, format, prefix='sdedit'):
+    """
+    Render sequence diagram into a PNG or PDF output file.
+    """
+    return render_sdx_files(self.builder, code, options, format, prefix)
+
+
+def render_sdx_files(builder, code, options, format, prefix='sdedit'):
+    relfn, outfn, infn = get_sdx_fnames(builder, code, options, format,
+                                        prefix)
     if os.path.isfile(outfn):
         return relfn, outfn
 
-    if hasattr(self.builder, '_sdedit_warned'):
+    if hasattr(builder, '_sdedit_warned'):
         return None, None
 
+    cache = rendercache and rendercache.get_cache(builder)
+    if cache:
+        key = cache.make_key('sdedit', builder.config.sdedit_path, code,
+                             sorted(options.items()),
+                             builder.config.sdedit_args, format)
+        if cache.fetch(key, outfn):
+            return relfn, outfn
+
     ensuredir(os.path.dirname(outfn))
     ensuredir(os.path.dirname(infn))
     inputfile = open(infn, "w")
@@ -97,37 +128,144 @@ def render_sdx(self, code, options, format, prefix='sdedit'):
     inputfile.write(code)
     inputfile.close()
 
-    path = self.builder.config.sdedit_path
+    path = builder.config.sdedit_path
     if path.endswith(".jar"):
-        sdedit_args = [self.builder.config.sdedit_java_path, "-jar", path]
+        sdedit_args = [builder.config.sdedit_java_path]
+        sdedit_args.extend(builder.config.sdedit_java_args)
+        sdedit_args.extend(["-jar", path])
     else:
         sdedit_args = [path]
-    sdedit_args.extend(self.builder.config.sdedit_args)
+    sdedit_args.extend(builder.config.sdedit_args)
     sdedit_args.extend(['-t', format, '-o', outfn, infn])
     if options.get("linewrap"):
         sdedit_args.extend(['--lineWrap', 'true'])
     if options.get("threadnumber"):
         sdedit_args.extend(['--threadNumbersVisible', 'true'])
+    start = time.time()
     try:
         p = Popen(sdedit_args, stdout=PIPE, stdin=None, stderr=PIPE)
     except OSError, err:
         if err.errno != 2:   # No such file or directory
             raise
-        self.builder.warn('sdedit command %r cannot be run (needed for '
-                          'sequence diagram output), check the sdedit_path '
-                          ' setting' %
-                          self.builder.config.sdedit_path)
-        self.builder._sdedit_warned = True
+        builder.warn('sdedit command %r cannot be run (needed for '
+                     'sequence diagram output), check the sdedit_path '
+                     ' setting' %
+                     builder.config.sdedit_path)
+        builder._sdedit_warned = True
         return None, None
 
     stdout, stderr = p.communicate()
+    record_sdedit_time(builder, time.time() - start)
     if p.returncode != 0:
         raise SdeditError('sdedit exited with error:\n[stderr]\n%s\n'
                             '[stdout]\n%s' % (stderr, stdout))
     os.remove(infn)
+    if cache:
+        cache.store(key, outfn)
     return relfn, outfn
 
 
+def get_prerender_format(builder):
+    if builder.format == 'html':
+        return 'png'
+    if builder.format == 'latex':
+        return 'pdf'
+    return None
+
+
+def collect_sdedit_sources(app, doctree):
+    if not get_sdedit_workers(app.config):
+        return
+    env = app.builder.env
+    if not hasattr(env, 'sdedit_sources'):
+        env.sdedit_sources = {}
+    sources = [(node['code'], node['options'])
+               for node in doctree.traverse(sequence_diagram)]
+    if sources:
+        env.sdedit_sources[env.docname] = sources
+    else:
+        env.sdedit_sources.pop(env.docname, None)
+
+
+def purge_sdedit_sources(app, env, docname):
+    if hasattr(env, 'sdedit_sources'):
+        env.sdedit_sources.pop(docname, None)
+
+
+def merge_sdedit_sources(app, env, docnames, other):
+    if not hasattr(other, 'sdedit_sources'):
+        return
+    if not hasattr(env, 'sdedit_sources'):
+        env.sdedit_sources = {}
+    for docname in docnames:
+        if docname in other.sdedit_sources:
+            env.sdedit_sources[docname] = other.sdedit_sources[docname]
+
+
+def get_sdedit_workers(config):
+    workers = config.sdedit_workers
+    if workers is None:
+        try:
+            workers = multiprocessing.cpu_count()
+        except NotImplementedError:
+            workers = 1
+    return int(workers)
+
+
+def prerender_sdedit(app, env):
+    """Render all diagrams of the build on a pool of workers before writing"""
+    format = get_prerender_format(app.builder)
+    workers = get_sdedit_workers(app.config)
+    if format is None or not workers:
+        return
+    # the same diagram in several documents is rendered once
+    diagrams = {}
+    for docname in sorted(getattr(env, 'sdedit_sources', {})):
+        for code, options in env.sdedit_sources[docname]:
+            outfn = get_sdx_fnames(app.builder, code, options, format)[1]
+            if not os.path.isfile(outfn):
+                diagrams[outfn] = (code, options)
+    if not diagrams:
+        return
+
+    def render(diagram):
+        code, options = diagram
+        try:
+            render_sdx_files(app.builder, code, options, format)
+        except SdeditError, exc:
+            # reported when the diagram is written
+            app.verbose('sdedit code %r: %s' % (code, exc))
+
+    app.info('rendering %d sequence diagrams... ' % len(diagrams), nonl=True)
+    pool = ThreadPool(min(workers, len(diagrams)))
+    try:
+        pool.map(render, [diagrams[fn] for fn in sorted(diagrams)])
+    finally:
+        pool.close()
+        pool.join()
+    app.info('done')
+
+
+def record_sdedit_time(builder, seconds):
+    if not hasattr(builder, '_sdedit_stats'):
+        return
+    with builder._sdedit_stats_lock:
+        builder._sdedit_stats[0] += 1
+        builder._sdedit_stats[1] += seconds
+
+
+def init_sdedit_stats(app):
+    app.builder._sdedit_stats = [0, 0.0]
+    app.builder._sdedit_stats_lock = threading.Lock()
+
+
+def report_sdedit_stats(app, exc):
+    stats = getattr(app.builder, '_sdedit_stats', None)
+    if not stats or not stats[0]:
+        return
+    app.info('sdedit: %d runs of sdedit in %.2fs' % tuple(stats))
+
+
 def render_sdx_html(self, node, code, options, prefix='sdedit', imgcls=None):
     try:
         fname, outfn = render_sdx(self, code, options, 'png', prefix)
@@ -203,6 +341,15 @@ def setup(app):
     app.add_directive('sequence-diagram', SequenceDiagram)
     app.add_config_value('sdedit_path', 'sdedit.jar', 'html')
     app.add_config_value('sdedit_java_path', 'java', 'html')
+    app.add_config_value('sdedit_java_args', [], 'html')
     app.add_config_value('sdedit_args', [], 'html')
     app.add_config_value('sdedit_default_options', 
                          {'maxwidth':700}, 'html')
+    app.add_config_value('sdedit_workers', None, '')
+    app.connect('builder-inited', init_sdedit_stats)
+    app.connect('doctree-read', collect_sdedit_sources)
+    app.connect('env-purge-doc', purge_sdedit_sources)
+    if sphinx.version_info >= (1, 3):
+        app.connect('env-merge-info', merge_sdedit_sources)
+    app.connect('env-updated', prerender_sdedit)
+    app.connect('build-finished', report_sdedit_stats)
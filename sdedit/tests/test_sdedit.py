@@ -0,0 +1,32 @@
+from docutils import nodes
+from mock import Mock
+from nose.tools import *
+
+from sphinxcontrib.sdedit import sequence_diagram, collect_sdedit_sources
+
+def make_app(workers):
+    app = Mock()
+    app.config.sdedit_workers = workers
+    app.builder.env = Mock(spec=['docname'])
+    app.builder.env.docname = 'index'
+    return app
+
+def make_doctree(*codes):
+    doctree = nodes.section()
+    for code in codes:
+        node = sequence_diagram()
+        node['code'] = code
+        node['options'] = {}
+        doctree += node
+    return doctree
+
+def test_collect_sources_by_default():
+    app = make_app(None)
+    collect_sdedit_sources(app, make_doctree(u'a:A\nb:B\n\na:b.hello()'))
+    assert_equals(app.builder.env.sdedit_sources,
+                  {'index': [(u'a:A\nb:B\n\na:b.hello()', {})]})
+
+def test_collect_no_sources_without_workers():
+    app = make_app(0)
+    collect_sdedit_sources(app, make_doctree(u'a:A\nb:B\n\na:b.hello()'))
+    assert not hasattr(app.builder.env, 'sdedit_sources')
@@ -41,9 +41,12 @@
 
 import tempfile
 import posixpath
+import re
 import shutil
 import sys
-from os import path, getcwd, chdir, mkdir, system
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from os import path, getcwd, mkdir, system
 from subprocess import Popen, PIPE, call
 try:
     from hashlib import sha1 as sha
@@ -53,6 +56,7 @@ except ImportError:
 from docutils import nodes, utils
 from docutils.parsers.rst import directives
 
+import sphinx
 from sphinx.errors import SphinxError
 try:
     from sphinx.util.osutil import ensuredir, ENOENT, EPIPE
@@ -61,6 +65,21 @@ except:
 
 from sphinx.util.compat import Directive
 
+try:
+    from io import BytesIO
+except ImportError:
+    from cStringIO import StringIO as BytesIO
+
+try:
+    from PIL import Image, ImageChops
+except ImportError:
+    Image = ImageChops = None
+
+try:
+    from sphinxcontrib import rendercache
+except ImportError:
+    rendercache = None
+
 class TikzExtError(SphinxError):
     category = 'Tikz extension error'
 
@@ -112,12 +131,208 @@ DOC_BODY = r'''
 \end{document}
 '''
 
-def render_tikz(self,tikz,libs='',stringsubst=False):
+BATCH_DOC_HEAD = r'''
+\documentclass[12pt,multi]{standalone}
+\usepackage[utf8]{inputenc}
+\usepackage{tikz}
+\usetikzlibrary{%s}
+\pagestyle{empty}
+\newenvironment{sphinxtikzpage}{}{}
+\standaloneenv{sphinxtikzpage}
+'''
+
+BATCH_DOC_PAGE = r'''
+\begin{sphinxtikzpage}
+\begin{tikzpicture}
+%s
+\end{tikzpicture}
+\end{sphinxtikzpage}
+'''
+
+def get_tikz_fname(builder, tikz):
     hashkey = tikz.encode('utf-8')
-    fname = 'tikz-%s.png' % (sha(hashkey).hexdigest())
     # if we're converting to svg, then we use a different extension
-    if 'svg' in self.builder.config.tikz_proc_suite:
-        fname = 'tikz-%s.svg' % (sha(hashkey).hexdigest())
+    if 'svg' in builder.config.tikz_proc_suite:
+        return 'tikz-%s.svg' % (sha(hashkey).hexdigest())
+    return 'tikz-%s.png' % (sha(hashkey).hexdigest())
+
+def get_tikz_libs(builder, node):
+    libs = builder.config.tikz_tikzlibraries
+    if isinstance(node, tikz):
+        libs += ',' + node['libs']
+    return libs.replace(' ', '').replace('\t', '').strip(', ')
+
+def substitute_tikz(tikz, stringsubst):
+    if stringsubst:
+        tikz = tikz % {'wd': getcwd()}
+    return tikz
+
+def get_tikz_latex(builder, tikz, libs, stringsubst):
+    latex = DOC_HEAD % libs
+    latex += builder.config.tikz_latex_preamble
+    latex += DOC_BODY % substitute_tikz(tikz, stringsubst)
+    if isinstance(latex, unicode):
+        latex = latex.encode('utf-8')
+    return latex
+
+def get_tikz_cache_key(cache, builder, latex):
+    return cache.make_key('tikz', 'pdflatex', latex,
+                          builder.config.tikz_proc_suite,
+                          builder.config.tikz_transparent)
+
+def run_tikz_command(builder, args, cwd, name):
+    """Run a command in cwd and return its stdout
+
+    Returns None if the command cannot be run, and raises TikzExtError if
+    it fails.
+    """
+    try:
+        p = Popen(args, cwd=cwd, stdout=PIPE, stderr=PIPE)
+    except OSError, err:
+        if err.errno != ENOENT:   # No such file or directory
+            raise
+        builder.warn('%s command cannot be run' % name)
+        builder.warn(str(err))
+        builder._tikz_warned = True
+        return None
+    stdout, stderr = p.communicate()
+    if p.returncode != 0:
+        raise TikzExtError('Error (tikz extension): %s exited with error:\n'
+                           '[stderr]\n%s\n[stdout]\n%s'
+                           % (name, stderr, stdout))
+    return stdout
+
+def convert_tikz_page(builder, tempdir, pdfname, page, outfn):
+    """Convert a page of the pdf compiled by latex to outfn
+
+    page is None for a single page pdf. Returns False if a command cannot be
+    run.
+    """
+    try:
+        return _convert_tikz_page(builder, tempdir, pdfname, page, outfn)
+    except TikzExtError:
+        builder._tikz_warned = True
+        raise
+
+def _convert_tikz_page(builder, tempdir, pdfname, page, outfn):
+    suite = builder.config.tikz_proc_suite
+    outfn = path.abspath(outfn)  # commands are run in tempdir
+    if suite == 'pdf2svg':
+        args = ['pdf2svg', pdfname, outfn]
+        if page is not None:
+            args.append(str(page))
+        return run_tikz_command(builder, args, tempdir, 'pdf2svg') is not None
+    if suite not in ('ImageMagick', 'Netpbm', 'PIL'):
+        raise TikzExtError('Error (tikz extension): Invalid configuration '
+                           'value for tikz_proc_suite')
+
+    # the following does not work for pdf patterns
+    # p1 = Popen(['convert', '-density', '120', '-colorspace', 'rgb',
+    #             '-trim', 'tikz.pdf', outfn], stdout=PIPE, stderr=PIPE)
+    # stdout, stderr = p1.communicate()
+
+    # Without an output root pdftoppm writes the page to stdout, so the
+    # (large) uncropped bitmap is streamed to the next stage instead of
+    # going through a file
+    page = str(page or 1)
+    pdftoppm = ['pdftoppm', '-r', '120', '-f', page, '-l', page, pdfname]
+
+    if suite == 'PIL':
+        if Image is None:
+            raise TikzExtError('Error (tikz extension): tikz_proc_suite '
+                               '\'PIL\' requires the PIL (or Pillow) package')
+        ppmdata = pipe_tikz_commands(builder, [pdftoppm], tempdir)
+        if ppmdata is None:
+            return False
+        crop_tikz_image(ppmdata, outfn, builder.config.tikz_transparent)
+        return True
+
+    if suite == 'ImageMagick':
+        convert_args = []
+        if builder.config.tikz_transparent:
+            convert_args = ['-fuzz', '2%', '-transparent', 'white']
+        convert = ['convert', '-trim'] + convert_args + ['ppm:-',
+                                                         'png:' + outfn]
+        return pipe_tikz_commands(builder, [pdftoppm, convert],
+                                  tempdir) is not None
+
+    pnm_args = []
+    if builder.config.tikz_transparent:
+        pnm_args = ['-transparent', 'white']
+    pngdata = pipe_tikz_commands(builder, [pdftoppm, ['pnmcrop'],
+                                           ['pnmtopng'] + pnm_args], tempdir)
+    if pngdata is None:
+        return False
+    f = open(outfn,'wb')
+    f.write(pngdata)
+    f.close()
+    return True
+
+def pipe_tikz_commands(builder, commands, cwd):
+    """Run commands in cwd, each reading the stdout of the previous one
+
+    Returns the stdout of the last command, or None if a command cannot be
+    run, and raises TikzExtError if any of them fails.
+    """
+    procs = []
+    stdin = None
+    try:
+        for args in commands:
+            # stderr goes to files, as a pipe which is not read could block
+            # a command in the middle of the pipeline
+            errfile = tempfile.TemporaryFile()
+            try:
+                p = Popen(args, cwd=cwd, stdin=stdin, stdout=PIPE,
+                          stderr=errfile)
+            except OSError, err:
+                errfile.close()
+                if err.errno != ENOENT:   # No such file or directory
+                    raise
+                builder.warn('%s command cannot be run' % args[0])
+                builder.warn(str(err))
+                builder._tikz_warned = True
+                return None
+            if stdin is not None:
+                # let the previous command get SIGPIPE if this one exits
+                stdin.close()
+            procs.append((args[0], p, errfile))
+            stdin = p.stdout
+        stdout = procs[-1][1].communicate()[0]
+        for name, p, errfile in procs:
+            p.wait()
+        # report the last command which failed: when a command exits early,
+        # the ones before it fail with a broken pipe
+        for name, p, errfile in reversed(procs):
+            if p.returncode != 0:
+                errfile.seek(0)
+                raise TikzExtError('Error (tikz extension): %s exited with '
+                                   'error:\n[stderr]\n%s'
+                                   % (name, errfile.read()))
+        return stdout
+    finally:
+        for name, p, errfile in procs:
+            if p.returncode is None:
+                p.kill()
+                p.wait()
+            errfile.close()
+
+def crop_tikz_image(ppmdata, outfn, transparent):
+    """Trim the white border of a page bitmap and save it as png
+
+    This is done in memory by PIL, in place of pnmcrop and pnmtopng.
+    """
+    im = Image.open(BytesIO(ppmdata)).convert('RGB')
+    background = Image.new('RGB', im.size, (255, 255, 255))
+    bbox = ImageChops.difference(im, background).getbbox()
+    if bbox:
+        im = im.crop(bbox)
+    options = {}
+    if transparent:
+        options['transparency'] = (255, 255, 255)
+    im.save(outfn, 'PNG', **options)
+
+def render_tikz(self,tikz,libs='',stringsubst=False):
+    fname = get_tikz_fname(self.builder, tikz)
     relfn = posixpath.join(self.builder.imgpath, fname)
     outfn = path.join(self.builder.outdir, '_images', fname)
 
@@ -128,168 +343,115 @@ def render_tikz(self,tikz,libs='',stringsubst=False):
         return None
 
     ensuredir(path.dirname(outfn))
-    curdir = getcwd()
 
-    latex = DOC_HEAD % libs
-    latex += self.builder.config.tikz_latex_preamble
-    if stringsubst:
-        tikz = tikz % {'wd': curdir}
-    latex += DOC_BODY % tikz
-    if isinstance(latex, unicode):
-        latex = latex.encode('utf-8')
+    latex = get_tikz_latex(self.builder, tikz, libs, stringsubst)
+
+    cache = rendercache and rendercache.get_cache(self.builder)
+    if cache:
+        key = get_tikz_cache_key(cache, self.builder, latex)
+        if cache.fetch(key, outfn):
+            return relfn
 
     if not hasattr(self.builder, '_tikz_tempdir'):
         tempdir = self.builder._tikz_tempdir = tempfile.mkdtemp()
     else:
         tempdir = self.builder._tikz_tempdir
 
-    chdir(tempdir)
-
-    tf = open('tikz.tex', 'wb')
+    tf = open(path.join(tempdir, 'tikz.tex'), 'wb')
     tf.write(latex)
     tf.close()
 
     try:
-        try:
-            p = Popen(['pdflatex', '--interaction=nonstopmode', 'tikz.tex'],
-                      stdout=PIPE, stderr=PIPE)
-        except OSError, err:
-            if err.errno != ENOENT:   # No such file or directory
-                raise
-            self.builder.warn('LaTeX command cannot be run')
-            self.builder._tikz_warned = True
-            return None
-    finally:
-        chdir(curdir)
+        p = Popen(['pdflatex', '--interaction=nonstopmode', 'tikz.tex'],
+                  cwd=tempdir, stdout=PIPE, stderr=PIPE)
+    except OSError, err:
+        if err.errno != ENOENT:   # No such file or directory
+            raise
+        self.builder.warn('LaTeX command cannot be run')
+        self.builder._tikz_warned = True
+        return None
 
     stdout, stderr = p.communicate()
     if p.returncode != 0:
         raise TikzExtError('Error (tikz extension): latex exited with error:\n'
                            '[stderr]\n%s\n[stdout]\n%s' % (stderr, stdout))
 
-    chdir(tempdir)
-
-    # the following does not work for pdf patterns
-    # p1 = Popen(['convert', '-density', '120', '-colorspace', 'rgb',
-    #             '-trim', 'tikz.pdf', outfn], stdout=PIPE, stderr=PIPE)
-    # stdout, stderr = p1.communicate()
-
-    try:
-        p = Popen(['pdftoppm', '-r', '120', 'tikz.pdf', 'tikz'],
-                  stdout=PIPE, stderr=PIPE)
-    except OSError, e:
-        if e.errno != ENOENT:   # No such file or directory
-            raise
-        self.builder.warn('pdftoppm command cannot be run')
-        self.builder.warn(err)
-        self.builder._tikz_warned = True
-        chdir(curdir)
+    if not convert_tikz_page(self.builder, tempdir, 'tikz.pdf', None, outfn):
         return None
-    stdout, stderr = p.communicate()
-    if p.returncode != 0:
-        self.builder._tikz_warned = True
-        raise TikzExtError('Error (tikz extension): pdftoppm exited with error:'
-                           '\n[stderr]\n%s\n[stdout]\n%s' % (stderr, stdout))
-
-    if self.builder.config.tikz_proc_suite == 'ImageMagick':
-        convert_args = []
-        if self.builder.config.tikz_transparent:
-            convert_args = ['-fuzz', '2%', '-transparent', 'white']
-
-        try:
-            p1 = Popen(['convert', '-trim'] + convert_args +
-                       ['tikz-1.ppm', outfn],
-                       stdout=PIPE, stderr=PIPE)
-        except OSError, e:
-            if e.errno != ENOENT:   # No such file or directory
-                raise
-            self.builder.warn('convert command cannot be run')
-            self.builder.warn(err)
-            self.builder._tikz_warned = True
-            chdir(curdir)
-            return None
-        stdout, stderr = p1.communicate()
-        if p1.returncode != 0:
-            self.builder._tikz_warned = True
-            chdir(curdir)
-            raise TikzExtError('Error (tikz extension): convert exited with '
-                               'error:\n[stderr]\n%s\n[stdout]\n%s'
-                               % (stderr, stdout))
-
-    elif self.builder.config.tikz_proc_suite == 'pdf2svg':
-        try:
-            p1 = Popen(['pdf2svg', 'tikz.pdf', outfn],
-                       stdout=PIPE, stderr=PIPE)
-        except OSError, e:
-            if e.errno != ENOENT:   # No such file or directory
-                raise
-            self.builder.warn('pdf2svg command cannot be run')
-            self.builder.warn(err)
-            self.builder._tikz_warned = True
-            chdir(curdir)
-            return None
-        stdout, stderr = p1.communicate()
-        if p1.returncode != 0:
-            self.builder._tikz_warned = True
-            chdir(curdir)
-            raise TikzExtError('Error (tikz extension): pdf2svg exited with '
-                               'error:\n[stderr]\n%s\n[stdout]\n%s'
-                               % (stderr, stdout))
-
-    elif self.builder.config.tikz_proc_suite == 'Netpbm':
-        try:
-            p1 = Popen(['pnmcrop', 'tikz-1.ppm'], stdout=PIPE, stderr=PIPE)
-        except OSError, err:
-            if err.errno != ENOENT:   # No such file or directory
-                raise
-            self.builder.warn('pnmcrop command cannot be run:')
-            self.builder.warn(err)
-            self.builder._tikz_warned = True
-            chdir(curdir)
-            return None
-
-        pnm_args = []
-        if self.builder.config.tikz_transparent:
-            pnm_args = ['-transparent', 'white']
 
-        try:
-            p2 = Popen(['pnmtopng'] + pnm_args, stdin=p1.stdout,
-                       stdout=PIPE, stderr=PIPE)
-        except OSError, err:
-            if err.errno != ENOENT:   # No such file or directory
-                raise
-            self.builder.warn('pnmtopng command cannot be run:')
-            self.builder.warn(err)
-            self.builder._tikz_warned = True
-            chdir(curdir)
-            return None
-
-        pngdata, stderr2 = p2.communicate()
-        dummy, stderr1 = p1.communicate()
-        if p1.returncode != 0:
-            self.builder._tikz_warned = True
-            raise TikzExtError('Error (tikz extension): pnmcrop exited with '
-                               'error:\n[stderr]\n%s' % (stderr1))
-        if p2.returncode != 0:
-            self.builder._tikz_warned = True
-            raise TikzExtError('Error (tikz extension): pnmtopng exited with '
-                               'error:\n[stderr]\n%s' % (stderr2))
-        f = open(outfn,'wb')
-        f.write(pngdata)
-        f.close()
+    if cache:
+        cache.store(key, outfn)
+    return relfn
 
-    else:
-        self.builder._tikz_warned = True
-        chdir(curdir)
-        raise TikzExtError('Error (tikz extension): Invalid configuration '
-                           'value for tikz_proc_suite')
+def render_tikz_batch(builder, libs, jobs, pool=None):
+    """Render many pictures by one latex run
+
+    jobs is a list of (tikz, stringsubst, outfn) tuples. The pictures are
+    compiled as pages of one document, which are then converted one by one,
+    or all at once by the threads of pool if it is given.
+    """
+    latex = BATCH_DOC_HEAD % libs
+    latex += builder.config.tikz_latex_preamble
+    latex += '\n\\begin{document}\n'
+    for tikz, stringsubst, outfn in jobs:
+        latex += BATCH_DOC_PAGE % substitute_tikz(tikz, stringsubst)
+    latex += '\\end{document}\n'
+    if isinstance(latex, unicode):
+        latex = latex.encode('utf-8')
 
-    chdir(curdir)
-    return relfn
+    tempdir = tempfile.mkdtemp()
+    try:
+        tf = open(path.join(tempdir, 'batch.tex'), 'wb')
+        tf.write(latex)
+        tf.close()
+
+        args = ['pdflatex', '--interaction=nonstopmode', 'batch.tex']
+        stdout = run_tikz_command(builder, args, tempdir, 'LaTeX')
+        if stdout is None:
+            return
+        m = re.search(r'Output written on batch\.pdf \((\d+) pages?', stdout)
+        if not m or int(m.group(1)) != len(jobs):
+            raise TikzExtError('Error (tikz extension): latex generated %s '
+                               'pages, expected %d'
+                               % (m and m.group(1), len(jobs)))
+
+        pages = []
+        for page, (tikz, stringsubst, outfn) in enumerate(jobs):
+            ensuredir(path.dirname(outfn))
+            pages.append((builder, tempdir, 'batch.pdf', page + 1, outfn))
+        if pool is None:
+            converted = []
+            for page_args in pages:
+                converted.append(convert_tikz_page(*page_args))
+                if not converted[-1]:
+                    break
+        else:
+            results = [pool.apply_async(convert_tikz_page, page_args)
+                       for page_args in pages]
+            converted = []
+            error = None
+            # all pages have to be done before tempdir is removed
+            for result in results:
+                try:
+                    converted.append(result.get())
+                except Exception, exc:
+                    converted.append(False)
+                    error = error or exc
+            if error is not None:
+                raise error
+
+        cache = rendercache and rendercache.get_cache(builder)
+        if cache:
+            for (tikz, stringsubst, outfn), done in zip(jobs, converted):
+                if done:
+                    latex = get_tikz_latex(builder, tikz, libs, stringsubst)
+                    cache.store(get_tikz_cache_key(cache, builder, latex),
+                                outfn)
+    finally:
+        shutil.rmtree(tempdir, True)
 
 def html_visit_tikzinline(self,node):
-    libs = self.builder.config.tikz_tikzlibraries
-    libs = libs.replace(' ', '').replace('\t', '').strip(', ')
+    libs = get_tikz_libs(self.builder, node)
     try:
         fname = render_tikz(self,node['tikz'],libs);
     except TikzExtError, exc:
@@ -309,8 +471,7 @@ def html_visit_tikzinline(self,node):
         raise nodes.SkipNode
 
 def html_visit_tikz(self,node):
-    libs = self.builder.config.tikz_tikzlibraries + ',' + node['libs']
-    libs = libs.replace(' ', '').replace('\t', '').strip(', ')
+    libs = get_tikz_libs(self.builder, node)
 
     try:
         fname = render_tikz(self,node['tikz'],libs,node['stringsubst'])
@@ -375,6 +536,106 @@ def cleanup_tempdir(app, exc):
     except Exception:
         pass
 
+def collect_tikz_sources(app, doctree):
+    env = app.builder.env
+    if not hasattr(env, 'tikz_sources'):
+        env.tikz_sources = {}
+    sources = set()
+    for node in doctree.traverse(lambda n: isinstance(n, (tikz, tikzinline))):
+        sources.add((node['tikz'], get_tikz_libs(app.builder, node),
+                     node.get('stringsubst', False)))
+    if sources:
+        env.tikz_sources[env.docname] = sources
+    else:
+        env.tikz_sources.pop(env.docname, None)
+
+def purge_tikz_sources(app, env, docname):
+    if not hasattr(env, 'tikz_sources'):
+        return
+    env.tikz_sources.pop(docname, None)
+
+def merge_tikz_sources(app, env, docnames, other):
+    if not hasattr(other, 'tikz_sources'):
+        return
+    if not hasattr(env, 'tikz_sources'):
+        env.tikz_sources = {}
+    for docname in docnames:
+        if docname in other.tikz_sources:
+            env.tikz_sources[docname] = other.tikz_sources[docname]
+
+def prerender_tikz(app, env):
+    """Render missing pictures of all documents before writing
+
+    The pictures are grouped by libraries and compiled in batches of
+    tikz_batch_size pages, running up to tikz_batch_workers latex processes
+    in parallel. Pictures failed to be rendered here are left to the
+    visitors, which report errors as usual.
+    """
+    batchsize = app.config.tikz_batch_size
+    builder = app.builder
+    if (not batchsize or builder.format != 'html'
+        or not getattr(env, 'tikz_sources', None)):
+        return
+    cache = rendercache and rendercache.get_cache(builder)
+
+    # {libs: {outfn: (tikz, stringsubst), ...}, ...}
+    pending = {}
+    for sources in env.tikz_sources.values():
+        for tikz, libs, stringsubst in sources:
+            outfn = path.join(builder.outdir, '_images',
+                              get_tikz_fname(builder, tikz))
+            if path.isfile(outfn):
+                continue
+            if cache:
+                latex = get_tikz_latex(builder, tikz, libs, stringsubst)
+                if cache.fetch(get_tikz_cache_key(cache, builder, latex),
+                               outfn):
+                    continue
+            pending.setdefault(libs, {})[outfn] = (tikz, stringsubst)
+
+    batches = []
+    for libs, pictures in sorted(pending.items()):
+        jobs = sorted((tikz, stringsubst, outfn)
+                      for outfn, (tikz, stringsubst) in pictures.items())
+        for i in range(0, len(jobs), batchsize):
+            batches.append((libs, jobs[i:i + batchsize]))
+    if not batches:
+        return
+
+    def render(batch):
+        libs, jobs = batch
+        if hasattr(builder, '_tikz_warned'):
+            return
+        try:
+            render_tikz_batch(builder, libs, jobs, page_pool)
+        except TikzExtError, exc:
+            if hasattr(builder, '_tikz_warned'):
+                builder.warn(str(exc))
+            else:
+                app.verbose('tikz batch rendering failed: %s' % exc)
+
+    workers = app.config.tikz_batch_workers
+    if not workers:
+        try:
+            workers = multiprocessing.cpu_count()
+        except NotImplementedError:
+            workers = 1
+    app.info('rendering %d tikz pictures... '
+             % sum(len(jobs) for _libs, jobs in batches), nonl=True)
+    # the pages of a batch are converted by a pool of their own, as the
+    # batches wait for them
+    page_pool = workers > 1 and ThreadPool(workers) or None
+    pool = ThreadPool(min(workers, len(batches)))
+    try:
+        pool.map(render, batches)
+    finally:
+        pool.close()
+        pool.join()
+        if page_pool is not None:
+            page_pool.close()
+            page_pool.join()
+    app.info('done')
+
 def which(program):
     import os
     def is_exe(fpath):
@@ -413,4 +674,11 @@ def setup(app):
         if not which('pnmcrop'):
             suite = 'ImageMagick'
     app.add_config_value('tikz_proc_suite', suite, 'html')
+    app.add_config_value('tikz_batch_size', 0, '')
+    app.add_config_value('tikz_batch_workers', None, '')
+    app.connect('doctree-read', collect_tikz_sources)
+    app.connect('env-purge-doc', purge_tikz_sources)
+    if sphinx.version_info >= (1, 3):
+        app.connect('env-merge-info', merge_tikz_sources)
+    app.connect('env-updated', prerender_tikz)
     app.connect('build-finished', cleanup_tempdir)
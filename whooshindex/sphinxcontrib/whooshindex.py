@@ -10,6 +10,14 @@
 """
 
 import os
+import re
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+from HTMLParser import HTMLParser
+from multiprocessing import cpu_count
 
 from sphinx.util import SEP
 from sphinx.builders.html import StandaloneHTMLBuilder
@@ -18,13 +26,99 @@ import whoosh.index
 import whoosh.fields
 import whoosh.analysis
 
+lines_re = re.compile(r'\s*\n\s*')
+
+class TextExtractor(HTMLParser):
+    """
+    Collects the text of a page body, and separately the text of its
+    headings and code. The markup, the permalink anchors after the headings
+    and any scripts or styles are dropped.
+    """
+    heading_tags = set(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
+    code_tags = set(['pre', 'code', 'tt'])
+    skipped_tags = set(['script', 'style'])
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.body = []
+        self.headings = []
+        self.code = []
+        # the open elements, with a flag telling whether they are skipped
+        self.stack = []
+        self.in_heading = self.in_code = self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        classes = (dict(attrs).get('class') or '').split()
+        skip = tag in self.skipped_tags or \
+               (tag == 'a' and 'headerlink' in classes)
+        self.stack.append((tag, skip))
+        self._count(tag, skip, 1)
+        if tag == 'br':
+            self._add(u'\n')
+
+    def handle_endtag(self, tag):
+        # close unclosed elements too, such as <p> in sloppy markup
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i][0] == tag:
+                while len(self.stack) > i:
+                    self._count(*self.stack.pop() + (-1,))
+                break
+        if tag in self.heading_tags or tag in ('p', 'div', 'li', 'dt', 'dd',
+                                               'tr', 'pre'):
+            self._add(u'\n')
+
+    def _count(self, tag, skip, delta):
+        # keep the text of separate headings and code apart
+        if tag in self.heading_tags:
+            self.in_heading += delta
+            self.headings.append(u'\n')
+        if tag in self.code_tags:
+            self.in_code += delta
+            self.code.append(u'\n')
+        if skip:
+            self.skipping += delta
+
+    def handle_data(self, data):
+        self._add(data)
+
+    def handle_entityref(self, name):
+        self._add(self.unescape('&%s;' % name))
+
+    def handle_charref(self, name):
+        self._add(self.unescape('&#%s;' % name))
+
+    def _add(self, text):
+        if self.skipping:
+            return
+        self.body.append(text)
+        if self.in_heading:
+            self.headings.append(text)
+        if self.in_code:
+            self.code.append(text)
+
+def extract_text(html):
+    """
+    Return the text of the HTML page body, its headings and its code.
+    """
+    extractor = TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return tuple(lines_re.sub(u'\n', u''.join(parts)).strip()
+                 for parts in (extractor.body, extractor.headings,
+                               extractor.code))
+
 class WhooshBuilder(StandaloneHTMLBuilder):
     """
     Builds Whoosh index.
 
+    With ``whoosh_incremental`` set, an existing index is updated: only the
+    documents which are not in the index yet or were read again are
+    rendered, a page is only written to the index if its content changed,
+    and the pages of removed documents are deleted.
     """
     name = "whoosh"
     format = "whoosh"
+    search = False # no searchindex.js
 
     def init(self):
         self.config_hash = ''
@@ -35,11 +129,60 @@ class WhooshBuilder(StandaloneHTMLBuilder):
         self.init_highlighter()
 
         self.schema = whoosh.fields.Schema(
-            name=whoosh.fields.ID(stored=True),
+            name=whoosh.fields.ID(stored=True, unique=True),
             title=whoosh.fields.TEXT(stored=True),
-            body=whoosh.fields.TEXT(analyzer=whoosh.analysis.StemmingAnalyzer()))
-        self.index = whoosh.index.create_in(self.outdir, self.schema)
-        self.writer = self.index.writer()
+            body=whoosh.fields.TEXT(analyzer=whoosh.analysis.StemmingAnalyzer(),
+                                    stored=True),
+            headings=whoosh.fields.TEXT(
+                analyzer=whoosh.analysis.StemmingAnalyzer(), field_boost=2.0),
+            code=whoosh.fields.TEXT(
+                analyzer=whoosh.analysis.SimpleAnalyzer(), field_boost=1.5),
+            digest=whoosh.fields.ID(stored=True))
+        self.index = None
+        if self.config.whoosh_incremental and \
+               whoosh.index.exists_in(self.outdir):
+            index = whoosh.index.open_dir(self.outdir)
+            if index.schema == self.schema:
+                self.index = index
+        if self.index is None:
+            self.index = whoosh.index.create_in(self.outdir, self.schema)
+        # name -> digest of the indexed pages
+        self.digests = {}
+        searcher = self.index.searcher()
+        try:
+            for fields in searcher.all_stored_fields():
+                self.digests[fields['name']] = fields.get('digest')
+        finally:
+            searcher.close()
+        self.writer = None
+
+    def prepare_writing(self, docnames):
+        StandaloneHTMLBuilder.prepare_writing(self, docnames)
+        # A multisegment writer never merges segments, so it only pays off
+        # when most of the pages are written, otherwise the segments of
+        # successive builds would pile up.
+        if len(docnames) * 2 >= len(self.digests):
+            self.open_writer(self.config.whoosh_procs or cpu_count())
+        else:
+            self.open_writer(1)
+
+    def open_writer(self, procs):
+        if self.writer is not None:
+            return
+        if procs > 1:
+            # each process writes a segment of its own
+            self.writer = self.index.writer(
+                procs=procs, multisegment=True,
+                limitmb=self.config.whoosh_limitmb)
+        else:
+            self.writer = self.index.writer(
+                limitmb=self.config.whoosh_limitmb)
+
+    def get_outdated_docs(self):
+        # documents read again are added by the environment update
+        for docname in self.env.found_docs:
+            if docname not in self.digests:
+                yield docname
 
     def get_target_uri(self, docname, typ=None):
         if docname == 'index':
@@ -58,15 +201,37 @@ class WhooshBuilder(StandaloneHTMLBuilder):
         self.app.emit('html-page-context', pagename, templatename,
                       ctx, event_arg)
 
-        # Push to index
-        self.writer.add_document(name=unicode(ctx['current_page_name']),
-                                 title=unicode(ctx.get('title', '')),
-                                 body=unicode(ctx.get('body', '')))
+        # Push to index, unless the page is unchanged
+        name = unicode(ctx['current_page_name'])
+        title = unicode(ctx.get('title', ''))
+        body = unicode(ctx.get('body', ''))
+        digest = unicode(md5(title.encode('utf-8') + '\0' +
+                             body.encode('utf-8')).hexdigest())
+        if self.digests.get(name) == digest:
+            return
+        text, headings, code = extract_text(body)
+        self.writer.update_document(name=name, title=title, body=text,
+                                    headings=headings, code=code,
+                                    digest=digest)
+        self.digests[name] = digest
 
     def finish(self):
+        self.open_writer(1)
+        # drop the pages of removed documents
+        for name in list(self.digests):
+            if name not in self.env.all_docs:
+                self.writer.delete_by_term('name', name)
+                del self.digests[name]
         self.writer.commit()
+        if self.config.whoosh_optimize:
+            # merge all segments, also those the processes wrote
+            self.index.optimize()
 
 
 def setup(app):
     app.add_builder(WhooshBuilder)
+    app.add_config_value('whoosh_incremental', True, '')
+    app.add_config_value('whoosh_procs', 0, '')
+    app.add_config_value('whoosh_limitmb', 128, '')
+    app.add_config_value('whoosh_optimize', False, '')
 
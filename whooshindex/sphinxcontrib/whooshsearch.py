@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+    sphinxcontrib.whooshsearch
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Search service for the index built by the Whoosh builder, as a WSGI
+    application. Run it locally with::
+
+        python -m sphinxcontrib.whooshsearch _build/whoosh
+
+    :copyright: Copyright 2009 Pauli Virtanen
+    :license: BSD, see LICENSE for details.
+"""
+
+import re
+import sys
+import time
+import threading
+import Queue
+from cgi import parse_qs
+from collections import deque
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import whoosh.index
+import whoosh.highlight
+from whoosh.qparser import MultifieldParser
+
+SEARCH_FIELDS = ('title', 'headings', 'body', 'code')
+
+callback_re = re.compile(r'^[A-Za-z_$][\w$.]*$')
+
+
+class Metrics(object):
+    """
+    Counts the queries and keeps the latencies of the recent ones.
+    """
+
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.cache_hits = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.recent = deque(maxlen=window)
+
+    def record(self, seconds, cache_hit=False):
+        self.lock.acquire()
+        try:
+            self.queries += 1
+            if cache_hit:
+                self.cache_hits += 1
+            self.total_time += seconds
+            self.max_time = max(self.max_time, seconds)
+            self.recent.append(seconds)
+        finally:
+            self.lock.release()
+
+    def error(self):
+        self.lock.acquire()
+        try:
+            self.errors += 1
+        finally:
+            self.lock.release()
+
+    def report(self):
+        """
+        Return the counters and the latencies in milliseconds, the
+        percentiles over the recent queries.
+        """
+        self.lock.acquire()
+        try:
+            recent = sorted(self.recent)
+            report = {
+                'queries': self.queries,
+                'cache_hits': self.cache_hits,
+                'errors': self.errors,
+                'mean_ms': self.queries and
+                           1000.0 * self.total_time / self.queries,
+                'max_ms': 1000.0 * self.max_time,
+            }
+        finally:
+            self.lock.release()
+        for percentile in (50, 90, 99):
+            key = 'p%d_ms' % percentile
+            if recent:
+                i = min(len(recent) - 1, len(recent) * percentile // 100)
+                report[key] = 1000.0 * recent[i]
+            else:
+                report[key] = 0.0
+        return report
+
+
+class SearchApp(object):
+    """
+    WSGI application answering queries against a Whoosh index.
+
+    The index is opened once. Searchers are taken from a pool of at most
+    *pool_size* idle ones, and the results of the last *cache_size* queries
+    are kept; both are dropped when the index is built again. Two paths are
+    served, both answering with JSON (JSONP if a ``callback`` is given):
+
+    ``/search?q=<query>&page=<number>``
+        The hits on the page, *page_size* of them, with the stored title and
+        highlighted fragments of the body.
+    ``/metrics``
+        The query counters and latencies.
+    """
+
+    def __init__(self, indexdir, pool_size=4, cache_size=256, page_size=10,
+                 fields=SEARCH_FIELDS):
+        self.index = whoosh.index.open_dir(indexdir)
+        self.generation = self.index.latest_generation()
+        self.fields = [name for name in fields if name in self.index.schema]
+        self.parser = MultifieldParser(self.fields, self.index.schema)
+        self.pool = Queue.Queue(pool_size)
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        self.metrics = Metrics()
+
+    def _check_index(self):
+        # drop the searchers and results of an index built again
+        generation = self.index.latest_generation()
+        if generation == self.generation:
+            return
+        self.lock.acquire()
+        try:
+            self.cache.clear()
+            self.generation = generation
+        finally:
+            self.lock.release()
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except Queue.Empty:
+                break
+
+    def _get_searcher(self):
+        try:
+            searcher = self.pool.get_nowait()
+        except Queue.Empty:
+            return self.index.searcher()
+        return searcher.refresh()
+
+    def _put_searcher(self, searcher):
+        try:
+            self.pool.put_nowait(searcher)
+        except Queue.Full:
+            searcher.close()
+
+    def search(self, querystring, page=1):
+        """
+        Return the result page of the query as a dict.
+        """
+        start = time.time()
+        self._check_index()
+        self.lock.acquire()
+        try:
+            # the generation is taken before the searcher, which is at least
+            # as new, so results of searches running while the index is
+            # built again are kept under the old one and never served
+            key = (self.generation, querystring, page)
+            result = self.cache.get(key)
+            if result is not None:
+                del self.cache[key]
+                self.cache[key] = result
+        finally:
+            self.lock.release()
+        if result is not None:
+            self.metrics.record(time.time() - start, cache_hit=True)
+            return result
+
+        query = self.parser.parse(querystring)
+        searcher = self._get_searcher()
+        try:
+            results = searcher.search_page(query, page,
+                                           pagelen=self.page_size)
+            results.results.fragmenter = whoosh.highlight.ContextFragmenter()
+            hits = []
+            for hit in results:
+                fields = hit.fields()
+                highlights = u''
+                if 'body' in fields:
+                    highlights = hit.highlights('body')
+                hits.append({'name': fields.get('name'),
+                             'title': fields.get('title'),
+                             'score': hit.score,
+                             'highlights': highlights})
+            result = {'query': querystring,
+                      'total': len(results),
+                      'page': results.pagenum,
+                      'pages': results.pagecount,
+                      'hits': hits}
+        finally:
+            self._put_searcher(searcher)
+
+        self.lock.acquire()
+        try:
+            self.cache[key] = result
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        finally:
+            self.lock.release()
+        self.metrics.record(time.time() - start)
+        return result
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '/').rstrip('/')
+        args = parse_qs(environ.get('QUERY_STRING', ''))
+        status = '200 OK'
+        if path == '/search':
+            querystring = args.get('q', [''])[0].decode('utf-8', 'replace')
+            try:
+                page = max(1, int(args.get('page', ['1'])[0]))
+                data = self.search(querystring, page)
+            except Exception, exc:
+                self.metrics.error()
+                status = '400 Bad Request'
+                data = {'error': unicode(exc)}
+        elif path == '/metrics':
+            data = self.metrics.report()
+        else:
+            status = '404 Not Found'
+            data = {'error': 'not found'}
+
+        body = json.dumps(data)
+        content_type = 'application/json'
+        callback = args.get('callback', [None])[0]
+        if callback and callback_re.match(callback):
+            body = '%s(%s);' % (callback, body)
+            content_type = 'application/javascript'
+        start_response(status, [('Content-Type', content_type),
+                                ('Content-Length', str(len(body)))])
+        return [body]
+
+
+def main(argv=None):
+    from optparse import OptionParser
+    from wsgiref.simple_server import make_server
+
+    parser = OptionParser(usage='%prog [options] INDEXDIR')
+    parser.add_option('--host', default='localhost',
+                      help='interface to listen on [%default]')
+    parser.add_option('--port', type='int', default=8000,
+                      help='port to listen on [%default]')
+    parser.add_option('--pool-size', type='int', default=4,
+                      help='number of idle searchers kept [%default]')
+    parser.add_option('--cache-size', type='int', default=256,
+                      help='number of query results kept [%default]')
+    parser.add_option('--page-size', type='int', default=10,
+                      help='number of hits per page [%default]')
+    options, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error('the index directory is required')
+
+    app = SearchApp(args[0], pool_size=options.pool_size,
+                    cache_size=options.cache_size,
+                    page_size=options.page_size)
+    server = make_server(options.host, options.port, app)
+    sys.stderr.write('Serving %s on http://%s:%d/search?q=...\n'
+                     % (args[0], options.host, options.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
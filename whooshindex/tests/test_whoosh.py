@@ -0,0 +1,136 @@
+import os, shutil, tempfile, json
+
+from mock import patch
+from nose.tools import *
+from sphinx.application import Sphinx
+
+import whoosh.index
+
+from sphinxcontrib import whooshindex
+from sphinxcontrib.whooshindex import extract_text
+from sphinxcontrib.whooshsearch import SearchApp
+
+def setup():
+    global _tempdir, _srcdir, _outdir
+    _tempdir = tempfile.mkdtemp()
+    _srcdir = os.path.join(_tempdir, 'src')
+    _outdir = os.path.join(_tempdir, 'whoosh')
+    os.makedirs(_srcdir)
+    os.makedirs(_outdir)
+    writefile('conf.py', "extensions = ['sphinxcontrib.whooshindex']\n"
+                         "master_doc = 'index'\n")
+    writefile('index.rst', 'Index\n=====\n\nThe front page.\n')
+    writefile('apples.rst', ':orphan:\n\nApples\n======\n\n'
+                            'Apples grow on trees.\n')
+    writefile('pears.rst', ':orphan:\n\nPears\n=====\n\n'
+                           'Pears ripen slowly.\n\n'
+                           '.. code-block:: python\n\n'
+                           '   harvest_pears()\n')
+
+def teardown():
+    shutil.rmtree(_tempdir)
+
+def writefile(fname, content):
+    f = open(os.path.join(_srcdir, fname), 'wb')
+    try:
+        f.write(content)
+    finally:
+        f.close()
+
+def build():
+    app = Sphinx(_srcdir, _srcdir, _outdir,
+                 os.path.join(_tempdir, 'doctrees'), 'whoosh',
+                 status=None, warning=None)
+    app.build()
+    return app
+
+def indexed():
+    index = whoosh.index.open_dir(_outdir)
+    searcher = index.searcher()
+    try:
+        return dict((fields['name'], fields)
+                    for fields in searcher.all_stored_fields())
+    finally:
+        searcher.close()
+
+def call(app, query):
+    responses = []
+    def start_response(status, headers):
+        responses.append((status, dict(headers)))
+    body = ''.join(app({'PATH_INFO': '/search', 'QUERY_STRING': query},
+                       start_response))
+    return responses[0][0], responses[0][1]['Content-Type'], body
+
+def test_extract_text():
+    body, headings, code = extract_text(
+        u'<h1>Title<a class="headerlink" href="#t">\xb6</a></h1>'
+        u'<p>Some &amp; text<br/>more</p>'
+        u'<script>var x;</script>'
+        u'<div class="highlight"><pre>run()</pre></div>'
+        u'<h2>Sub</h2><p>Use <tt>call()</tt> here')
+    assert_equals(body, u'Title\nSome & text\nmore\nrun()\nSub\n'
+                        u'Use call() here')
+    assert_equals(headings, u'Title\nSub')
+    assert_equals(code, u'run()\ncall()')
+
+def test_incremental_build():
+    build()
+    pages = indexed()
+    assert u'apples' in pages and u'pears' in pages
+    digest = pages[u'apples']['digest']
+
+    # a document read again with the same content is not written again
+    os.utime(os.path.join(_srcdir, 'apples.rst'), None)
+    with patch.object(whooshindex, 'extract_text',
+                      wraps=extract_text) as extract:
+        build()
+        assert_equals(extract.call_count, 0)
+    assert_equals(indexed()[u'apples']['digest'], digest)
+
+    # a changed document is, and the pages of removed ones are deleted
+    writefile('apples.rst', ':orphan:\n\nApples\n======\n\n'
+                            'Apples fall from trees.\n')
+    os.unlink(os.path.join(_srcdir, 'pears.rst'))
+    with patch.object(whooshindex, 'extract_text',
+                      wraps=extract_text) as extract:
+        build()
+        assert_equals(extract.call_count, 1)
+    pages = indexed()
+    assert u'pears' not in pages
+    assert pages[u'apples']['digest'] != digest
+    assert u'fall' in pages[u'apples']['body']
+
+def test_search_app():
+    build()
+    app = SearchApp(_outdir)
+    result = app.search(u'trees')
+    assert_equals([hit['name'] for hit in result['hits']], [u'apples'])
+    assert_equals(result['total'], 1)
+    assert app.search(u'trees') is result
+    assert_equals(app.metrics.report()['cache_hits'], 1)
+
+    # results are kept by the generation of the index
+    assert_equals(list(app.cache), [(app.generation, u'trees', 1)])
+    generation = app.generation
+    writefile('oaks.rst', ':orphan:\n\nOaks\n====\n\nOaks are trees.\n')
+    build()
+    app._check_index()
+    assert app.generation != generation
+    # a search of the old index finishing after the cache was dropped
+    app.cache[(generation, u'trees', 1)] = result
+    new_result = app.search(u'trees')
+    assert_equals(sorted(hit['name'] for hit in new_result['hits']),
+                  [u'apples', u'oaks'])
+    assert (app.generation, u'trees', 1) in app.cache
+
+def test_search_app_wsgi():
+    app = SearchApp(_outdir)
+    status, content_type, body = call(app, 'q=trees&callback=show')
+    assert_equals(status, '200 OK')
+    assert_equals(content_type, 'application/javascript')
+    assert body.startswith('show(') and body.endswith(');')
+    assert_equals(json.loads(body[5:-2])['query'], u'trees')
+
+    status, content_type, body = call(app, 'q=trees&page=x')
+    assert_equals(status, '400 Bad Request')
+    assert_equals(app.metrics.report()['errors'], 1)